@@ -0,0 +1,290 @@
+import hashlib
+import os
+import re
+import tempfile
+import time
+from datetime import datetime, timedelta
+import click
+from flask import current_app, request
+from flask.cli import with_appcontext
+from sqlalchemy import case, delete, func, select, update
+from werkzeug.utils import send_file
+from main_app import db
+from database import upsert
+from models import Blob, Document, XBRLReport
+
+# Store settings; each can be overridden in app.config
+BLOB_DEFAULTS = {
+    'BLOB_CHUNK_SIZE': 1024 * 1024,  # bytes read, hashed and written per step of an upload
+    'BLOB_GC_GRACE': 3600,           # seconds an unreferenced file is kept before garbage collection
+    'BLOB_CACHE_MAX_AGE': 31536000,  # seconds browsers may keep a file fetched through a versioned (?v=) URL
+    'BLOB_X_ACCEL_PREFIX': None,     # internal nginx location aliased to uploads/; enables X-Accel-Redirect
+}
+
+# Files live at uploads/blobs/<first two hex digits>/<sha256><ext>; the path
+# stored on Document.file_path / XBRLReport.xbrl_file_path is that relative path,
+# so send_file() and the download name keep working unchanged.
+BLOB_DIR = os.path.join('uploads', 'blobs')
+_BLOB_PATH = re.compile(r'^uploads/blobs/[0-9a-f]{2}/([0-9a-f]{64})(\.[a-z0-9]{1,9})?$')
+
+# Columns that hold upload paths; a blob's reference count is the number of rows pointing at it
+REFERENCES = ((Document, Document.file_path), (XBRLReport, XBRLReport.xbrl_file_path))
+
+
+def _setting(key):
+    return current_app.config.get(key, BLOB_DEFAULTS[key])
+
+
+def blob_path(sha256, extension=''):
+    """Relative path of the file holding the given content"""
+    return os.path.join(BLOB_DIR, sha256[:2], sha256 + extension)
+
+
+def parse_blob_path(path):
+    """(sha256, extension) for a blob store path, or None for legacy uploads"""
+    match = _BLOB_PATH.match((path or '').replace(os.sep, '/'))
+    return (match.group(1), match.group(2) or '') if match else None
+
+
+def _absolute(relative_path):
+    return os.path.join(current_app.root_path, relative_path)
+
+
+def content_version(path):
+    """Short content hash for cache-busting URLs, or None for legacy uploads"""
+    parsed = parse_blob_path(path)
+    return parsed[0][:16] if parsed else None
+
+
+def _acquire(sha256, extension, size):
+    """Insert the blob row if new and take a reference to it, in the caller's transaction"""
+    stmt = upsert(Blob, db.session.get_bind().dialect.name, ['sha256', 'extension'])
+    row = {'sha256': sha256, 'extension': extension, 'size': size, 'ref_count': 0,
+           'created_at': datetime.utcnow()}
+    if stmt is not None:
+        db.session.execute(stmt, [row])
+    elif not db.session.execute(select(Blob.id).filter_by(sha256=sha256, extension=extension)).first():
+        db.session.execute(Blob.__table__.insert(), [row])
+    db.session.execute(
+        update(Blob)
+        .where(Blob.sha256 == sha256, Blob.extension == extension)
+        .values(ref_count=Blob.ref_count + 1, released_at=None)
+    )
+
+
+def store(stream, extension=''):
+    """Save an upload stream in the blob store; returns (relative path, size).
+
+    The stream is copied to a temporary file in chunks while it is hashed, so
+    the content is read once and never held in memory. If the same content
+    is already stored the copy is dropped and the existing file is shared.
+    Takes a reference to the blob in the current transaction; the caller
+    commits along with the row that stores the path.
+    """
+    extension = extension.lower()
+    chunk_size = _setting('BLOB_CHUNK_SIZE')
+    tmp_dir = _absolute(os.path.join(BLOB_DIR, 'tmp'))
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    digest = hashlib.sha256()
+    size = 0
+    with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as tmp:
+        try:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                tmp.write(chunk)
+                size += len(chunk)
+        except BaseException:
+            tmp.close()
+            os.unlink(tmp.name)
+            raise
+
+    sha256 = digest.hexdigest()
+    relative_path = blob_path(sha256, extension)
+    _acquire(sha256, extension, size)
+
+    target = _absolute(relative_path)
+    if os.path.exists(target):
+        os.unlink(tmp.name)
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(tmp.name, target)
+    return relative_path, size
+
+
+def release(path):
+    """Drop one reference to a stored file; returns False for paths outside the blob store.
+
+    The file itself is removed later by collect_garbage(), once it has gone
+    unreferenced for the grace period, so a rolled-back transaction never
+    loses content.
+    """
+    parsed = parse_blob_path(path)
+    if parsed is None:
+        return False
+    sha256, extension = parsed
+    db.session.execute(
+        update(Blob)
+        .where(Blob.sha256 == sha256, Blob.extension == extension, Blob.ref_count > 0)
+        .values(
+            ref_count=Blob.ref_count - 1,
+            released_at=case((Blob.ref_count <= 1, datetime.utcnow()), else_=Blob.released_at),
+        )
+    )
+    return True
+
+
+def send_stored_file(path, download_name=None, as_attachment=False):
+    """Response serving a stored upload, or None if the file is missing.
+
+    Blob store files get a strong ETag (their SHA-256), so repeat requests
+    are answered with 304 and byte ranges can be resumed safely with
+    If-Range; legacy uploads fall back to an mtime/size ETag. A request
+    carrying the file's current ?v=<content_version> may be cached for
+    BLOB_CACHE_MAX_AGE, since that URL changes whenever the content does;
+    any other URL is revalidated on each use.
+
+    With BLOB_X_ACCEL_PREFIX set (e.g. '/_uploads/', served by an nginx
+    `internal` location aliased to the uploads directory) the body, including
+    range requests, is left to nginx via X-Accel-Redirect, so app workers
+    only answer the headers. Flask's USE_X_SENDFILE is honoured likewise.
+    """
+    full_path = _absolute(path)
+    if not os.path.isfile(full_path):
+        return None
+
+    parsed = parse_blob_path(path)
+    accel_prefix = _setting('BLOB_X_ACCEL_PREFIX')
+    response = send_file(
+        full_path, request.environ,
+        download_name=download_name,
+        as_attachment=as_attachment,
+        etag=parsed[0] if parsed else True,
+        # nginx handles ranges itself after the redirect, so only answer 304s here
+        conditional=not accel_prefix,
+        use_x_sendfile=bool(accel_prefix) or current_app.config.get('USE_X_SENDFILE', False),
+        response_class=current_app.response_class,
+    )
+
+    version = request.args.get('v')
+    if parsed and version and version == content_version(path):
+        response.headers['Cache-Control'] = f"private, max-age={_setting('BLOB_CACHE_MAX_AGE')}, immutable"
+    else:
+        response.headers['Cache-Control'] = 'private, no-cache'
+
+    if accel_prefix:
+        response.headers.pop('X-Sendfile', None)
+        response = response.make_conditional(request.environ)
+        if response.status_code != 304:
+            relative = os.path.relpath(full_path, _absolute('uploads')).replace(os.sep, '/')
+            response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + relative
+    return response
+
+
+def recount_references():
+    """Rebuild every blob's ref_count from the rows that point at it; returns the number corrected"""
+    counts = {}
+    for _, column in REFERENCES:
+        for path, count in db.session.execute(
+            select(column, func.count()).where(column.like(BLOB_DIR.replace(os.sep, '/') + '/%')).group_by(column)
+        ):
+            parsed = parse_blob_path(path)
+            if parsed:
+                counts[parsed] = counts.get(parsed, 0) + count
+
+    corrected = 0
+    now = datetime.utcnow()
+    for blob in db.session.execute(select(Blob)).scalars():
+        actual = counts.get((blob.sha256, blob.extension), 0)
+        if blob.ref_count != actual:
+            if actual == 0:
+                blob.released_at = now
+            blob.ref_count = actual
+            corrected += 1
+    db.session.commit()
+    return corrected
+
+
+def _referenced_paths():
+    paths = set()
+    for _, column in REFERENCES:
+        paths.update(os.path.normpath(p) for p in db.session.scalars(select(column).where(column.isnot(None))))
+    return paths
+
+
+def collect_garbage(grace=None, include_legacy=False):
+    """Delete files nothing refers to any more; returns {'blobs': n, 'strays': n, 'legacy': n, 'bytes': n}.
+
+    - blobs whose ref_count has been 0 for longer than `grace` seconds
+    - files in the blob directory without a row (uploads whose transaction
+      was rolled back, interrupted temporary files)
+    - with `include_legacy`, files saved under uploads/ before the blob store
+      that no document or report points at any more
+    """
+    grace = _setting('BLOB_GC_GRACE') if grace is None else grace
+    cutoff = datetime.utcnow() - timedelta(seconds=grace)
+    stats = {'blobs': 0, 'strays': 0, 'legacy': 0, 'bytes': 0}
+
+    def remove(relative_path, kind):
+        try:
+            size = os.path.getsize(_absolute(relative_path))
+            os.unlink(_absolute(relative_path))
+        except FileNotFoundError:
+            return
+        stats[kind] += 1
+        stats['bytes'] += size
+
+    released = db.session.execute(
+        select(Blob.id, Blob.sha256, Blob.extension).where(Blob.ref_count <= 0, Blob.released_at < cutoff)
+    ).all()
+    for blob in released:
+        # Guarded so a blob re-uploaded since the select keeps its row. The file goes
+        # before the commit: until then the deleted row stays locked, so a store() of
+        # the same content waits and then writes a fresh copy instead of keeping this one.
+        deleted = db.session.execute(
+            delete(Blob).where(Blob.id == blob.id, Blob.ref_count <= 0)
+        ).rowcount
+        if deleted:
+            remove(blob_path(blob.sha256, blob.extension), 'blobs')
+        db.session.commit()
+
+    known = {(sha256, extension) for sha256, extension in db.session.execute(select(Blob.sha256, Blob.extension))}
+    oldest = time.time() - grace
+    root = _absolute(BLOB_DIR)
+    for directory, _, files in os.walk(root):
+        for name in files:
+            relative_path = os.path.relpath(os.path.join(directory, name), current_app.root_path)
+            parsed = parse_blob_path(relative_path)
+            if parsed in known or os.path.getmtime(os.path.join(directory, name)) > oldest:
+                continue
+            remove(relative_path, 'strays')
+
+    if include_legacy:
+        referenced = _referenced_paths()
+        for directory, subdirs, files in os.walk(_absolute('uploads')):
+            subdirs[:] = [d for d in subdirs if os.path.join(directory, d) != root]
+            for name in files:
+                full_path = os.path.join(directory, name)
+                relative_path = os.path.relpath(full_path, current_app.root_path)
+                if relative_path in referenced or os.path.getmtime(full_path) > oldest:
+                    continue
+                remove(relative_path, 'legacy')
+    return stats
+
+
+@click.command('blobs-gc')
+@click.option('--grace', type=int, default=None,
+              help='Seconds a file must have been unreferenced before removal (default BLOB_GC_GRACE).')
+@click.option('--recount', is_flag=True, help='Rebuild reference counts from documents and XBRL reports first.')
+@click.option('--include-legacy', is_flag=True, help='Also remove unreferenced files saved before the blob store.')
+@with_appcontext
+def blobs_gc_command(grace, recount, include_legacy):
+    """Remove uploaded files that no document or report refers to."""
+    if recount:
+        click.echo(f"Reference counts corrected: {recount_references()}")
+    stats = collect_garbage(grace, include_legacy)
+    click.echo(f"Removed {stats['blobs']} released blob(s), {stats['strays']} stray file(s) and "
+               f"{stats['legacy']} legacy file(s), freeing {stats['bytes']:,} bytes.")
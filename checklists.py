@@ -0,0 +1,140 @@
+import json
+import logging
+from datetime import date, datetime
+from sqlalchemy import and_, case, func, insert, select, update
+from main_app import db
+from models import Client, DocumentChecklist, DocumentChecklistItem
+
+logger = logging.getLogger(__name__)
+
+# Checklists converted per transaction when moving legacy JSON columns into items
+MIGRATE_CHUNK = 500
+
+_received = func.coalesce(func.sum(case((DocumentChecklistItem.received.is_(True), 1), else_=0)), 0)
+
+
+def add_items(checklist_id, documents, received=()):
+    """Insert items for `documents`, marking those in `received`; the caller refreshes completion"""
+    now = datetime.utcnow()
+    received = set(received)
+    rows = [{'checklist_id': checklist_id, 'document_name': name, 'received': name in received,
+             'received_at': now if name in received else None, 'created_at': now}
+            for name in dict.fromkeys(documents)]
+    if rows:
+        db.session.execute(insert(DocumentChecklistItem), rows)
+    return len(rows)
+
+
+def set_item_received(item, received):
+    item.received = received
+    item.received_at = datetime.utcnow() if received else None
+
+
+def refresh_completion(checklist_ids):
+    """Recompute completion_percentage for the checklists from their items; the caller commits"""
+    ids = list(checklist_ids)
+    if not ids:
+        return
+    counts = (
+        select(DocumentChecklistItem.checklist_id, func.count().label('total'), _received.label('received'))
+        .where(DocumentChecklistItem.checklist_id.in_(ids))
+        .group_by(DocumentChecklistItem.checklist_id)
+    )
+    percentages = {checklist_id: received * 100 // total for checklist_id, total, received in db.session.execute(counts)}
+    db.session.execute(update(DocumentChecklist), [
+        {'id': checklist_id, 'completion_percentage': percentages.get(checklist_id, 0)} for checklist_id in ids
+    ])
+
+
+def item_counts():
+    """Per-checklist item totals: a subquery of (checklist_id, total, received)"""
+    return (
+        select(DocumentChecklistItem.checklist_id, func.count().label('total'), _received.label('received'))
+        .group_by(DocumentChecklistItem.checklist_id)
+        .subquery()
+    )
+
+
+def checklist_rows():
+    """Checklists with client name and item counts, by due date, in one query"""
+    counts = item_counts()
+    return db.session.execute(
+        select(DocumentChecklist.id, DocumentChecklist.checklist_name, DocumentChecklist.service_type,
+               DocumentChecklist.due_date, DocumentChecklist.status, DocumentChecklist.completion_percentage,
+               Client.name.label('client_name'),
+               func.coalesce(counts.c.total, 0).label('total'),
+               func.coalesce(counts.c.received, 0).label('received'))
+        .outerjoin(Client, Client.id == DocumentChecklist.client_id)
+        .outerjoin(counts, counts.c.checklist_id == DocumentChecklist.id)
+        .order_by(DocumentChecklist.due_date)
+    ).all()
+
+
+def checklist_summary(today=None):
+    """Counts for the summary cards: active, completed, overdue and the overall document rate"""
+    today = today or date.today()
+    completed = func.lower(DocumentChecklist.status) == 'completed'
+    overdue = and_(~completed, DocumentChecklist.due_date < today,
+                   func.coalesce(DocumentChecklist.completion_percentage, 0) < 100)
+    row = db.session.execute(
+        select(func.count(DocumentChecklist.id).label('total'),
+               func.coalesce(func.sum(case((completed, 1), else_=0)), 0).label('completed'),
+               func.coalesce(func.sum(case((overdue, 1), else_=0)), 0).label('overdue'))
+    ).one()
+    docs = db.session.execute(select(func.count(DocumentChecklistItem.id), _received)).one()
+    return {
+        'active': row.total - row.completed - row.overdue,
+        'completed': row.completed,
+        'overdue': row.overdue,
+        'avg_completion_rate': round(docs[1] * 100 / docs[0], 1) if docs[0] else 0,
+    }
+
+
+def migrate_json_checklists():
+    """Move checklists still holding JSON document lists into document_checklist_items.
+
+    Documents marked received but missing from the required list are added as
+    items too. The JSON columns are cleared once converted, so this is a no-op
+    after the first run. Runs as one transaction through migrations.run_once;
+    the caller commits.
+    """
+    moved = 0
+    while True:
+        rows = db.session.execute(
+            select(DocumentChecklist.id, DocumentChecklist.documents_required,
+                   DocumentChecklist.documents_received, DocumentChecklist.created_at)
+            .where((DocumentChecklist.documents_required.isnot(None))
+                   | (DocumentChecklist.documents_received.isnot(None)))
+            .order_by(DocumentChecklist.id)
+            .limit(MIGRATE_CHUNK)
+        ).all()
+        if not rows:
+            break
+        items = []
+        for row in rows:
+            required, received = _json_list(row.documents_required), _json_list(row.documents_received)
+            received_set = set(received)
+            for name in dict.fromkeys(required + received):
+                items.append({'checklist_id': row.id, 'document_name': name[:200], 'received': name in received_set,
+                              'received_at': row.created_at if name in received_set else None,
+                              'created_at': row.created_at})
+        if items:
+            db.session.execute(insert(DocumentChecklistItem), items)
+        ids = [row.id for row in rows]
+        db.session.execute(
+            update(DocumentChecklist).where(DocumentChecklist.id.in_(ids))
+            .values(documents_required=None, documents_received=None)
+        )
+        refresh_completion(ids)
+        moved += len(rows)
+    if moved:
+        logger.info("Moved %d document checklists to checklist items", moved)
+    return moved
+
+
+def _json_list(text):
+    try:
+        value = json.loads(text or '[]')
+    except ValueError:
+        return []
+    return [str(v) for v in value if v] if isinstance(value, list) else []
@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import namedtuple
+from flask import current_app
+from sqlalchemy import select
+from main_app import db
+from models import Client
+from search import ranked_ids
+from stats import topic_versions, invalidate
+
+# Unpacks like the old (id, name) tuples and still supports client.id / client.name in templates
+ClientChoice = namedtuple('ClientChoice', ['id', 'name'])
+
+DEFAULT_TYPEAHEAD_THRESHOLD = 500
+DEFAULT_TTL = 60  # seconds; picks up clients added by other worker processes
+
+_lock = threading.Lock()
+_cache = {'version': None, 'loaded_at': 0.0, 'all': [], 'active': [], 'by_id': {}}
+
+
+def _load():
+    rows = db.session.execute(
+        select(Client.id, Client.name, Client.status).order_by(Client.name)
+    ).all()
+    all_choices = [ClientChoice(r.id, r.name) for r in rows]
+    active = [ClientChoice(r.id, r.name) for r in rows if r.status == 'Active']
+    by_id = {r.id: (r.name, r.status == 'Active') for r in rows}
+    return all_choices, active, by_id
+
+
+def _snapshot():
+    """Current cache contents, reloaded (id, name, status only) when Client rows changed"""
+    ttl = current_app.config.get('CLIENT_CHOICES_TTL', DEFAULT_TTL)
+    version = topic_versions()['clients']
+    with _lock:
+        if _cache['version'] == version and time.monotonic() - _cache['loaded_at'] < ttl:
+            return _cache
+    all_choices, active, by_id = _load()
+    with _lock:
+        # Only publish if nothing changed while we were loading
+        if topic_versions()['clients'] == version:
+            _cache.update(version=version, loaded_at=time.monotonic(),
+                          all=all_choices, active=active, by_id=by_id)
+            return _cache
+    return {'version': version, 'all': all_choices, 'active': active, 'by_id': by_id}
+
+
+def get_client_choices(active_only=False):
+    """Cached list of ClientChoice(id, name) ordered by name"""
+    cache = _snapshot()
+    return cache['active'] if active_only else cache['all']
+
+
+def client_choice_exists(client_id, active_only=False):
+    entry = _snapshot()['by_id'].get(client_id)
+    if entry is None and client_id:
+        # Possibly created by another worker since our last load
+        client = db.session.get(Client, client_id)
+        if client is None:
+            return False
+        invalidate('clients')
+        entry = (client.name, client.status == 'Active')
+    return entry is not None and (entry[1] or not active_only)
+
+
+def get_client_name(client_id):
+    entry = _snapshot()['by_id'].get(client_id)
+    return entry[0] if entry else None
+
+
+def use_typeahead():
+    """Render client pickers as AJAX typeaheads once the client table is large"""
+    threshold = current_app.config.get('CLIENT_PICKER_TYPEAHEAD_THRESHOLD', DEFAULT_TYPEAHEAD_THRESHOLD)
+    return len(_snapshot()['all']) > threshold
+
+
+def search_client_choices(q, active_only=False, limit=20):
+    """Typeahead lookup: ranked FTS matches mapped to cached names"""
+    by_id = _snapshot()['by_id']
+    results = []
+    for client_id in ranked_ids('clients', q, limit=limit * 2 if active_only else limit):
+        entry = by_id.get(client_id)
+        if entry and (entry[1] or not active_only):
+            results.append(ClientChoice(client_id, entry[0]))
+            if len(results) >= limit:
+                break
+    return results
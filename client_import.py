@@ -0,0 +1,359 @@
+import csv
+import logging
+import os
+import re
+import tempfile
+import time
+import uuid
+import zipfile
+import zlib
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from xml.etree.ElementTree import ParseError, iterparse
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from main_app import db
+from compliance import extend_calendars
+from gstin import check_gstin
+from search import bulk_insert
+from models import Client
+
+logger = logging.getLogger(__name__)
+
+# Rows validated and inserted per batch; memory use stays flat whatever the file size
+IMPORT_CHUNK = 2000
+# Rejected rows shown on the result page; the full list is in the downloadable report
+REJECT_PREVIEW = 100
+# Rejection reports are kept this long
+REPORT_MAX_AGE = timedelta(days=1)
+REPORT_DIR = os.path.join(tempfile.gettempdir(), 'client-imports')
+
+# Header spellings accepted for each Client column
+HEADERS = {
+    'name': ('name', 'client name', 'client'),
+    'pan': ('pan', 'pan number', 'pan no'),
+    'gstin': ('gstin', 'gst number', 'gst no', 'gstin number'),
+    'email': ('email', 'email address', 'e-mail'),
+    'phone': ('phone', 'mobile', 'phone number', 'contact'),
+    'address': ('address',),
+    'date_of_birth': ('date of birth', 'date_of_birth', 'dob'),
+    'incorporation_date': ('incorporation date', 'incorporation_date', 'date of incorporation'),
+    'client_type': ('client type', 'client_type', 'type', 'constitution'),
+    'status': ('status',),
+}
+_HEADER_FIELDS = {alias: field for field, aliases in HEADERS.items() for alias in aliases}
+
+CLIENT_TYPES = ('Individual', 'Company', 'Partnership', 'LLP', 'Trust', 'Society')
+STATUSES = ('Active', 'Inactive')
+
+# Same rules as ClientForm
+_PAN = re.compile(r'[A-Z]{5}[0-9]{4}[A-Z]')
+_PHONE = re.compile(r'[6-9]\d{9}')
+_EMAIL = re.compile(r'[^@\s]+@[^@\s]+\.[^@\s]+')
+_DATE_FORMATS = ('%Y-%m-%d', '%d-%m-%Y', '%d/%m/%Y', '%d.%m.%Y')
+_CLIENT_TYPES = {t.lower(): t for t in CLIENT_TYPES}
+_STATUSES = {s.lower(): s for s in STATUSES}
+
+# error: why reading stopped part-way through the file, if it did
+ImportResult = namedtuple('ImportResult', ['token', 'rows', 'imported', 'rejected', 'preview', 'seconds', 'error'],
+                          defaults=(None,))
+
+
+class ImportFileError(ValueError):
+    """The upload can't be read as a client list"""
+
+
+# --- Readers ------------------------------------------------------------------
+
+def read_rows(stream, filename):
+    """Yield (row number, {field: text}) from a CSV or XLSX upload, one row at a time"""
+    if filename.lower().endswith('.xlsx'):
+        rows = _xlsx_rows(stream)
+    elif filename.lower().endswith('.csv'):
+        rows = csv.reader(_csv_lines(stream))
+    else:
+        raise ImportFileError('Upload a .csv or .xlsx file')
+    rows = _readable(rows)
+
+    header = next(rows, None)
+    if not header:
+        raise ImportFileError('The file is empty')
+    fields = [_HEADER_FIELDS.get(str(h or '').strip().lower()) for h in header]
+    if 'name' not in fields:
+        raise ImportFileError('The first row must be a header with at least a "Name" column')
+
+    for number, row in enumerate(rows, start=2):
+        values = {field: row[i] for i, field in enumerate(fields) if field and i < len(row)}
+        if any(str(v).strip() for v in values.values() if v is not None):
+            yield number, values
+
+
+def _csv_lines(stream):
+    """Decode a binary CSV line by line, so a bad byte is reported on its own row"""
+    for number, line in enumerate(stream):
+        yield line.decode('utf-8-sig' if number == 0 else 'utf-8')
+
+
+def _readable(rows):
+    """Pass rows through, turning decode and parse failures into ImportFileError"""
+    read = 0
+    try:
+        for read, row in enumerate(rows, start=1):
+            yield row
+    except ImportFileError:
+        raise
+    except UnicodeDecodeError:
+        raise ImportFileError(f'Row {read + 1} is not UTF-8 text; save the file as "CSV UTF-8"') from None
+    except csv.Error as e:
+        raise ImportFileError(f'Row {read + 1} could not be read: {e}') from None
+    except (ParseError, zipfile.BadZipFile, zlib.error, EOFError, ValueError, IndexError):
+        raise ImportFileError(f'The workbook is damaged after row {read}') from None
+
+
+def _xlsx_rows(stream):
+    """Rows of the first worksheet of an XLSX file as lists of cell values.
+
+    Streams the sheet XML with iterparse, clearing each row once read, so only
+    the shared-string table is held in memory.
+    """
+    try:
+        archive = zipfile.ZipFile(stream)
+    except zipfile.BadZipFile:
+        raise ImportFileError('The file is not a valid .xlsx workbook')
+    ns = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+    names = set(archive.namelist())
+    sheet = 'xl/worksheets/sheet1.xml'
+    if sheet not in names:
+        sheets = sorted(n for n in names if n.startswith('xl/worksheets/sheet'))
+        if not sheets:
+            raise ImportFileError('The workbook has no worksheets')
+        sheet = sheets[0]
+
+    shared = []
+    if 'xl/sharedStrings.xml' in names:
+        with archive.open('xl/sharedStrings.xml') as f:
+            for _, elem in iterparse(f):
+                if elem.tag == ns + 'si':
+                    shared.append(''.join(t.text or '' for t in elem.iter(ns + 't')))
+                    elem.clear()
+
+    with archive.open(sheet) as f:
+        for _, elem in iterparse(f):
+            if elem.tag != ns + 'row':
+                continue
+            row = []
+            for cell in elem.iter(ns + 'c'):
+                column = _column_index(cell.get('r')) if cell.get('r') else len(row)
+                row.extend([None] * (column - len(row)))
+                kind = cell.get('t')
+                if kind == 'inlineStr':
+                    value = ''.join(t.text or '' for t in cell.iter(ns + 't'))
+                else:
+                    v = cell.find(ns + 'v')
+                    value = v.text if v is not None else None
+                    if kind == 's' and value is not None:
+                        value = shared[int(value)]
+                    elif kind in (None, 'n') and value is not None:
+                        value = _number(value)
+                row.append(value)
+            elem.clear()
+            yield row
+
+
+def _number(text):
+    """A numeric cell's value as an int or float, so dates stored as day numbers can be told apart from text"""
+    try:
+        number = float(text)
+    except ValueError:
+        return text
+    return int(number) if number.is_integer() else number
+
+
+def _column_index(ref):
+    index = 0
+    for ch in ref:
+        if not ch.isalpha():
+            break
+        index = index * 26 + ord(ch.upper()) - 64
+    return index - 1
+
+
+# --- Validation ---------------------------------------------------------------
+
+def _text(value, limit):
+    text = str(value).strip() if value is not None else ''
+    return text[:limit] if text else None
+
+
+def _date(value):
+    if value is None or str(value).strip() == '':
+        return None
+    if isinstance(value, (int, float)):
+        # Numeric XLSX cell: Excel stores dates as day numbers since 1899-12-30
+        try:
+            return date(1899, 12, 30) + timedelta(days=int(value))
+        except (OverflowError, ValueError):
+            raise ValueError(f'Unrecognised date "{value}"') from None
+    text = str(value).strip()
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            pass
+    raise ValueError(f'Unrecognised date "{text}"')
+
+
+def validate_chunk(rows, known_pans, user_id, now):
+    """Split a chunk of (row number, values) into accepted (row number, Client row) and rejected
+    (row number, reason, values) lists.
+
+    `known_pans` holds every PAN already in the database or earlier in the
+    file; accepted PANs are added to it.
+    """
+    accepted, rejected = [], []
+    for number, values in rows:
+        name = _text(values.get('name'), 200)
+        pan = (_text(values.get('pan'), 20) or '').upper() or None
+        gstin = (re.sub(r'\s+', '', str(values.get('gstin') or '')).upper()) or None
+        email = _text(values.get('email'), 120)
+        phone = re.sub(r'[\s()+-]+', '', str(values.get('phone') or '')) or None
+        if phone and len(phone) > 10 and phone.startswith(('0', '91')):
+            phone = phone[-10:]
+        client_type = _CLIENT_TYPES.get((_text(values.get('client_type'), 50) or 'individual').lower())
+        status = _STATUSES.get((_text(values.get('status'), 20) or 'active').lower())
+
+        if not name:
+            reason = 'Name is missing'
+        elif pan and not _PAN.fullmatch(pan):
+            reason = 'PAN format is invalid'
+        elif pan and pan in known_pans:
+            reason = 'PAN already exists'
+        elif gstin and not check_gstin(gstin).is_valid:
+            reason = 'GSTIN is invalid'
+        elif gstin and pan and gstin[2:12] != pan:
+            reason = 'GSTIN does not contain the PAN'
+        elif email and not _EMAIL.fullmatch(email):
+            reason = 'Email address is invalid'
+        elif phone and not _PHONE.fullmatch(phone):
+            reason = 'Phone must be a 10-digit mobile number'
+        elif client_type is None:
+            reason = f"Client type must be one of {', '.join(CLIENT_TYPES)}"
+        elif status is None:
+            reason = 'Status must be Active or Inactive'
+        else:
+            try:
+                date_of_birth = _date(values.get('date_of_birth'))
+                incorporation_date = _date(values.get('incorporation_date'))
+            except ValueError as e:
+                reason = str(e)
+            else:
+                reason = None
+        if reason:
+            rejected.append((number, reason, values))
+            continue
+
+        if pan:
+            known_pans.add(pan)
+        accepted.append((number, {
+            'name': name, 'pan': pan, 'gstin': gstin, 'email': email, 'phone': phone,
+            'address': _text(values.get('address'), 500), 'date_of_birth': date_of_birth,
+            'incorporation_date': incorporation_date, 'client_type': client_type, 'status': status,
+            'created_at': now, 'created_by': user_id,
+        }))
+    return accepted, rejected
+
+
+# --- Import -------------------------------------------------------------------
+
+def import_clients(stream, filename, user_id):
+    """Validate and insert the clients in an upload; returns an ImportResult.
+
+    Existing PANs are loaded into a set once, so duplicates are caught without
+    a query or failed insert per row. Accepted rows are inserted and committed
+    in IMPORT_CHUNK batches; rejected rows are streamed to a CSV report.
+    Compliance calendars for the new clients are generated once all chunks are in.
+    """
+    started = time.perf_counter()
+    known_pans = set(db.session.scalars(select(Client.pan).where(Client.pan.isnot(None))))
+    token = uuid.uuid4().hex
+    _prune_reports()
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    imported = rejected = total = 0
+    preview = []
+
+    with open(report_path(token), 'w', newline='', encoding='utf-8') as report:
+        writer = csv.writer(report)
+        writer.writerow(['row', 'reason'] + list(HEADERS))
+
+        def reject(items):
+            for number, reason, values in items:
+                writer.writerow([number, reason] + [values.get(field, '') for field in HEADERS])
+                if len(preview) < REJECT_PREVIEW:
+                    preview.append((number, reason, values.get('name') or '', values.get('pan') or ''))
+            return len(items)
+
+        chunk = []
+        error = None
+        try:
+            for item in read_rows(stream, filename):
+                chunk.append(item)
+                if len(chunk) >= IMPORT_CHUNK:
+                    total += len(chunk)
+                    done, bad = _import_chunk(chunk, known_pans, user_id)
+                    imported += done
+                    rejected += reject(bad)
+                    chunk = []
+        except ImportFileError as e:
+            if not total and not chunk:
+                raise
+            # Rows before the damaged part are kept; the result says where reading stopped
+            error = str(e)
+        if chunk:
+            total += len(chunk)
+            done, bad = _import_chunk(chunk, known_pans, user_id)
+            imported += done
+            rejected += reject(bad)
+
+    if imported:
+        extend_calendars()
+    seconds = round(time.perf_counter() - started, 2)
+    logger.info("Imported %d of %d clients from %s in %.2fs", imported, total, filename, seconds)
+    return ImportResult(token, total, imported, rejected, preview, seconds, error)
+
+
+def _import_chunk(chunk, known_pans, user_id):
+    accepted, rejected = validate_chunk(chunk, known_pans, user_id, datetime.utcnow())
+    if not accepted:
+        return 0, rejected
+    try:
+        bulk_insert('clients', [row for _, row in accepted])
+        db.session.commit()
+    except IntegrityError:
+        # A PAN added by someone else since the set was loaded: drop those rows and retry once
+        db.session.rollback()
+        pans = [row['pan'] for _, row in accepted if row['pan']]
+        taken = set(db.session.scalars(select(Client.pan).where(Client.pan.in_(pans))))
+        values = dict(chunk)
+        rejected += [(number, 'PAN already exists', values[number]) for number, row in accepted if row['pan'] in taken]
+        accepted = [(number, row) for number, row in accepted if row['pan'] not in taken]
+        if accepted:
+            bulk_insert('clients', [row for _, row in accepted])
+            db.session.commit()
+    return len(accepted), rejected
+
+
+def report_path(token):
+    return os.path.join(REPORT_DIR, f'{token}-rejected.csv')
+
+
+def _prune_reports():
+    if not os.path.isdir(REPORT_DIR):
+        return
+    cutoff = time.time() - REPORT_MAX_AGE.total_seconds()
+    for name in os.listdir(REPORT_DIR):
+        path = os.path.join(REPORT_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
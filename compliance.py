@@ -0,0 +1,322 @@
+import logging
+import re
+from collections import defaultdict, namedtuple
+from datetime import date, timedelta
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+from main_app import db
+from database import upsert
+from models import Client, ComplianceCalendar, SchedulerState, TDSReturn
+
+logger = logging.getLogger(__name__)
+
+CalendarEntry = namedtuple('CalendarEntry', ['form', 'period', 'due_date'])
+
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+# --- Rules --------------------------------------------------------------------
+# Due dates as (month, day) in calendar year terms; `year_offset` counts from the
+# calendar year the financial year starts in (FY 2025-26 -> 2025).
+
+# GST: monthly returns fall due in the month after the tax period
+GST_DUE_DAY = {'GSTR-1': 11, 'GSTR-3B': 20}
+
+# TDS/TCS quarterly statements: (month, day, year_offset) per quarter
+TDS_DUE = {
+    'default': {'Q1': (7, 31, 0), 'Q2': (10, 31, 0), 'Q3': (1, 31, 1), 'Q4': (5, 31, 1)},
+    '27EQ': {'Q1': (7, 15, 0), 'Q2': (10, 15, 0), 'Q3': (1, 15, 1), 'Q4': (5, 15, 1)},
+}
+
+# ITR for the assessment year after the FY: non-audit individuals by 31 July,
+# companies and (audited) firms and trusts by 31 October
+ITR_DUE = {
+    'Individual': (7, 31),
+    'Company': (10, 31),
+    'LLP': (10, 31),
+    'Partnership': (10, 31),
+    'Trust': (10, 31),
+    'Society': (10, 31),
+}
+ITR_DUE_DEFAULT = (7, 31)
+
+# Company annual filings, counted from an AGM held by 30 September after the FY:
+# AOC-4 within 30 days and MGT-7 within 60 days
+ROC_DUE = {'AOC-4': (10, 30), 'MGT-7': (11, 29)}
+ROC_CLIENT_TYPES = ('Company',)
+
+
+def financial_year_of(day):
+    """'2025-26' for any date from 1 April 2025 to 31 March 2026"""
+    start = day.year if day.month >= 4 else day.year - 1
+    return f"{start}-{(start + 1) % 100:02d}"
+
+
+def _fy_start(financial_year):
+    return int(financial_year[:4])
+
+
+def next_financial_year(financial_year):
+    start = _fy_start(financial_year) + 1
+    return f"{start}-{(start + 1) % 100:02d}"
+
+
+def active_financial_years(today=None):
+    """The current financial year and the next, whose calendars are kept generated"""
+    current = financial_year_of(today or date.today())
+    return current, next_financial_year(current)
+
+
+def _is_company(client_type):
+    return client_type in ROC_CLIENT_TYPES
+
+
+def calendar_entries(financial_year, client_type=None, gstin=None, tds_forms=()):
+    """Every statutory filing a client owes for `financial_year`, as CalendarEntry tuples"""
+    start = _fy_start(financial_year)
+    short_fy = f"FY{(start + 1) % 100:02d}"
+    entries = []
+
+    if gstin:
+        for offset in range(12):
+            month = (3 + offset) % 12 + 1
+            year = start + (3 + offset) // 12
+            due_year, due_month = (year + 1, 1) if month == 12 else (year, month + 1)
+            period = f"{_MONTHS[month - 1]} {year}"
+            for form, day in GST_DUE_DAY.items():
+                entries.append(CalendarEntry(form, period, date(due_year, due_month, day)))
+
+    for form in tds_forms:
+        schedule = TDS_DUE.get(form, TDS_DUE['default'])
+        for quarter, (month, day, year_offset) in schedule.items():
+            entries.append(CalendarEntry(f"TDS-{form}", f"{quarter} {short_fy}", date(start + year_offset, month, day)))
+
+    month, day = ITR_DUE.get(client_type, ITR_DUE_DEFAULT)
+    entries.append(CalendarEntry('ITR', f"AY {start + 1}-{(start + 2) % 100:02d}", date(start + 1, month, day)))
+
+    if _is_company(client_type):
+        for form, (month, day) in ROC_DUE.items():
+            entries.append(CalendarEntry(form, f"FY {financial_year}", date(start + 1, month, day)))
+
+    overrides = current_app.config.get('COMPLIANCE_DUE_DATE_OVERRIDES', {})
+    if overrides:
+        # Extensions notified by CBDT/CBIC/MCA: {(form, period): date}
+        entries = [e._replace(due_date=overrides.get((e.form, e.period), e.due_date)) for e in entries]
+    return entries
+
+
+def calendar_form(return_type):
+    """Calendar form name for a ReturnTracker return_type ('ITR-2' -> 'ITR')"""
+    if not return_type:
+        return None
+    return_type = return_type.strip()
+    if return_type.upper().startswith('ITR'):
+        return 'ITR'
+    return return_type
+
+
+def financial_year_of_period(period):
+    """Financial year a period label belongs to, for the labels calendar_entries() produces"""
+    period = (period or '').strip()
+    match = re.fullmatch(r'AY (\d{4})-\d{2}', period)
+    if match:
+        return financial_year_of(date(int(match.group(1)) - 1, 4, 1))
+    match = re.fullmatch(r'FY (\d{4})-\d{2}', period)
+    if match:
+        return financial_year_of(date(int(match.group(1)), 4, 1))
+    match = re.fullmatch(r'Q[1-4] FY(\d{2})', period)
+    if match:
+        return financial_year_of(date(2000 + int(match.group(1)) - 1, 4, 1))
+    match = re.fullmatch(r'([A-Z][a-z]{2}) (\d{4})', period)
+    if match and match.group(1) in _MONTHS:
+        return financial_year_of(date(int(match.group(2)), _MONTHS.index(match.group(1)) + 1, 1))
+    return None
+
+
+def statutory_due_date(client, return_type, period):
+    """Due date the rules give for a client's return, or None if the period isn't recognised"""
+    form = calendar_form(return_type)
+    financial_year = financial_year_of_period(period)
+    if not form or not financial_year:
+        return None
+    tds_forms = [form[len('TDS-'):]] if form.startswith('TDS-') else ()
+    for entry in calendar_entries(financial_year, client.client_type, client.gstin, tds_forms):
+        if entry.form == form and entry.period == period.strip():
+            return entry.due_date
+    return None
+
+
+# --- Generation ---------------------------------------------------------------
+
+GENERATE_CHUNK = 500  # clients per round of queries
+
+
+def _tds_forms_by_client(client_ids):
+    rows = db.session.execute(
+        select(TDSReturn.client_id, TDSReturn.return_type)
+        .where(TDSReturn.client_id.in_(client_ids))
+        .group_by(TDSReturn.client_id, TDSReturn.return_type)
+    ).all()
+    forms = defaultdict(set)
+    for client_id, return_type in rows:
+        forms[client_id].add(return_type or '26Q')
+    return forms
+
+
+def generate_calendar(financial_year, client_ids=None, id_range=None):
+    """Bulk-generate the calendar for `financial_year`; returns the number of entries written.
+
+    Covers every client, the given `client_ids`, or clients whose id falls in
+    `id_range` = (after, up_to]. Existing entries keep their status and get
+    any changed due date; pending entries a client no longer owes (e.g. GSTIN
+    removed) are dropped. Runs in chunks of clients with one upsert per chunk.
+    The caller commits.
+    """
+    query = select(Client.id, Client.client_type, Client.gstin).order_by(Client.id)
+    if client_ids is not None:
+        query = query.where(Client.id.in_(client_ids))
+    if id_range is not None:
+        query = query.where(Client.id > id_range[0], Client.id <= id_range[1])
+    clients = db.session.execute(query).all()
+    dialect = db.session.get_bind().dialect.name
+    written = 0
+
+    for i in range(0, len(clients), GENERATE_CHUNK):
+        chunk = clients[i:i + GENERATE_CHUNK]
+        ids = [c.id for c in chunk]
+        tds_forms = _tds_forms_by_client(ids)
+        rows = []
+        for client in chunk:
+            for entry in calendar_entries(financial_year, client.client_type, client.gstin,
+                                          sorted(tds_forms.get(client.id, ()))):
+                rows.append({'client_id': client.id, 'financial_year': financial_year, 'form': entry.form,
+                             'period': entry.period, 'due_date': entry.due_date, 'status': 'Pending'})
+
+        wanted = {(r['client_id'], r['form'], r['period']) for r in rows}
+        existing = db.session.execute(
+            select(ComplianceCalendar.id, ComplianceCalendar.client_id, ComplianceCalendar.form,
+                   ComplianceCalendar.period, ComplianceCalendar.status)
+            .where(ComplianceCalendar.client_id.in_(ids), ComplianceCalendar.financial_year == financial_year)
+        ).all()
+        stale = [e.id for e in existing if (e.client_id, e.form, e.period) not in wanted and e.status == 'Pending']
+        if stale:
+            db.session.execute(delete(ComplianceCalendar).where(ComplianceCalendar.id.in_(stale)))
+
+        if rows:
+            stmt = upsert(ComplianceCalendar, dialect, ['client_id', 'form', 'period'], update_columns=['due_date'])
+            if stmt is None:
+                present = {(e.client_id, e.form, e.period) for e in existing}
+                rows = [r for r in rows if (r['client_id'], r['form'], r['period']) not in present]
+                stmt = ComplianceCalendar.__table__.insert()
+            if rows:
+                db.session.execute(stmt, rows)
+        written += len(rows)
+    return written
+
+
+def refresh_client_calendar(client_id, today=None):
+    """Regenerate one client's calendar for the current and next financial year"""
+    for financial_year in active_financial_years(today):
+        generate_calendar(financial_year, [client_id])
+
+
+def extend_calendars(today=None):
+    """Generate the active years' calendars for clients added since the last call; commits.
+
+    A per-year client id watermark in scheduler_state records how far each
+    year has been generated, so a new financial year starts from the first
+    client. Runs at startup, after client imports and on every scheduler sync.
+    """
+    last_client_id = db.session.scalar(select(func.max(Client.id))) or 0
+    written = 0
+    for financial_year in active_financial_years(today):
+        name = f'calendar.{financial_year}.last_client_id'
+        state = db.session.get(SchedulerState, name) or SchedulerState(name=name, value=0)
+        if (state.value or 0) >= last_client_id:
+            continue
+        count = generate_calendar(financial_year, id_range=(state.value or 0, last_client_id))
+        state.value = last_client_id
+        db.session.add(state)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another process generated this year at the same time; the entries were upserted
+            db.session.rollback()
+            continue
+        logger.info("Added %d FY %s compliance calendar entries", count, financial_year)
+        written += count
+    return written
+
+
+def mark_filed(client_id, return_type, period, filed=True):
+    """Reflect a ReturnTracker status change on the matching calendar entry"""
+    form = calendar_form(return_type)
+    if not form or not period:
+        return
+    db.session.execute(
+        update(ComplianceCalendar)
+        .where(ComplianceCalendar.client_id == client_id,
+               ComplianceCalendar.form == form,
+               ComplianceCalendar.period == period.strip())
+        .values(status='Filed' if filed else 'Pending')
+    )
+
+
+# --- Reading ------------------------------------------------------------------
+
+FORM_FAMILIES = {
+    'ITR': ('ITR',),
+    'GST': ('GSTR-1', 'GSTR-3B'),
+    'TDS': tuple(f"TDS-{form}" for form in ('24Q', '26Q', '27Q', '27EQ')),
+    'ROC': tuple(ROC_DUE),
+}
+
+
+# Due-date windows (days ahead) offered by the return tracker
+DUE_DATE_WINDOWS = (7, 30, 90)
+
+
+def upcoming_due_query(days=30, family=None, client_id=None, today=None):
+    """Pending calendar entries due within the next `days` days, unordered, with their clients.
+
+    A range scan on the due_date index, so the cost follows the size of the
+    window rather than of the calendar.
+    """
+    today = today or date.today()
+    query = ComplianceCalendar.query.filter(
+        ComplianceCalendar.due_date >= today,
+        ComplianceCalendar.due_date <= today + timedelta(days=days),
+        ComplianceCalendar.status == 'Pending',
+    )
+    if family in FORM_FAMILIES:
+        query = query.filter(ComplianceCalendar.form.in_(FORM_FAMILIES[family]))
+    if client_id is not None:
+        query = query.filter(ComplianceCalendar.client_id == client_id)
+    return query.options(joinedload(ComplianceCalendar.client))
+
+
+def upcoming_due_dates(days=30, family=None, client_id=None, limit=None, today=None):
+    """Pending calendar entries due within the next `days` days, soonest first"""
+    query = upcoming_due_query(days, family, client_id, today) \
+        .order_by(ComplianceCalendar.due_date, ComplianceCalendar.id)
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+
+@click.command('compliance-calendar')
+@click.option('--fy', 'financial_years', multiple=True,
+              help='Financial year such as 2025-26; repeatable. Defaults to the current and next year.')
+@with_appcontext
+def compliance_calendar_command(financial_years):
+    """Generate the statutory compliance calendar for every client."""
+    financial_years = financial_years or active_financial_years()
+    for financial_year in financial_years:
+        if not re.fullmatch(r'\d{4}-\d{2}', financial_year):
+            raise click.BadParameter(f"{financial_year!r} is not a financial year like 2025-26", param_hint='--fy')
+        written = generate_calendar(financial_year)
+        db.session.commit()
+        click.echo(f"FY {financial_year}: {written} calendar entries written.")
@@ -0,0 +1,168 @@
+import os
+from datetime import date, datetime, timedelta
+from sqlalchemy import String, and_, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+# Pool sizing for server databases (PostgreSQL); env vars override the defaults
+POOL_DEFAULTS = {
+    'DB_POOL_SIZE': 10,         # connections kept open per worker process
+    'DB_MAX_OVERFLOW': 20,      # extra connections allowed under burst load
+    'DB_POOL_TIMEOUT': 30,      # seconds to wait for a free connection
+    'DB_POOL_RECYCLE': 1800,    # seconds before a connection is replaced
+}
+
+
+def database_uri(default):
+    """DATABASE_URL from the environment, else `default` (the bundled SQLite file)"""
+    uri = os.environ.get('DATABASE_URL') or default
+    # Heroku-style URLs use the scheme SQLAlchemy dropped in 1.4
+    if uri.startswith('postgres://'):
+        uri = 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+
+def engine_options(uri, env=os.environ):
+    """SQLALCHEMY_ENGINE_OPTIONS for `uri`: a sized, pre-pinged QueuePool for server databases"""
+    if uri.startswith('sqlite'):
+        return {}
+    settings = {key: int(env.get(key, default)) for key, default in POOL_DEFAULTS.items()}
+    return {
+        'pool_size': settings['DB_POOL_SIZE'],
+        'max_overflow': settings['DB_MAX_OVERFLOW'],
+        'pool_timeout': settings['DB_POOL_TIMEOUT'],
+        'pool_recycle': settings['DB_POOL_RECYCLE'],
+        # Drop connections the server closed while idle instead of failing the request
+        'pool_pre_ping': True,
+    }
+
+
+# Connect-time SQLite settings; each can be overridden in app.config
+SQLITE_PRAGMA_DEFAULTS = {
+    'SQLITE_JOURNAL_MODE': 'WAL',      # readers no longer block behind a writer
+    'SQLITE_SYNCHRONOUS': 'NORMAL',    # durable at each WAL checkpoint; safe with WAL
+    'SQLITE_BUSY_TIMEOUT': 5000,       # ms a writer waits for the lock before "database is locked"
+    'SQLITE_MMAP_SIZE': 256 * 1024 * 1024,
+    'SQLITE_CACHE_SIZE': -64000,       # negative = KiB, so ~64 MB of page cache per connection
+}
+
+_PRAGMAS = (
+    ('journal_mode', 'SQLITE_JOURNAL_MODE'),
+    ('synchronous', 'SQLITE_SYNCHRONOUS'),
+    ('busy_timeout', 'SQLITE_BUSY_TIMEOUT'),
+    ('mmap_size', 'SQLITE_MMAP_SIZE'),
+    ('cache_size', 'SQLITE_CACHE_SIZE'),
+)
+
+
+def sqlite_pragmas(config):
+    """[(pragma, value)] to run on every new connection; a None setting skips that pragma"""
+    pragmas = []
+    for pragma, key in _PRAGMAS:
+        value = config.get(key, SQLITE_PRAGMA_DEFAULTS[key])
+        if value is not None:
+            pragmas.append((pragma, value))
+    return pragmas
+
+
+def configure_sqlite(engine, config):
+    """Apply the SQLite pragmas from `config` to each connection the engine opens.
+
+    Must run before the engine's first connection; no-op for other databases.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = sqlite_pragmas(config)
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma, value in pragmas:
+                cursor.execute(f"PRAGMA {pragma} = {value}")
+        finally:
+            cursor.close()
+
+
+def upsert(model, dialect_name, index_elements, update_columns=(), increment_columns=()):
+    """INSERT for `model` that skips or updates rows clashing on the unique `index_elements`.
+
+    `update_columns` take the new row's values; `increment_columns` add them
+    to the stored ones (counters). Uses ON CONFLICT on SQLite and PostgreSQL;
+    returns None for other databases so callers can fall back to checking for
+    existing rows first.
+    """
+    dialects = {'sqlite': sqlite, 'postgresql': postgresql}
+    if dialect_name not in dialects:
+        return None
+    stmt = dialects[dialect_name].insert(model)
+    set_ = {column: stmt.excluded[column] for column in update_columns}
+    set_.update({column: model.__table__.c[column] + stmt.excluded[column] for column in increment_columns})
+    if set_:
+        return stmt.on_conflict_do_update(index_elements=index_elements, set_=set_)
+    return stmt.on_conflict_do_nothing(index_elements=index_elements)
+
+
+# --- Portable date expressions ------------------------------------------------
+
+class year_month(FunctionElement):
+    """'YYYY-MM' bucket of a date/datetime column, rendered per dialect"""
+    type = String()
+    inherit_cache = True
+    name = 'year_month'
+
+
+@compiles(year_month)
+def _year_month_default(element, compiler, **kw):
+    return "to_char(%s, 'YYYY-MM')" % compiler.process(element.clauses, **kw)
+
+
+@compiles(year_month, 'sqlite')
+def _year_month_sqlite(element, compiler, **kw):
+    return "strftime('%%Y-%%m', %s)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(year_month, 'mysql')
+def _year_month_mysql(element, compiler, **kw):
+    return "DATE_FORMAT(%s, '%%Y-%%m')" % compiler.process(element.clauses, **kw)
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def next_month(day):
+    return (month_start(day) + timedelta(days=32)).replace(day=1)
+
+
+def month_starts(day, count):
+    """First days of the `count` calendar months ending with the month of `day`, oldest first"""
+    year, month = day.year, day.month
+    starts = []
+    for _ in range(count):
+        starts.append(date(year, month, 1))
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return starts[::-1]
+
+
+def _bound(column, day):
+    # Compare DateTime columns against datetimes so SQLite's text ordering holds
+    if column.type.python_type is datetime:
+        return datetime.combine(day, datetime.min.time())
+    return day
+
+
+def in_months(column, first_day, last_day):
+    """`column` falls between the start of first_day's month and the end of last_day's month"""
+    return and_(column >= _bound(column, month_start(first_day)), column < _bound(column, next_month(last_day)))
+
+
+def in_month(column, day):
+    """`column` falls in the calendar month containing `day`; a sargable range, not extract()"""
+    return in_months(column, day, day)
+
+
+def on_day(column, day):
+    """`column` falls on `day`; replaces func.date(column) == day"""
+    return and_(column >= _bound(column, day), column < _bound(column, day + timedelta(days=1)))
@@ -0,0 +1,137 @@
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import Column, DateTime, Float, Integer, MetaData, String, Table, create_engine, func, insert, select
+from sqlalchemy.exc import OperationalError
+from database import SQLITE_PRAGMA_DEFAULTS, configure_sqlite, engine_options
+
+# Scratch table the benchmark creates, fills and drops; never an app table
+_metadata = MetaData()
+bench = Table(
+    'db_benchmark_rows', _metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', String(100)),
+    Column('amount', Float),
+    Column('created_at', DateTime, index=True),
+)
+
+# Connect settings that leave every pragma at SQLite's default: the "before" run
+NO_PRAGMAS = dict.fromkeys(SQLITE_PRAGMA_DEFAULTS)
+
+
+def _engine(url, pragmas):
+    engine = create_engine(url, **engine_options(url))
+    if pragmas is not None:
+        configure_sqlite(engine, pragmas)
+    return engine
+
+
+def _seed(url, pragmas, rows):
+    engine = _engine(url, pragmas)
+    _metadata.drop_all(engine)
+    _metadata.create_all(engine)
+    rng = random.Random(8)
+    start = datetime(2024, 1, 1)
+    with engine.begin() as conn:
+        for offset in range(0, rows, 5000):
+            conn.execute(insert(bench), [
+                {'name': f'Client {i}', 'amount': rng.randrange(100, 100000) / 10,
+                 'created_at': start + timedelta(minutes=i)}
+                for i in range(offset, min(offset + 5000, rows))
+            ])
+    engine.dispose()
+
+
+def _drop(url, pragmas):
+    engine = _engine(url, pragmas)
+    _metadata.drop_all(engine)
+    engine.dispose()
+
+
+def _run_worker(role, url, pragmas, start_at, seconds):
+    """One reader or writer process: (role, operations, lock errors) over the timed window"""
+    engine = _engine(url, pragmas)
+    ops = errors = 0
+    time.sleep(max(start_at - time.time(), 0))
+    deadline = start_at + seconds
+    with engine.connect() as conn:
+        while time.time() < deadline:
+            try:
+                if role == 'read':
+                    # A dashboard-style aggregate and one list page
+                    conn.execute(select(func.count(), func.sum(bench.c.amount))).one()
+                    conn.execute(select(bench).order_by(bench.c.created_at.desc(), bench.c.id.desc()).limit(20)).all()
+                else:
+                    conn.execute(insert(bench).values(name='New client', amount=1.0, created_at=datetime.utcnow()))
+                conn.commit()
+                ops += 1
+            except OperationalError:
+                conn.rollback()
+                errors += 1
+    engine.dispose()
+    return role, ops, errors
+
+
+def run_benchmark(url, pragmas, readers, writers, seconds, rows):
+    """{'read': ops/s, 'write': ops/s, 'errors': n} for concurrent reader and writer processes"""
+    _seed(url, pragmas, rows)
+    roles = ['read'] * readers + ['write'] * writers
+    # Spawned like the XBRL pool, so each worker opens its own connections
+    with multiprocessing.get_context('spawn').Pool(len(roles)) as pool:
+        pool.map(abs, range(len(roles)))  # wait for every worker to be up before the clock starts
+        start_at = time.time() + 0.5
+        results = pool.starmap(_run_worker, [(role, url, pragmas, start_at, seconds) for role in roles])
+    _drop(url, pragmas)
+    totals = {'read': 0, 'write': 0, 'errors': 0}
+    for role, ops, errors in results:
+        totals[role] += ops
+        totals['errors'] += errors
+    return {'read': totals['read'] / seconds, 'write': totals['write'] / seconds, 'errors': totals['errors']}
+
+
+@click.command('db-benchmark')
+@click.option('--readers', default=4, show_default=True, help='Reader processes.')
+@click.option('--writers', default=2, show_default=True, help='Writer processes.')
+@click.option('--seconds', default=5.0, show_default=True, help='Length of each timed run.')
+@click.option('--rows', default=50000, show_default=True, help='Rows in the scratch table.')
+@click.option('--runs', default=2, show_default=True, help='Timed runs per configuration.')
+@click.option('--url', default=None,
+              help='Server database to measure (e.g. PostgreSQL, with the DB_POOL_* settings). '
+                   'By default scratch SQLite files are used.')
+@with_appcontext
+def db_benchmark_command(readers, writers, seconds, rows, runs, url):
+    """Measure concurrent read/write throughput on a scratch table.
+
+    For SQLite it runs SQLite's defaults and then the configured SQLITE_*
+    pragmas, each on its own scratch file, because WAL mode persists in a
+    database file.
+    """
+    if url:
+        configurations = [(f'{url.split(":", 1)[0]} (pool from DB_POOL_*)', url, None)]
+        scratch = None
+    else:
+        scratch = tempfile.mkdtemp(prefix='db-benchmark-')
+        configured = {key: current_app.config.get(key, default) for key, default in SQLITE_PRAGMA_DEFAULTS.items()}
+        configurations = [
+            ('SQLite defaults', f"sqlite:///{os.path.join(scratch, 'defaults.db')}", NO_PRAGMAS),
+            ('configured pragmas', f"sqlite:///{os.path.join(scratch, 'pragmas.db')}", configured),
+        ]
+
+    click.echo(f"{readers} readers, {writers} writers, {seconds:g}s per run, {rows:,} rows")
+    try:
+        for label, config_url, pragmas in configurations:
+            for run in range(1, runs + 1):
+                result = run_benchmark(config_url, pragmas, readers, writers, seconds, rows)
+                click.echo(f"{label:<32} run {run}: {result['read']:8.1f} reads/s {result['write']:8.1f} writes/s "
+                           f"{result['errors']} lock error(s)")
+    finally:
+        if scratch:
+            for name in os.listdir(scratch):
+                os.remove(os.path.join(scratch, name))
+            os.rmdir(scratch)
@@ -0,0 +1,289 @@
+import csv
+import io
+import re
+import zipfile
+import zlib
+from collections import namedtuple
+from datetime import date, datetime
+from xml.sax.saxutils import escape
+from sqlalchemy import select
+from main_app import db
+from models import (Client, IncomeTaxReturn, TDSReturn, GSTReturn, OutstandingFee, CommunicationLog,
+                    ChallanManagement, normalize_challan_status)
+from search import client_filter
+
+# Rows fetched from the database cursor and written out per step; memory use
+# depends on this, not on the size of the export
+EXPORT_BATCH = 1000
+
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', '.csv'),
+    'csv.gz': ('application/gzip', '.csv.gz'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', '.xlsx'),
+}
+
+# filename: download name stem; columns: (header, column) in output order;
+# order_by: row order; filters: request args -> WHERE criteria, shared with the list view
+ExportSpec = namedtuple('ExportSpec', ['filename', 'model', 'columns', 'order_by', 'filters'])
+
+
+def no_filters(values):
+    return []
+
+
+def clients_filters(values):
+    search = values.get('search', '')
+    return [client_filter(search)] if search else []
+
+
+def challan_filters(values):
+    """The challan list's filters from request args: (filter values, WHERE criteria)"""
+    filters = {
+        'status': values.get('status', '').strip(),
+        'client_id': values.get('client_id', type=int),
+        'tax_type': values.get('tax_type', ''),
+        'assessment_year': values.get('assessment_year', '').strip(),
+        'bank_name': values.get('bank_name', '').strip(),
+        'date_from': values.get('date_from', type=date.fromisoformat),
+        'date_to': values.get('date_to', type=date.fromisoformat),
+    }
+
+    criteria = []
+    if filters['status']:
+        # Statuses are stored normalised, so ?status=cleared matches 'Cleared'
+        filters['status'] = normalize_challan_status(filters['status'])
+        criteria.append(ChallanManagement.status == filters['status'])
+    if filters['client_id']:
+        criteria.append(ChallanManagement.client_id == filters['client_id'])
+    if filters['tax_type']:
+        criteria.append(ChallanManagement.tax_type == filters['tax_type'])
+    if filters['assessment_year']:
+        criteria.append(ChallanManagement.assessment_year == filters['assessment_year'])
+    if filters['bank_name']:
+        criteria.append(ChallanManagement.bank_name.ilike(f"%{filters['bank_name']}%"))
+    if filters['date_from']:
+        criteria.append(ChallanManagement.payment_date >= filters['date_from'])
+    if filters['date_to']:
+        criteria.append(ChallanManagement.payment_date <= filters['date_to'])
+    return filters, criteria
+
+
+EXPORTS = {
+    'income-tax': ExportSpec('income_tax_returns', IncomeTaxReturn, (
+        ('Client', Client.name), ('PAN', Client.pan), ('Assessment Year', IncomeTaxReturn.assessment_year),
+        ('Return Type', IncomeTaxReturn.return_type), ('Filing Date', IncomeTaxReturn.filing_date),
+        ('Due Date', IncomeTaxReturn.due_date), ('Total Income', IncomeTaxReturn.total_income),
+        ('Tax Payable', IncomeTaxReturn.tax_payable), ('Refund', IncomeTaxReturn.refund_amount),
+        ('Status', IncomeTaxReturn.status), ('Acknowledgment No', IncomeTaxReturn.acknowledgment_number),
+        ('Created', IncomeTaxReturn.created_at),
+    ), (IncomeTaxReturn.created_at.desc(), IncomeTaxReturn.id.desc()), no_filters),
+    'tds': ExportSpec('tds_returns', TDSReturn, (
+        ('Client', Client.name), ('TAN', TDSReturn.tan), ('Financial Year', TDSReturn.financial_year),
+        ('Quarter', TDSReturn.quarter), ('Return Type', TDSReturn.return_type),
+        ('Filing Date', TDSReturn.filing_date), ('Due Date', TDSReturn.due_date),
+        ('Total TDS', TDSReturn.total_tds), ('Status', TDSReturn.status),
+        ('Token No', TDSReturn.token_number), ('Created', TDSReturn.created_at),
+    ), (TDSReturn.created_at.desc(), TDSReturn.id.desc()), no_filters),
+    'gst': ExportSpec('gst_returns', GSTReturn, (
+        ('Client', Client.name), ('GSTIN', GSTReturn.gstin), ('Return Type', GSTReturn.return_type),
+        ('Period', GSTReturn.month_year), ('Filing Date', GSTReturn.filing_date),
+        ('Due Date', GSTReturn.due_date), ('Total Sales', GSTReturn.total_sales),
+        ('Total Tax', GSTReturn.total_tax), ('Status', GSTReturn.status), ('ARN', GSTReturn.arn_number),
+        ('Created', GSTReturn.created_at),
+    ), (GSTReturn.created_at.desc(), GSTReturn.id.desc()), no_filters),
+    'outstanding': ExportSpec('outstanding_fees', OutstandingFee, (
+        ('Client', Client.name), ('Service', OutstandingFee.service_type), ('Invoice No', OutstandingFee.invoice_number),
+        ('Amount', OutstandingFee.amount), ('Due Date', OutstandingFee.due_date), ('Status', OutstandingFee.status),
+        ('Created', OutstandingFee.created_at),
+    ), (OutstandingFee.due_date, OutstandingFee.id), no_filters),
+    'communications': ExportSpec('communication_log', CommunicationLog, (
+        ('Sent At', CommunicationLog.sent_at), ('Client', Client.name), ('Type', CommunicationLog.communication_type),
+        ('Recipient', CommunicationLog.recipient), ('Subject', CommunicationLog.subject),
+        ('Message', CommunicationLog.message), ('Status', CommunicationLog.status),
+        ('Template', CommunicationLog.template_used),
+    ), (CommunicationLog.sent_at.desc(), CommunicationLog.id.desc()), no_filters),
+    'challans': ExportSpec('challans', ChallanManagement, (
+        ('Client', Client.name), ('Challan No', ChallanManagement.challan_number),
+        ('Challan Type', ChallanManagement.challan_type), ('Tax Type', ChallanManagement.tax_type),
+        ('Assessment Year', ChallanManagement.assessment_year), ('Amount', ChallanManagement.amount),
+        ('Payment Date', ChallanManagement.payment_date), ('Bank', ChallanManagement.bank_name),
+        ('Branch', ChallanManagement.bank_branch), ('BSR Code', ChallanManagement.bsr_code),
+        ('Serial No', ChallanManagement.serial_number), ('Status', ChallanManagement.status),
+        ('Remarks', ChallanManagement.remarks),
+    ), (ChallanManagement.created_at.desc(), ChallanManagement.id.desc()), lambda values: challan_filters(values)[1]),
+    'clients': ExportSpec('clients', Client, (
+        ('Name', Client.name), ('PAN', Client.pan), ('GSTIN', Client.gstin), ('Email', Client.email),
+        ('Phone', Client.phone), ('Address', Client.address), ('Date of Birth', Client.date_of_birth),
+        ('Incorporation Date', Client.incorporation_date), ('Client Type', Client.client_type),
+        ('Status', Client.status), ('Created', Client.created_at),
+    ), (Client.created_at.desc(), Client.id.desc()), clients_filters),
+}
+
+
+def export_rows(spec, values):
+    """Batches of result tuples for an export, read from the cursor EXPORT_BATCH rows at a time"""
+    stmt = select(*[column for _, column in spec.columns]).select_from(spec.model)
+    if spec.model is not Client:
+        stmt = stmt.outerjoin(Client, Client.id == spec.model.client_id)
+    stmt = stmt.where(*spec.filters(values)).order_by(*spec.order_by)
+    result = db.session.execute(stmt.execution_options(yield_per=EXPORT_BATCH))
+    yield from result.partitions()
+
+
+def _cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+# Leading characters that make Excel/Sheets read a CSV cell as a formula
+_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _csv_cell(value):
+    """_cell() for CSV, with text that would run as a formula prefixed by a quote.
+
+    Numbers are left alone, so negative amounts stay numeric. XLSX inline
+    strings are never evaluated, so only CSV needs this.
+    """
+    value = _cell(value)
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def csv_chunks(headers, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(headers)
+    for batch in batches:
+        writer.writerows([_csv_cell(v) for v in row] for row in batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+# --- XLSX -----------------------------------------------------------------------
+# A minimal single-sheet workbook written as a streamed zip: every part but the
+# sheet is fixed, and the sheet is deflated row batch by row batch as it is read.
+
+_XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Export" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+# Characters XML 1.0 can't carry
+_XML_INVALID = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+class _Pipe(io.RawIOBase):
+    """Unseekable sink that collects what zipfile writes so the generator can hand it on"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _xlsx_row(values):
+    cells = []
+    for value in values:
+        value = _cell(value)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            text = escape(_XML_INVALID.sub('', str(value)))
+            cells.append(f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+        else:
+            cells.append(f'<c><v>{value!r}</v></c>')
+    return '<row>' + ''.join(cells) + '</row>'
+
+
+def xlsx_chunks(headers, batches):
+    pipe = _Pipe()
+    with zipfile.ZipFile(pipe, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in _XLSX_PARTS.items():
+            archive.writestr(name, content)
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                        b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+            sheet.write(_xlsx_row(headers).encode('utf-8'))
+            for batch in batches:
+                sheet.write(''.join(_xlsx_row(row) for row in batch).encode('utf-8'))
+                data = pipe.drain()
+                if data:
+                    yield data
+            sheet.write(b'</sheetData></worksheet>')
+    yield pipe.drain()
+
+
+def export_stream(name, fmt, values):
+    """(generator of body chunks, mimetype, download filename) for an export, or None if unknown"""
+    spec = EXPORTS.get(name)
+    if spec is None or fmt not in FORMATS:
+        return None
+    headers = [header for header, _ in spec.columns]
+    batches = export_rows(spec, values)
+    if fmt == 'xlsx':
+        body = xlsx_chunks(headers, batches)
+    elif fmt == 'csv.gz':
+        body = gzip_chunks(csv_chunks(headers, batches))
+    else:
+        body = csv_chunks(headers, batches)
+    mimetype, extension = FORMATS[fmt]
+    return body, mimetype, f"{spec.filename}_{date.today().isoformat()}{extension}"
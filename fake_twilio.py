@@ -0,0 +1,113 @@
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import click
+
+_MESSAGES_PATH = re.compile(r'^/2010-04-01/Accounts/(\w+)/Messages\.json$')
+
+
+class FakeTwilioServer(ThreadingHTTPServer):
+    """Local stand-in for Twilio's Messages API.
+
+    Point TWILIO_API_BASE at it to run the SMS pipeline offline. `latency`
+    delays every response, `failure_rate` answers that share of requests with
+    a retryable 429/503, and numbers that aren't E.164 are rejected with 400
+    like the real API. `stats` counts requests by outcome.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 8099), latency=0.0, failure_rate=0.0):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.stats = Counter()
+        self.messages = []
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record(self, outcome, message=None):
+        with self._lock:
+            self.stats[outcome] += 1
+            if message:
+                self.messages.append(message)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='fake-twilio', daemon=True).start()
+        return self
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        match = _MESSAGES_PATH.match(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+        if server.latency:
+            time.sleep(server.latency)
+
+        if not match:
+            server.record('not_found')
+            return self._reply(404, {'code': 20404, 'message': 'The requested resource was not found'})
+        if not self.headers.get('Authorization', '').startswith('Basic '):
+            server.record('unauthorized')
+            return self._reply(401, {'code': 20003, 'message': 'Authenticate'})
+        if server.failure_rate and random.random() < server.failure_rate:
+            status = random.choice((429, 503))
+            server.record(f'error_{status}')
+            return self._reply(status, {'code': 20429 if status == 429 else 20500,
+                                        'message': 'Too Many Requests' if status == 429 else 'Service Unavailable'})
+        to = form.get('To', '')
+        if not re.fullmatch(r'\+\d{7,15}', to):
+            server.record('invalid_number')
+            return self._reply(400, {'code': 21211, 'message': f"The 'To' number {to} is not a valid phone number."})
+
+        message = {
+            'sid': 'SM' + uuid.uuid4().hex,
+            'account_sid': match.group(1),
+            'to': to,
+            'from': form.get('From'),
+            'body': form.get('Body', ''),
+            'status': 'queued',
+        }
+        server.record('accepted', message)
+        self._reply(201, message)
+
+
+@click.command('fake-twilio')
+@click.option('--port', default=8099, show_default=True)
+@click.option('--latency', default=0.05, show_default=True, help='Seconds to wait before each response.')
+@click.option('--failure-rate', default=0.0, show_default=True, help='Share of requests answered with 429/503.')
+def fake_twilio_command(port, latency, failure_rate):
+    """Run a local fake of Twilio's Messages API for offline SMS testing."""
+    server = FakeTwilioServer(('127.0.0.1', port), latency=latency, failure_rate=failure_rate)
+    click.echo(f"Fake Twilio listening on {server.base_url}; set TWILIO_API_BASE to this URL.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        click.echo(f"Requests: {dict(server.stats)}")
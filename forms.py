@@ -3,8 +3,65 @@ from flask_wtf.file import FileField, FileAllowed
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileAllowed
 from wtforms import StringField, PasswordField, SelectField, SubmitField, TextAreaField, DateField, FloatField, IntegerField, BooleanField, HiddenField
-from wtforms.validators import DataRequired, InputRequired, Email, Length, Optional, NumberRange, Regexp
+from wtforms.validators import DataRequired, InputRequired, Email, Length, Optional, NumberRange, Regexp, ValidationError
 from wtforms.widgets import TextArea
+from flask import url_for
+from choices import get_client_choices, client_choice_exists, get_client_name, use_typeahead
+
+
+class ClientSelectField(SelectField):
+    """Client picker fed from the cached (id, name) list.
+
+    Choices are loaded lazily, and above CLIENT_PICKER_TYPEAHEAD_THRESHOLD clients
+    only the selected option is rendered; main.js turns the select into an AJAX
+    typeahead using the data-typeahead-url attribute.
+    """
+
+    def __init__(self, label=None, validators=None, active_only=False, placeholder=None, **kwargs):
+        kwargs.setdefault('coerce', int)
+        self.active_only = active_only
+        self.placeholder = placeholder
+        self._choices = None
+        super().__init__(label, validators, **kwargs)
+
+    @property
+    def choices(self):
+        if self._choices is not None:
+            return self._choices
+        prefix = [(0, self.placeholder)] if self.placeholder else []
+        if use_typeahead():
+            name = get_client_name(self.data) if self.data else None
+            return prefix + ([(self.data, name)] if name else [])
+        return prefix + get_client_choices(self.active_only)
+
+    @choices.setter
+    def choices(self, value):
+        # Explicitly assigned choices still win over the cache
+        self._choices = value
+
+    def pre_validate(self, form):
+        if self._choices is not None:
+            return super().pre_validate(form)
+        if self.placeholder and not self.data:
+            return
+        if not client_choice_exists(self.data, self.active_only):
+            raise ValidationError(self.gettext('Not a valid choice.'))
+
+    def __call__(self, **kwargs):
+        if self._choices is None and use_typeahead():
+            kwargs.setdefault('data-typeahead-url', url_for(
+                'main.api_client_choices', active=1 if self.active_only else None))
+        return super().__call__(**kwargs)
+
+    def render_for(self, client_id, **kwargs):
+        """Render the picker with another record's client selected (per-row edit modals)"""
+        original = self.data
+        self.data = client_id
+        try:
+            kwargs.setdefault('id', False)
+            return self(**kwargs)
+        finally:
+            self.data = original
 
 
 class LoginForm(FlaskForm):
@@ -63,7 +120,7 @@ class ClientForm(FlaskForm):
     ], default='Active', validators=[DataRequired(message="Status is required")])
 
 class IncomeTaxReturnForm(FlaskForm):
-    client_id = SelectField('Client', coerce=int, validators=[DataRequired()])
+    client_id = ClientSelectField('Client', validators=[DataRequired()], active_only=True)
     assessment_year = StringField('Assessment Year', validators=[DataRequired(), Length(max=10)])
     return_type = SelectField('Return Type', choices=[
         ('ITR-1', 'ITR-1'),
@@ -87,7 +144,7 @@ class IncomeTaxReturnForm(FlaskForm):
     acknowledgment_number = StringField('Acknowledgment Number', validators=[Optional(), Length(max=50)])
 
 class TDSReturnForm(FlaskForm):
-    client_id = SelectField('Client', coerce=int, validators=[DataRequired()])
+    client_id = ClientSelectField('Client', validators=[DataRequired()], active_only=True)
     tan = StringField('TAN', validators=[DataRequired(), Length(min=10, max=10)])
     quarter = SelectField('Quarter', choices=[
         ('Q1', 'Q1 (Apr-Jun)'),
@@ -113,7 +170,7 @@ class TDSReturnForm(FlaskForm):
     token_number = StringField('Token Number', validators=[Optional(), Length(max=50)])
 
 class GSTReturnForm(FlaskForm):
-    client_id = SelectField('Client', coerce=int, validators=[DataRequired()])
+    client_id = ClientSelectField('Client', validators=[DataRequired()], active_only=True)
     gstin = StringField('GSTIN', validators=[DataRequired(), Length(min=15, max=15)])
     return_type = SelectField('Return Type', choices=[
         ('GSTR-1', 'GSTR-1'),
@@ -176,7 +233,7 @@ class PayrollEntryForm(FlaskForm):
     tds_deduction = FloatField('TDS Deduction', validators=[Optional(), NumberRange(min=0)])
 
 class DocumentForm(FlaskForm):
-    client_id = SelectField('Client', coerce=int, validators=[Optional()])
+    client_id = ClientSelectField('Client', validators=[Optional()], active_only=True, placeholder='Select Client')
     title = StringField('Document Title', validators=[DataRequired(), Length(max=200)])
     document_type = SelectField('Document Type', choices=[
         ('PAN Card', 'PAN Card'),
@@ -193,7 +250,7 @@ class DocumentForm(FlaskForm):
     notes = TextAreaField('Notes', validators=[Optional()])
 
 class OutstandingFeeForm(FlaskForm):
-    client_id = SelectField('Client', coerce=int, validators=[DataRequired()])
+    client_id = ClientSelectField('Client', validators=[DataRequired()], active_only=True)
     service_type = StringField('Service Type', validators=[DataRequired(), Length(max=100)])
     amount = FloatField('Amount', validators=[DataRequired(), NumberRange(min=0)])
     due_date = DateField('Due Date', validators=[Optional()])
@@ -212,7 +269,7 @@ class UserForm(FlaskForm):
     is_active = BooleanField('Active')
 
 class ReminderForm(FlaskForm):
-    client_id = SelectField('Client', coerce=int, validators=[Optional()])
+    client_id = ClientSelectField('Client', validators=[Optional()], placeholder='Select Client')
     title = StringField('Title', validators=[DataRequired(), Length(max=200)])
     description = TextAreaField('Description', validators=[Optional()])
     reminder_date = DateField('Reminder Date', validators=[DataRequired()])
@@ -225,7 +282,7 @@ class ReminderForm(FlaskForm):
     ], validators=[DataRequired()])
 
 class ROCFormForm(FlaskForm):
-    client_id = SelectField('Client', coerce=int, validators=[DataRequired()])
+    client_id = ClientSelectField('Client', validators=[DataRequired()])
     form_type = SelectField('Form Type', choices=[
         ('AOC-4', 'AOC-4 (Financial Statements)'),
         ('MGT-7', 'MGT-7 (Annual Return)'),
@@ -248,7 +305,7 @@ class ROCFormForm(FlaskForm):
     late_fee = FloatField('Late Fee', validators=[Optional(), NumberRange(min=0)])
 
 class SFTReturnForm(FlaskForm):
-    client_id = SelectField('Client', coerce=int, validators=[DataRequired()])
+    client_id = ClientSelectField('Client', validators=[DataRequired()])
     financial_year = StringField('Financial Year', validators=[DataRequired(), Length(max=10)])
     form_type = SelectField('Form Type', choices=[
         ('SFT-001', 'SFT-001 (Statement of Financial Transaction)'),
@@ -266,7 +323,7 @@ class SFTReturnForm(FlaskForm):
     ], default='Pending')
 
 class BalanceSheetAuditForm(FlaskForm):
-    client_id = SelectField('Client', coerce=int, validators=[DataRequired()])
+    client_id = ClientSelectField('Client', validators=[DataRequired()])
     financial_year = StringField('Financial Year', validators=[DataRequired(), Length(max=10)])
     audit_type = SelectField('Audit Type', choices=[
         ('Statutory', 'Statutory Audit'),
@@ -297,7 +354,7 @@ class BalanceSheetAuditForm(FlaskForm):
     ], default='In Progress')
 
 class CMAReportForm(FlaskForm):
-    client_id = SelectField('Client', coerce=int, validators=[DataRequired()])
+    client_id = ClientSelectField('Client', validators=[DataRequired()])
     reporting_period = SelectField('Reporting Period', choices=[
         ('Monthly', 'Monthly'),
         ('Quarterly', 'Quarterly'),
@@ -320,7 +377,7 @@ class CMAReportForm(FlaskForm):
     ], default='Draft')
 
 class AssessmentOrderForm(FlaskForm):
-    client_id = SelectField('Client', coerce=int, validators=[DataRequired()])
+    client_id = ClientSelectField('Client', validators=[DataRequired()])
     assessment_year = StringField('Assessment Year', validators=[DataRequired(), Length(max=10)])
     order_type = SelectField('Order Type', choices=[
         ('Scrutiny', 'Scrutiny Assessment'),
@@ -347,7 +404,7 @@ class AssessmentOrderForm(FlaskForm):
     remarks = TextAreaField('Remarks', validators=[Optional()])
 
 class XBRLReportForm(FlaskForm):
-    client_id = SelectField('Client', coerce=int, validators=[DataRequired()])
+    client_id = ClientSelectField('Client', validators=[DataRequired()])
     financial_year = StringField('Financial Year', validators=[DataRequired(), Length(max=10)])
     report_type = SelectField('Report Type', choices=[
         ('Balance Sheet', 'Balance Sheet'),
@@ -380,7 +437,7 @@ class XBRLReportForm(FlaskForm):
     ], default='Draft')
 
 class ChallanManagementForm(FlaskForm):
-    client_id = SelectField('Client', coerce=int, validators=[DataRequired()])
+    client_id = ClientSelectField('Client', validators=[DataRequired()])
     challan_number = StringField('Challan Number', validators=[DataRequired()])
     challan_type = SelectField('Challan Type', choices=[
         ('ITNS 281', 'ITNS 281'),
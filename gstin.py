@@ -0,0 +1,192 @@
+import csv
+import re
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy import select, update
+from main_app import db
+from database import upsert
+from models import GSTValidation
+
+# GST state codes (first two characters of a GSTIN)
+STATE_CODES = {
+    '01': 'Jammu and Kashmir',
+    '02': 'Himachal Pradesh',
+    '03': 'Punjab',
+    '04': 'Chandigarh',
+    '05': 'Uttarakhand',
+    '06': 'Haryana',
+    '07': 'Delhi',
+    '08': 'Rajasthan',
+    '09': 'Uttar Pradesh',
+    '10': 'Bihar',
+    '11': 'Sikkim',
+    '12': 'Arunachal Pradesh',
+    '13': 'Nagaland',
+    '14': 'Manipur',
+    '15': 'Mizoram',
+    '16': 'Tripura',
+    '17': 'Meghalaya',
+    '18': 'Assam',
+    '19': 'West Bengal',
+    '20': 'Jharkhand',
+    '21': 'Odisha',
+    '22': 'Chhattisgarh',
+    '23': 'Madhya Pradesh',
+    '24': 'Gujarat',
+    '25': 'Daman and Diu',
+    '26': 'Dadra and Nagar Haveli and Daman and Diu',
+    '27': 'Maharashtra',
+    '28': 'Andhra Pradesh (Before Division)',
+    '29': 'Karnataka',
+    '30': 'Goa',
+    '31': 'Lakshadweep',
+    '32': 'Kerala',
+    '33': 'Tamil Nadu',
+    '34': 'Puducherry',
+    '35': 'Andaman and Nicobar Islands',
+    '36': 'Telangana',
+    '37': 'Andhra Pradesh',
+    '38': 'Ladakh',
+    '97': 'Other Territory',
+    '99': 'Centre Jurisdiction',
+}
+
+# Fourth character of the embedded PAN: the holder's constitution
+PAN_HOLDER_TYPES = {
+    'A': 'Association of Persons',
+    'B': 'Body of Individuals',
+    'C': 'Company',
+    'F': 'Firm / LLP',
+    'G': 'Government',
+    'H': 'Hindu Undivided Family',
+    'J': 'Artificial Juridical Person',
+    'L': 'Local Authority',
+    'P': 'Individual / Proprietorship',
+    'T': 'Trust',
+}
+
+ERROR_MESSAGES = {
+    'length': 'GSTIN must be 15 characters',
+    'format': 'GSTIN does not follow the state code + PAN + entity + Z + check digit layout',
+    'state-code': 'Unknown state code',
+    'pan-type': 'Embedded PAN has an unknown holder type',
+    'checksum': 'Check digit does not match',
+}
+
+# Distinct GSTINs accepted by one batch request, and rows per bulk upsert
+BATCH_LIMIT = 50000
+SAVE_CHUNK = 1000
+
+GSTINCheck = namedtuple('GSTINCheck', ['gstin', 'is_valid', 'error', 'state_code', 'state_name', 'pan', 'constitution'])
+
+_CHARSET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+_LAYOUT = re.compile(r'[0-9]{2}[A-Z]{5}[0-9]{4}[A-Z][1-9A-Z]Z[0-9A-Z]')
+
+# The check digit is a Luhn mod 36 over the first 14 characters with weights
+# alternating 1, 2. Each position's (value * weight) folded back into base 36
+# is precomputed, so checking a GSTIN is 14 dict lookups and a sum.
+_WEIGHTED = tuple(
+    {c: sum(divmod(v * (1 + i % 2), 36)) for v, c in enumerate(_CHARSET)}
+    for i in range(14)
+)
+
+
+def check_digit(body):
+    """Check character for the first 14 characters of a GSTIN"""
+    total = sum(table[c] for table, c in zip(_WEIGHTED, body))
+    return _CHARSET[(36 - total % 36) % 36]
+
+
+def normalize_gstin(value):
+    return re.sub(r'\s+', '', str(value or '')).upper()
+
+
+def check_gstin(gstin):
+    """Offline structural check of one normalized GSTIN"""
+    if len(gstin) != 15:
+        return GSTINCheck(gstin, False, 'length', None, None, None, None)
+    if not _LAYOUT.fullmatch(gstin):
+        return GSTINCheck(gstin, False, 'format', None, None, None, None)
+    state_code, pan = gstin[:2], gstin[2:12]
+    state_name = STATE_CODES.get(state_code)
+    constitution = PAN_HOLDER_TYPES.get(pan[3])
+    if state_name is None:
+        error = 'state-code'
+    elif constitution is None:
+        error = 'pan-type'
+    elif check_digit(gstin[:14]) != gstin[14]:
+        error = 'checksum'
+    else:
+        error = None
+    return GSTINCheck(gstin, error is None, error, state_code, state_name, pan, constitution)
+
+
+def check_gstins(values):
+    """Check many GSTINs in one pass; returns {normalized gstin: GSTINCheck} in first-seen order"""
+    results = {}
+    for value in values:
+        gstin = normalize_gstin(value)
+        if gstin and gstin not in results:
+            results[gstin] = check_gstin(gstin)
+    return results
+
+
+def save_checks(checks, source='Offline'):
+    """Upsert GSTValidation rows for the checks, one statement per chunk; the caller commits.
+
+    Only the columns an offline check can vouch for are written, so names and
+    registration details recorded from other sources are kept.
+    """
+    now = datetime.utcnow()
+    rows = [{'gstin': c.gstin, 'is_valid': c.is_valid, 'state_code': c.state_code, 'state_name': c.state_name,
+             'constitution': c.constitution, 'last_validated': now, 'validation_source': source}
+            for c in checks if len(c.gstin) == 15]
+    columns = ['is_valid', 'state_code', 'state_name', 'constitution', 'last_validated', 'validation_source']
+    stmt = upsert(GSTValidation, db.session.get_bind().dialect.name, ['gstin'], update_columns=columns)
+
+    for i in range(0, len(rows), SAVE_CHUNK):
+        chunk = rows[i:i + SAVE_CHUNK]
+        if stmt is not None:
+            db.session.execute(stmt, chunk)
+            continue
+        existing = dict(db.session.execute(
+            select(GSTValidation.gstin, GSTValidation.id).where(GSTValidation.gstin.in_([r['gstin'] for r in chunk]))
+        ).all())
+        updates = [dict(r, id=existing[r['gstin']]) for r in chunk if r['gstin'] in existing]
+        inserts = [r for r in chunk if r['gstin'] not in existing]
+        if updates:
+            db.session.execute(update(GSTValidation), updates)
+        if inserts:
+            db.session.execute(GSTValidation.__table__.insert(), inserts)
+    return len(rows)
+
+
+def gstins_from_csv(lines):
+    """GSTIN values from CSV lines: the 'gstin' column when there is a header row, else the first column"""
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    names = [h.strip().lower() for h in header]
+    if 'gstin' in names:
+        column = names.index('gstin')
+    else:
+        column = 0
+        if header and len(normalize_gstin(header[0])) == 15:  # no header row, just data
+            yield header[0]
+    for row in reader:
+        if len(row) > column:
+            yield row[column]
+
+
+def check_to_dict(check):
+    return {
+        'gstin': check.gstin,
+        'is_valid': check.is_valid,
+        'error': check.error,
+        'message': ERROR_MESSAGES.get(check.error),
+        'state_code': check.state_code,
+        'state_name': check.state_name,
+        'pan': check.pan,
+        'constitution': check.constitution,
+    }
@@ -0,0 +1,199 @@
+import logging
+from datetime import date, datetime, timedelta
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func, inspect, or_, select, tuple_
+from main_app import db
+from database import in_months, month_starts, on_day, year_month
+from models import (Client, IncomeTaxReturn, TDSReturn, GSTReturn, Document, OutstandingFee, Reminder,
+                    ReturnTracker, CommunicationLog, ClientNote, DocumentChecklist, DocumentChecklistItem, ChallanManagement,
+                    ROCForm, SFTReturn, GSTValidation, Task, EmailJob, EmailJobRecipient, ReminderSource,
+                    ComplianceCalendar, SMSJob, SMSJobRecipient)
+
+logger = logging.getLogger(__name__)
+
+
+def ensure_indexes(engine):
+    """Create declared indexes missing from an existing database.
+
+    db.create_all() only emits CREATE INDEX for tables it creates, so indexes
+    added to models.py after a database was first set up need this pass.
+    """
+    created = 0
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        for table in db.metadata.sorted_tables:
+            existing = {ix['name'] for ix in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(conn)
+                    created += 1
+    if created:
+        logger.info("Created %d missing database indexes", created)
+    return created
+
+
+def _query_catalogue():
+    """Representative statements behind the dashboard, list views and schedulers"""
+    today = date.today()
+    now = datetime.now()
+    page = 21  # per_page + 1, as fetched by keyset_paginate
+    catalogue = {
+        'dashboard: pending ITR count': select(func.count(IncomeTaxReturn.id)).where(IncomeTaxReturn.status == 'Pending'),
+        'dashboard: pending TDS count': select(func.count(TDSReturn.id)).where(TDSReturn.status == 'Pending'),
+        'dashboard: pending GST count': select(func.count(GSTReturn.id)).where(GSTReturn.status == 'Pending'),
+        'dashboard: pending fees total': select(func.sum(OutstandingFee.amount)).where(OutstandingFee.status == 'Pending'),
+        'dashboard: upcoming reminders': select(Reminder)
+            .where(Reminder.reminder_date >= today, Reminder.status == 'Active')
+            .order_by(Reminder.reminder_date).limit(5),
+        'client picker: active clients': select(Client.id, Client.name)
+            .where(Client.status == 'Active').order_by(Client.name),
+        'client picker: all clients': select(Client.id, Client.name).order_by(Client.name),
+        'clients: list page': select(Client).order_by(Client.created_at.desc(), Client.id.desc()).limit(page),
+        'documents: list page': select(Document)
+            .where(tuple_(Document.upload_date, Document.id) < tuple_(now, 1_000_000))
+            .order_by(Document.upload_date.desc(), Document.id.desc()).limit(page),
+        'documents: by client': select(Document).where(Document.client_id == 1)
+            .order_by(Document.upload_date.desc()),
+        'outstanding: list page': select(OutstandingFee)
+            .join(Client, Client.id == OutstandingFee.client_id)
+            .where(tuple_(OutstandingFee.due_date, OutstandingFee.id) > tuple_(today, 0))
+            .order_by(OutstandingFee.due_date, OutstandingFee.id).limit(page),
+        'outstanding: overdue count': select(func.count(OutstandingFee.id))
+            .where(OutstandingFee.status == 'Overdue', OutstandingFee.due_date < today),
+        'outstanding: six-month trend': select(year_month(OutstandingFee.created_at), func.sum(OutstandingFee.amount))
+            .where(in_months(OutstandingFee.created_at, month_starts(today, 6)[0], today))
+            .group_by(year_month(OutstandingFee.created_at)),
+        'outstanding: latest fee for client': select(OutstandingFee).where(OutstandingFee.client_id == 1)
+            .order_by(OutstandingFee.due_date.desc()).limit(1),
+        'reminders: list page': select(Reminder)
+            .order_by(Reminder.reminder_date.desc(), Reminder.id.desc()).limit(page),
+        'reminders: due this week': select(Reminder)
+            .where(Reminder.status == 'Active', Reminder.reminder_date <= now + timedelta(days=7))
+            .order_by(Reminder.reminder_date),
+        'reminders: fee reminder sent today': select(Reminder)
+            .where(Reminder.client_id == 1, Reminder.fee_id == 1, on_day(Reminder.reminder_date, today))
+            .limit(1),
+        'scheduler: reminders due soon': select(Reminder.reminder_date, Reminder.id)
+            .where(Reminder.notification_sent == False,  # noqa: E712
+                   Reminder.status == 'Active', Reminder.reminder_date < now + timedelta(minutes=10)),
+        'scheduler: reminders for sources': select(ReminderSource.source_id)
+            .where(ReminderSource.source == 'fees', ReminderSource.source_id.in_([1, 2, 3])),
+        'auto reminders: rules for user': select(Reminder)
+            .where(Reminder.created_by == 1, Reminder.auto_created.is_(True)),
+        'return tracker: by due date': select(ReturnTracker).order_by(ReturnTracker.due_date),
+        'return tracker: filtered by type': select(ReturnTracker)
+            .where(ReturnTracker.return_type.like('GST%')).order_by(ReturnTracker.due_date),
+        'return tracker: overdue sweep': select(ReturnTracker.id)
+            .where(ReturnTracker.status == 'Pending', ReturnTracker.due_date < date.today()),
+        'communications: recent log': select(CommunicationLog)
+            .order_by(CommunicationLog.sent_at.desc()).limit(100),
+        'email queue: claim batch': select(EmailJobRecipient.id)
+            .where(EmailJobRecipient.status == 'Pending',
+                   EmailJobRecipient.job_id.in_(select(EmailJob.id).where(EmailJob.status.in_(('Queued', 'Running')))),
+                   or_(EmailJobRecipient.next_attempt_at.is_(None), EmailJobRecipient.next_attempt_at <= now))
+            .order_by(EmailJobRecipient.job_id, EmailJobRecipient.id).limit(50),
+        'email queue: open recipients for job': select(EmailJobRecipient.id)
+            .where(EmailJobRecipient.job_id == 1, EmailJobRecipient.status.in_(('Pending', 'Sending'))).limit(1),
+        'sms queue: claim batch': select(SMSJobRecipient.id)
+            .where(SMSJobRecipient.status == 'Pending',
+                   SMSJobRecipient.job_id.in_(select(SMSJob.id).where(SMSJob.status.in_(('Queued', 'Running')))))
+            .order_by(SMSJobRecipient.job_id, SMSJobRecipient.id).limit(100),
+        'sms queue: stale claims': select(SMSJobRecipient.id)
+            .where(SMSJobRecipient.status == 'Sending', SMSJobRecipient.claimed_at < now - timedelta(minutes=10)),
+        'communications: SMS this month': select(func.count(CommunicationLog.id))
+            .where(CommunicationLog.communication_type == 'SMS',
+                   CommunicationLog.sent_at >= today.replace(day=1)),
+        'compliance calendar: next 30 days': select(ComplianceCalendar)
+            .where(ComplianceCalendar.due_date >= today, ComplianceCalendar.due_date <= today + timedelta(days=30),
+                   ComplianceCalendar.status == 'Pending')
+            .order_by(ComplianceCalendar.due_date, ComplianceCalendar.id),
+        'compliance calendar: client year': select(ComplianceCalendar.id)
+            .where(ComplianceCalendar.client_id.in_([1, 2, 3]), ComplianceCalendar.financial_year == '2025-26'),
+        'client notes: by client': select(ClientNote).where(ClientNote.client_id == 1)
+            .order_by(ClientNote.created_at.desc()),
+        'client notes: recent': select(ClientNote).order_by(ClientNote.created_at.desc()).limit(page),
+        'document checklists: by due date': select(DocumentChecklist).order_by(DocumentChecklist.due_date),
+        'document checklists: item counts': select(DocumentChecklistItem.checklist_id, func.count())
+            .where(DocumentChecklistItem.received.is_(True)).group_by(DocumentChecklistItem.checklist_id),
+        'challans: list': select(ChallanManagement).order_by(ChallanManagement.created_at.desc()).limit(page),
+        'challans: by status and payment date': select(ChallanManagement)
+            .where(ChallanManagement.status == 'Pending', ChallanManagement.payment_date >= today - timedelta(days=90))
+            .order_by(ChallanManagement.created_at.desc()).limit(page),
+        'challans: totals by status': select(ChallanManagement.status, func.count(), func.sum(ChallanManagement.amount))
+            .group_by(ChallanManagement.status),
+        'ROC forms: by client': select(ROCForm).where(ROCForm.client_id == 1).order_by(ROCForm.created_at.desc()),
+        'GST validations: recent': select(GSTValidation).order_by(GSTValidation.last_validated.desc()).limit(10),
+        'tasks: by start date': select(Task).order_by(Task.start_date.desc()),
+    }
+    for model in (IncomeTaxReturn, TDSReturn, GSTReturn):
+        name = model.__tablename__.replace('_', ' ')
+        catalogue[f'{name}: list page'] = (
+            select(model).join(Client)
+            .where(tuple_(model.created_at, model.id) < tuple_(now, 1_000_000))
+            .order_by(model.created_at.desc(), model.id.desc()).limit(page)
+        )
+        catalogue[f'{name}: by client'] = select(model).where(model.client_id == 1).order_by(model.created_at.desc())
+    # Global search: each identifier is matched by prefix range in its own query
+    for col in (IncomeTaxReturn.acknowledgment_number, TDSReturn.tan, TDSReturn.token_number, GSTReturn.gstin,
+                GSTReturn.arn_number, ChallanManagement.challan_number, ROCForm.acknowledgment_number,
+                ROCForm.form_type, SFTReturn.acknowledgment_number):
+        catalogue[f'global search: {col.table.name}.{col.name} prefix'] = (
+            select(col.table).where(col >= '27AB', col < '27AC').order_by(col.table.c.created_at.desc()).limit(8)
+        )
+    return catalogue
+
+
+def explain(conn, stmt):
+    """EXPLAIN QUERY PLAN rows (detail strings) for a statement on a SQLite connection"""
+    compiled = stmt.compile(dialect=conn.dialect, compile_kwargs={"render_postcompile": True})
+    params = tuple(compiled.params[name] for name in compiled.positiontup or ())
+    rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params).all()
+    return [row[-1] for row in rows]
+
+
+def _is_full_scan(detail):
+    # "SCAN clients" reads the whole table; "SCAN clients USING INDEX ..." walks an index in order
+    return detail.startswith('SCAN ') and ' USING ' not in detail
+
+
+def advise(engine):
+    """Run the query catalogue through EXPLAIN QUERY PLAN -> [(name, plan, full scans, temp sorts)]"""
+    report = []
+    with engine.connect() as conn:
+        for name, stmt in _query_catalogue().items():
+            plan = explain(conn, stmt)
+            scans = [d for d in plan if _is_full_scan(d)]
+            sorts = [d for d in plan if 'USE TEMP B-TREE' in d]
+            report.append((name, plan, scans, sorts))
+    return report
+
+
+@click.command('db-advise')
+@click.option('--verbose', '-v', is_flag=True, help='Print the full plan for every query.')
+@click.option('--strict', is_flag=True, help='Exit with status 1 if any query does a full table scan.')
+@with_appcontext
+def db_advise_command(verbose, strict):
+    """Report full table scans in the app's common queries."""
+    engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        raise click.ClickException("db-advise reads SQLite's EXPLAIN QUERY PLAN output; "
+                                   f"the configured database is {engine.dialect.name}.")
+
+    report = advise(engine)
+    flagged = 0
+    for name, plan, scans, sorts in report:
+        if scans:
+            flagged += 1
+            click.secho(f"FULL SCAN  {name}", fg='red')
+        elif sorts:
+            click.secho(f"TEMP SORT  {name}", fg='yellow')
+        elif verbose:
+            click.echo(f"ok         {name}")
+        if verbose or scans or sorts:
+            for detail in plan:
+                click.echo(f"             {detail}")
+
+    click.echo(f"\n{len(report)} queries checked, {flagged} with full table scans.")
+    if strict and flagged:
+        raise SystemExit(1)
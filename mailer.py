@@ -0,0 +1,507 @@
+import itertools
+import logging
+import queue
+import smtplib
+import ssl
+import threading
+import time
+import uuid
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from sqlalchemy import insert, or_, select, update
+from main_app import db
+from mailmerge import MailMerge
+from models import Client, CommunicationLog, Configuration, EmailJob, EmailJobRecipient
+
+logger = logging.getLogger(__name__)
+
+# Dispatcher settings; each can be overridden in app.config
+EMAIL_DEFAULTS = {
+    'EMAIL_WORKERS': 2,              # worker threads, each holding one long-lived SMTP connection
+    'EMAIL_RATE_LIMIT': 5,           # messages per second across all workers; 0 disables throttling
+    'EMAIL_MAX_ATTEMPTS': 3,         # tries per recipient before it is marked Failed
+    'EMAIL_RETRY_DELAY': 30,         # seconds before the first retry; doubles on each further attempt
+    'EMAIL_CLAIM_BATCH': 50,         # recipients picked up from the queue table at a time
+    'EMAIL_LOG_BATCH': 50,           # outcomes written to CommunicationLog per commit
+    'EMAIL_FLUSH_INTERVAL': 1.0,     # seconds before a partial batch of outcomes is written anyway
+    'EMAIL_POLL_INTERVAL': 5.0,      # seconds between queue checks when idle
+    'EMAIL_CLAIM_TIMEOUT': 600,      # seconds after which a 'Sending' row from a dead process is requeued
+    'EMAIL_SMTP_TIMEOUT': 30,
+    'EMAIL_SMTP_IDLE_TIMEOUT': 60,   # idle seconds before a worker closes its SMTP connection
+    'EMAIL_SMTP_MAX_MESSAGES': 100,  # messages per connection before reconnecting (provider limits)
+    'EMAIL_DISPATCHER_AUTOSTART': True,  # start on the first request a process serves
+}
+
+# Port for SMTP over implicit TLS; other ports use STARTTLS
+SMTPS_PORT = 465
+
+# (host, port, login, password) identifying one SMTP account
+SMTPSettings = namedtuple('SMTPSettings', ['host', 'port', 'login', 'password'])
+
+_Task = namedtuple('_Task', ['recipient_id', 'job_id', 'client_id', 'client_name', 'attempts',
+                             'smtp', 'sender', 'to', 'subject', 'body'])
+_Outcome = namedtuple('_Outcome', ['task', 'ok', 'permanent', 'fatal', 'skipped', 'error'])
+
+
+class RateLimiter:
+    """Token bucket shared by the worker threads"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class InsecureSMTPError(smtplib.SMTPException):
+    """The server offers no TLS, so the account password would be sent in plain text"""
+
+
+class SMTPSession:
+    """One reusable SMTP connection; reconnects lazily after errors or max_messages sends"""
+
+    def __init__(self, settings, timeout=30, max_messages=100):
+        self.settings = settings
+        self.timeout = timeout
+        self.max_messages = max_messages
+        self._conn = None
+        self._sent = 0
+        self.last_used = 0.0
+
+    def _connect(self):
+        context = ssl.create_default_context()
+        if self.settings.port == SMTPS_PORT:
+            conn = smtplib.SMTP_SSL(self.settings.host, self.settings.port, timeout=self.timeout, context=context)
+            conn.ehlo()
+        else:
+            conn = smtplib.SMTP(self.settings.host, self.settings.port, timeout=self.timeout)
+            conn.ehlo()
+            if conn.has_extn('starttls'):
+                conn.starttls(context=context)
+                conn.ehlo()
+            elif self.settings.password:
+                conn.close()
+                raise InsecureSMTPError(f"{self.settings.host} does not offer STARTTLS; refusing to send the "
+                                        f"password unencrypted (use port {SMTPS_PORT} for implicit TLS)")
+        if self.settings.password and conn.has_extn('auth'):
+            conn.login(self.settings.login, self.settings.password)
+        self._conn = conn
+        self._sent = 0
+
+    def send(self, message):
+        if self._conn is None or self._sent >= self.max_messages:
+            self.close()
+            self._connect()
+        self._conn.send_message(message)
+        self._sent += 1
+        self.last_used = time.monotonic()
+
+    def close(self):
+        if self._conn is not None:
+            try:
+                self._conn.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._conn = None
+
+
+def _classify(exc):
+    """(permanent, fatal) for an SMTP failure; fatal errors stop the whole job"""
+    if isinstance(exc, (smtplib.SMTPAuthenticationError, InsecureSMTPError, ssl.SSLCertVerificationError)):
+        return True, True
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        # 4xx per-recipient codes (mailbox busy, greylisting) are temporary
+        return all(code >= 500 for code, _ in exc.recipients.values()), False
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return exc.smtp_code >= 500, False
+    # Disconnects, timeouts and socket errors are worth retrying
+    return False, False
+
+
+def smtp_settings_for(user_id):
+    config = Configuration.query.filter_by(user_id=user_id, type='email', status='Configured').first()
+    if not config:
+        return None, None
+    return SMTPSettings(config.smtp_server, config.smtp_port, config.email_address, config.email_password), \
+        config.email_address
+
+
+class EmailDispatcher:
+    """Background sender for EmailJob rows.
+
+    A coordinator thread claims batches of pending recipients from the
+    database, renders them and hands them to worker threads, then writes the
+    outcomes back (CommunicationLog rows, recipient status, job counters) in
+    batched commits. Because the queue lives in the database, jobs survive
+    restarts and several processes can share it safely.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._tasks = queue.Queue()
+        self._results = queue.Queue()
+        self._wake = threading.Event()
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._cancelled_jobs = set()
+        self._in_flight = 0
+        self._job_tasks = Counter()  # tasks per job claimed but not yet drained
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['email_dispatcher'] = self
+        # Started by the first request a process serves, so one-shot `flask` commands and
+        # pool workers (e.g. the XBRL validator's) that import the app never claim recipients
+        app.before_request(self._start_on_request)
+
+    def setting(self, key):
+        return self.app.config.get(key, EMAIL_DEFAULTS[key])
+
+    def _start_on_request(self):
+        # The setting is read per request, so it can still be switched off after init_app (tests)
+        if not self._started and self.setting('EMAIL_DISPATCHER_AUTOSTART'):
+            self.start()
+
+    def start(self):
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+        self._limiter = RateLimiter(self.setting('EMAIL_RATE_LIMIT'))
+        threading.Thread(target=self._coordinate, name='email-dispatcher', daemon=True).start()
+        for i in range(self.setting('EMAIL_WORKERS')):
+            threading.Thread(target=self._work, name=f'email-worker-{i}', daemon=True).start()
+
+    def wake(self):
+        """Pick up newly queued work now instead of at the next poll"""
+        self._wake.set()
+
+    # --- Coordinator ----------------------------------------------------------
+
+    def _coordinate(self):
+        buffer = []
+        last_flush = time.monotonic()
+        with self.app.app_context():
+            self._requeue_stale()
+        while True:
+            try:
+                with self.app.app_context():
+                    self._drain(buffer, timeout=0.2 if self._in_flight else 0)
+                    now = time.monotonic()
+                    if buffer and (len(buffer) >= self.setting('EMAIL_LOG_BATCH') or not self._in_flight
+                                   or now - last_flush >= self.setting('EMAIL_FLUSH_INTERVAL')):
+                        self._flush(buffer)
+                        buffer = []
+                        last_flush = now
+
+                    claimed = 0
+                    if self._tasks.qsize() < self.setting('EMAIL_WORKERS') * 2:
+                        claimed = self._claim()
+
+                    if not claimed and not self._in_flight and not buffer:
+                        if not self._wake.wait(self.setting('EMAIL_POLL_INTERVAL')):
+                            self._requeue_stale()
+                        self._wake.clear()
+            except Exception:
+                logger.exception("Email dispatcher cycle failed")
+                db.session.rollback()
+                time.sleep(self.setting('EMAIL_POLL_INTERVAL'))
+
+    def _drain(self, buffer, timeout):
+        try:
+            while True:
+                outcome = self._results.get(timeout=timeout)
+                timeout = 0
+                self._in_flight -= 1
+                self._job_tasks[outcome.task.job_id] -= 1
+                if outcome.fatal:
+                    self._cancelled_jobs.add(outcome.task.job_id)
+                buffer.append(outcome)
+        except queue.Empty:
+            pass
+
+    def _requeue_stale(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=self.setting('EMAIL_CLAIM_TIMEOUT'))
+        result = db.session.execute(
+            update(EmailJobRecipient)
+            .where(EmailJobRecipient.status == 'Sending', EmailJobRecipient.claimed_at < cutoff)
+            .values(status='Pending', claim_token=None)
+        )
+        db.session.commit()
+        if result.rowcount:
+            logger.warning("Requeued %d email recipients abandoned mid-send", result.rowcount)
+
+    def _claim(self):
+        now = datetime.utcnow()
+        active_jobs = select(EmailJob.id).where(EmailJob.status.in_(('Queued', 'Running')))
+        ids = db.session.scalars(
+            select(EmailJobRecipient.id)
+            .where(EmailJobRecipient.status == 'Pending',
+                   EmailJobRecipient.job_id.in_(active_jobs),
+                   or_(EmailJobRecipient.next_attempt_at.is_(None), EmailJobRecipient.next_attempt_at <= now))
+            .order_by(EmailJobRecipient.job_id, EmailJobRecipient.id)
+            .limit(self.setting('EMAIL_CLAIM_BATCH'))
+        ).all()
+        if not ids:
+            return 0
+
+        # The status guard makes the claim safe against other processes polling the same table
+        token = uuid.uuid4().hex
+        db.session.execute(
+            update(EmailJobRecipient)
+            .where(EmailJobRecipient.id.in_(ids), EmailJobRecipient.status == 'Pending')
+            .values(status='Sending', claim_token=token, claimed_at=now,
+                    attempts=EmailJobRecipient.attempts + 1)
+            .execution_options(synchronize_session=False)
+        )
+        rows = db.session.scalars(
+            select(EmailJobRecipient).where(EmailJobRecipient.claim_token == token)
+            .order_by(EmailJobRecipient.job_id, EmailJobRecipient.id)
+        ).all()
+        job_ids = {row.job_id for row in rows}
+        db.session.execute(
+            update(EmailJob)
+            .where(EmailJob.id.in_(job_ids), EmailJob.status == 'Queued')
+            .values(status='Running', started_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+
+        jobs = {job.id: job for job in EmailJob.query.filter(EmailJob.id.in_(job_ids))}
+        clients = {c.id: c for c in Client.query.filter(Client.id.in_({row.client_id for row in rows}))}
+        accounts = {}
+        for job_id, job_rows in itertools.groupby(rows, key=lambda row: row.job_id):
+            job_rows = list(job_rows)
+            job = jobs[job_id]
+            if job.created_by not in accounts:
+                accounts[job.created_by] = smtp_settings_for(job.created_by)
+            smtp, sender = accounts[job.created_by]
+
+            # Variables for the whole batch are prefetched together, not per recipient
+            merge = MailMerge(job.subject, job.message)
+            rendered = {client.id: (subject, body) for client, subject, body
+                        in merge.render([clients[row.client_id] for row in job_rows if row.client_id in clients])}
+            for row in job_rows:
+                client = clients.get(row.client_id)
+                subject, body = rendered.get(row.client_id, (job.subject, job.message))
+                task = _Task(row.id, row.job_id, row.client_id, client.name if client else '', row.attempts,
+                             smtp, sender, row.email, subject, body)
+                self._in_flight += 1
+                self._job_tasks[row.job_id] += 1
+                if smtp is None:
+                    self._results.put(_Outcome(task, False, True, True, False, 'Email configuration not found'))
+                else:
+                    self._tasks.put(task)
+        return len(rows)
+
+    def _flush(self, outcomes):
+        now = datetime.utcnow()
+        max_attempts = self.setting('EMAIL_MAX_ATTEMPTS')
+        retry_delay = self.setting('EMAIL_RETRY_DELAY')
+        jobs = {job.id: job for job in EmailJob.query.filter(EmailJob.id.in_({o.task.job_id for o in outcomes}))}
+
+        logs, recipient_updates = [], []
+        sent, failed = Counter(), Counter()
+        fatal = {}
+        for outcome in outcomes:
+            task = outcome.task
+            if outcome.skipped or jobs[task.job_id].status == 'Failed':
+                # A stopped job's unfinished recipients were all marked Failed and counted then
+                continue
+            if outcome.fatal:
+                fatal.setdefault(task.job_id, outcome.error)
+                continue
+
+            if outcome.ok:
+                status = 'Sent'
+                sent[task.job_id] += 1
+                recipient_updates.append({'id': task.recipient_id, 'status': 'Sent', 'sent_at': now,
+                                          'last_error': None, 'claim_token': None})
+            elif outcome.permanent or task.attempts >= max_attempts:
+                status = 'Failed'
+                failed[task.job_id] += 1
+                recipient_updates.append({'id': task.recipient_id, 'status': 'Failed',
+                                          'last_error': outcome.error[:500], 'claim_token': None})
+            else:
+                recipient_updates.append({
+                    'id': task.recipient_id, 'status': 'Pending', 'last_error': outcome.error[:500],
+                    'claim_token': None,
+                    'next_attempt_at': now + timedelta(seconds=retry_delay * 2 ** (task.attempts - 1)),
+                })
+                continue
+
+            job = jobs[task.job_id]
+            logs.append({
+                'client_id': task.client_id,
+                'communication_type': job.communication_type or 'email',
+                'subject': task.subject,
+                'message': task.body,
+                'recipient': task.client_name,
+                'status': status,
+                'sent_at': now,
+                'template_used': job.template_used or 'Custom',
+                'created_by': job.created_by,
+            })
+
+        if logs:
+            db.session.execute(insert(CommunicationLog), logs)
+        if recipient_updates:
+            db.session.execute(update(EmailJobRecipient), recipient_updates)
+
+        for job_id, error in fatal.items():
+            result = db.session.execute(
+                update(EmailJobRecipient)
+                .where(EmailJobRecipient.job_id == job_id,
+                       EmailJobRecipient.status.in_(('Pending', 'Sending')))
+                .values(status='Failed', last_error=error[:500], claim_token=None)
+                .execution_options(synchronize_session=False)
+            )
+            failed[job_id] += result.rowcount
+            jobs[job_id].status = 'Failed'
+            jobs[job_id].last_error = error[:500]
+            jobs[job_id].finished_at = now
+
+        for job_id, job in jobs.items():
+            job.sent = (job.sent or 0) + sent[job_id]
+            job.failed = (job.failed or 0) + failed[job_id]
+            if job.status == 'Running' and not db.session.scalar(
+                select(EmailJobRecipient.id)
+                .where(EmailJobRecipient.job_id == job_id,
+                       EmailJobRecipient.status.in_(('Pending', 'Sending')))
+                .limit(1)
+            ):
+                job.status = 'Completed'
+                job.finished_at = now
+        db.session.commit()
+
+        # Stopped jobs are Failed in the database now, so nothing more is claimed for them;
+        # forget them once their last queued task has come back
+        self._job_tasks = +self._job_tasks
+        self._cancelled_jobs = {job_id for job_id in self._cancelled_jobs if self._job_tasks[job_id]}
+
+    # --- Workers --------------------------------------------------------------
+
+    def _work(self):
+        sessions = {}
+        timeout = self.setting('EMAIL_SMTP_TIMEOUT')
+        max_messages = self.setting('EMAIL_SMTP_MAX_MESSAGES')
+        idle_timeout = self.setting('EMAIL_SMTP_IDLE_TIMEOUT')
+        while True:
+            try:
+                task = self._tasks.get(timeout=idle_timeout)
+            except queue.Empty:
+                for session in sessions.values():
+                    session.close()
+                sessions.clear()
+                continue
+
+            if task.job_id in self._cancelled_jobs:
+                self._results.put(_Outcome(task, False, True, False, True, 'Job stopped'))
+                continue
+
+            message = EmailMessage()
+            message['From'] = task.sender
+            message['To'] = task.to
+            message['Subject'] = task.subject
+            message.set_content(task.body)
+
+            session = sessions.get(task.smtp)
+            if session is None:
+                session = sessions[task.smtp] = SMTPSession(task.smtp, timeout, max_messages)
+            self._limiter.acquire()
+            try:
+                session.send(message)
+            except (smtplib.SMTPException, OSError) as e:
+                permanent, fatal = _classify(e)
+                # A refused recipient leaves the connection usable; anything else may not
+                if fatal or not isinstance(e, (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException)):
+                    session.close()
+                self._results.put(_Outcome(task, False, permanent, fatal, False, str(e) or type(e).__name__))
+            except Exception as e:
+                logger.exception("Unexpected error sending email to %s", task.to)
+                self._results.put(_Outcome(task, False, True, False, False, str(e) or type(e).__name__))
+            else:
+                self._results.put(_Outcome(task, True, False, False, False, None))
+
+
+dispatcher = EmailDispatcher()
+
+
+def enqueue_email_job(user_id, subject, message, recipient_ids, template_used=None, communication_type='email',
+                      commit=True):
+    """Queue a bulk email and return the EmailJob.
+
+    `recipient_ids` is a list of client ids, or contains 'all' for every
+    active client. Clients without an email address are recorded as failed
+    recipients straight away. With commit=False the caller commits (and
+    calls dispatcher.wake()) as part of its own transaction.
+    """
+    stmt = select(Client.id, Client.email)
+    if 'all' in recipient_ids:
+        stmt = stmt.where(Client.status == 'Active')
+    else:
+        stmt = stmt.where(Client.id.in_([int(i) for i in recipient_ids]))
+    recipients = db.session.execute(stmt).all()
+
+    job = EmailJob(
+        communication_type=communication_type,
+        subject=subject,
+        message=message,
+        template_used=template_used,
+        status='Queued',
+        total=len(recipients),
+        created_by=user_id,
+    )
+    db.session.add(job)
+    db.session.flush()
+
+    rows = []
+    for client_id, email in recipients:
+        row = {'job_id': job.id, 'client_id': client_id, 'email': email, 'status': 'Pending', 'attempts': 0}
+        if not email:
+            row.update(status='Failed', last_error='Client has no email address')
+            job.failed += 1
+        rows.append(row)
+    if rows:
+        db.session.execute(insert(EmailJobRecipient), rows)
+    if job.failed == job.total:
+        job.status = 'Completed'
+        job.finished_at = datetime.utcnow()
+    if commit:
+        db.session.commit()
+        dispatcher.wake()
+    return job
+
+
+def email_job_progress(job):
+    done = (job.sent or 0) + (job.failed or 0)
+    return {
+        'id': job.id,
+        'status': job.status,
+        'total': job.total,
+        'sent': job.sent,
+        'failed': job.failed,
+        'pending': max(job.total - done, 0),
+        'percent': round(100 * done / job.total) if job.total else 100,
+        'last_error': job.last_error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
@@ -0,0 +1,164 @@
+import re
+from datetime import date
+from sqlalchemy import func, select
+from main_app import db
+from models import OutstandingFee, ReturnTracker
+
+_VARIABLE = re.compile(r'\{(\w+)\}')
+
+DEFAULT_CHUNK_SIZE = 500  # recipients whose data is prefetched per round of queries
+
+# variable name -> provider; see merge_variables()
+_providers = {}
+
+
+def merge_variables(*names):
+    """Register a provider for template variables.
+
+    The decorated function takes a list of clients and returns
+    {client_id: {variable: value}} for all of them at once, so each provider
+    costs a fixed number of queries per batch rather than one per recipient.
+    Providers only run when a template actually uses one of their variables.
+    """
+    def register(provider):
+        for name in names:
+            _providers[name] = provider
+        return provider
+    return register
+
+
+def available_variables():
+    return sorted(_providers)
+
+
+class MergeTemplate:
+    """A message template parsed once into literal text and {variable} slots"""
+
+    def __init__(self, text):
+        self.text = text or ''
+        self._parts = []
+        self.variables = set()
+        position = 0
+        for match in _VARIABLE.finditer(self.text):
+            name = match.group(1)
+            # Unknown placeholders are left in the text as written
+            if name not in _providers:
+                continue
+            self._parts.append((self.text[position:match.start()], name))
+            self.variables.add(name)
+            position = match.end()
+        self._tail = self.text[position:]
+
+    def render(self, values):
+        out = []
+        for literal, name in self._parts:
+            out.append(literal)
+            out.append(values.get(name, ''))
+        out.append(self._tail)
+        return ''.join(out)
+
+
+class MailMerge:
+    """Render one or more templates (e.g. subject and body) for many clients"""
+
+    def __init__(self, *templates, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.templates = [t if isinstance(t, MergeTemplate) else MergeTemplate(t) for t in templates]
+        self.chunk_size = chunk_size
+        used = set().union(*(t.variables for t in self.templates))
+        providers = []
+        for name in used:
+            if _providers[name] not in providers:
+                providers.append(_providers[name])
+        self._providers = providers
+
+    def context(self, clients):
+        """{client_id: {variable: value}} for a batch of clients"""
+        values = {client.id: {} for client in clients}
+        for provider in self._providers:
+            for client_id, provided in provider(clients).items():
+                values[client_id].update(provided)
+        return values
+
+    def render(self, clients):
+        """Yield (client, rendered templates...) for each client, prefetching chunk by chunk"""
+        chunk = []
+        for client in clients:
+            chunk.append(client)
+            if len(chunk) >= self.chunk_size:
+                yield from self._render_chunk(chunk)
+                chunk = []
+        if chunk:
+            yield from self._render_chunk(chunk)
+
+    def _render_chunk(self, clients):
+        values = self.context(clients)
+        for client in clients:
+            yield (client, *(t.render(values[client.id]) for t in self.templates))
+
+
+def _format_date(value):
+    return value.strftime('%d-%m-%Y') if value else ''
+
+
+def _latest_per_client(model, client_ids, order_by, *criteria):
+    """One row per client: the first by `order_by`, picked with a window function in a single query"""
+    ranked = (
+        select(model.id, func.row_number().over(partition_by=model.client_id, order_by=order_by).label('rank'))
+        .where(model.client_id.in_(client_ids), *criteria)
+        .subquery()
+    )
+    rows = db.session.scalars(
+        select(model).join(ranked, ranked.c.id == model.id).where(ranked.c.rank == 1)
+    )
+    return {row.client_id: row for row in rows}
+
+
+# --- Built-in variables -------------------------------------------------------
+
+@merge_variables('client_name', 'pan', 'gstin', 'email', 'phone')
+def _client_fields(clients):
+    return {
+        client.id: {
+            'client_name': client.name or '',
+            'pan': client.pan or '',
+            'gstin': client.gstin or '',
+            'email': client.email or '',
+            'phone': client.phone or '',
+        }
+        for client in clients
+    }
+
+
+@merge_variables('due_date', 'amount', 'status', 'invoice_number')
+def _latest_fee(clients):
+    fees = _latest_per_client(
+        OutstandingFee, [c.id for c in clients],
+        (OutstandingFee.due_date.desc().nulls_last(), OutstandingFee.id.desc()),
+    )
+    values = {}
+    for client_id, fee in fees.items():
+        values[client_id] = {
+            'due_date': _format_date(fee.due_date),
+            'amount': str(fee.amount) if fee.amount else '',
+            'status': fee.status or '',
+            'invoice_number': fee.invoice_number or '',
+        }
+    return values
+
+
+@merge_variables('next_return', 'next_return_period', 'next_return_due_date')
+def _next_return(clients):
+    returns = _latest_per_client(
+        ReturnTracker, [c.id for c in clients],
+        (ReturnTracker.due_date, ReturnTracker.id),
+        ReturnTracker.due_date >= date.today(),
+        ReturnTracker.status.in_(('Pending', 'Overdue')),
+    )
+    values = {}
+    for client_id, tracker in returns.items():
+        values[client_id] = {
+            'next_return': tracker.return_type,
+            'next_return_period': tracker.period,
+            'next_return_due_date': _format_date(tracker.due_date),
+        }
+    return values
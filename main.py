@@ -1,4 +1,5 @@
 import eel
+import multiprocessing
 import threading
 from main_app import app
 
@@ -10,5 +11,6 @@ def run_flask():
 eel.init('web')  # put an empty index.html here or actual UI
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()  # XBRL validator pool workers in the packaged app
     threading.Thread(target=run_flask, daemon=True).start()
     eel.start('index.html', mode='chrome', block=True, close_callback=lambda route, websockets: exit(0))
\ No newline at end of file
@@ -27,8 +27,10 @@ def resource_path(relative_path):
     return os.path.join(os.path.abspath("."), relative_path)
 # Example usage
 db_path = resource_path("var/app-instance/audit_system.db")
-# Configure the database - using SQLite for local storage
-app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
+# Configure the database - SQLite for local storage unless DATABASE_URL points elsewhere (e.g. PostgreSQL)
+from database import database_uri, engine_options
+app.config["SQLALCHEMY_DATABASE_URI"] = database_uri(f"sqlite:///{db_path}")
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config["SQLALCHEMY_DATABASE_URI"])
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
 # Initialize extensions
@@ -52,11 +54,31 @@ def load_user(user_id):
     return User.query.get(int(user_id))
 
 with app.app_context():
+    # WAL, busy timeout and cache pragmas on every SQLite connection (SQLITE_* settings)
+    from database import configure_sqlite
+    configure_sqlite(db.engine, app.config)
+
     # Import models to ensure they're registered
     import models
     
     # Create all tables
     db.create_all()
+
+    # Indexes declared after a database was created aren't added by create_all()
+    from indexes import ensure_indexes
+    ensure_indexes(db.engine)
+
+    # Full-text search index (SQLite FTS5), kept in sync by triggers
+    from search import init_search_index
+    init_search_index(db.engine)
+
+    # One-off data migrations (checklist items, return status counters), once per database
+    from migrations import run_migrations
+    run_migrations()
+
+    # Compliance calendars for clients added while no scheduler ran, and for a new financial year
+    from compliance import extend_calendars
+    extend_calendars()
     
     # Create default admin user if none exists
     from models import User, Role
@@ -93,3 +115,29 @@ from auth import auth_bp
 
 app.register_blueprint(main_bp)
 app.register_blueprint(auth_bp)
+
+from indexes import db_advise_command
+from fake_twilio import fake_twilio_command
+from scheduler import reminder_scheduler_command
+from compliance import compliance_calendar_command
+from blobstore import blobs_gc_command
+from xbrl import xbrl_benchmark_command
+from return_status import recount_return_statuses_command
+from db_benchmark import db_benchmark_command
+app.cli.add_command(db_advise_command)
+app.cli.add_command(fake_twilio_command)
+app.cli.add_command(reminder_scheduler_command)
+app.cli.add_command(compliance_calendar_command)
+app.cli.add_command(blobs_gc_command)
+app.cli.add_command(xbrl_benchmark_command)
+app.cli.add_command(recount_return_statuses_command)
+app.cli.add_command(db_benchmark_command)
+
+from mailer import dispatcher
+dispatcher.init_app(app)
+
+from sms import dispatcher as sms_dispatcher
+sms_dispatcher.init_app(app)
+
+from xbrl_batch import validator as xbrl_validator
+xbrl_validator.init_app(app)
@@ -0,0 +1,72 @@
+import logging
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+from main_app import db
+from database import upsert
+from models import ChallanManagement, SchedulerState, normalize_challan_status
+from checklists import migrate_json_checklists
+from return_status import rebuild_status_counts
+
+logger = logging.getLogger(__name__)
+
+
+def _marker(name):
+    return f'migrations.{name}'
+
+
+def run_once(name, migrate):
+    """Run `migrate` the first time any process starts against this database.
+
+    The migration's marker row in scheduler_state is inserted in the same
+    transaction as its changes, so it is recorded only if they commit.
+    Processes that find the marker skip it after one read. Processes
+    starting together race to insert the marker. The winner runs the
+    migration, and the others block on the insert, then find the marker
+    there and skip it. `migrate` must not commit.
+    """
+    if db.session.get(SchedulerState, _marker(name)) is not None:
+        return False
+    stmt = upsert(SchedulerState, db.session.get_bind().dialect.name, ['name'])
+    try:
+        if stmt is not None:
+            claimed = db.session.connection().execute(stmt, {'name': _marker(name), 'value': 1}).rowcount == 1
+        else:
+            db.session.add(SchedulerState(name=_marker(name), value=1))
+            db.session.flush()
+            claimed = True
+    except IntegrityError:
+        claimed = False
+    except OperationalError:
+        # Still locked by another process running it; that process records it
+        logger.warning("Skipped data migration %s: the database is busy with it in another process", name)
+        claimed = False
+    if not claimed:
+        db.session.rollback()
+        return False
+
+    migrate()
+    db.session.commit()
+    logger.info("Applied data migration %s", name)
+    return True
+
+
+def normalize_challan_statuses():
+    """Rewrite challan statuses saved before they were normalised on write ('cleared ', NULL)"""
+    raw_statuses = db.session.scalars(select(ChallanManagement.status).distinct()).all()
+    for raw in raw_statuses:
+        status = normalize_challan_status(raw)
+        if status != raw:
+            column = ChallanManagement.status
+            db.session.execute(
+                update(ChallanManagement)
+                .where(column.is_(None) if raw is None else column == raw)
+                .values(status=status)
+                .execution_options(synchronize_session=False)
+            )
+
+
+def run_migrations():
+    """Apply the data migrations this database hasn't had yet, in order"""
+    run_once('checklist_items', migrate_json_checklists)
+    run_once('return_status_counts', rebuild_status_counts)
+    run_once('challan_statuses', normalize_challan_statuses)
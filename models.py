@@ -1,8 +1,8 @@
 from datetime import datetime
 from main_app import db
 from flask_login import UserMixin
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, Float, ForeignKey, Date
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, Float, ForeignKey, Date, Index
+from sqlalchemy.orm import backref, relationship, validates
 
 class Role(db.Model):
     __tablename__ = 'roles'
@@ -16,6 +16,9 @@ class Role(db.Model):
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        Index('ix_users_created_at', 'created_at', 'id'),
+    )
     
     id = Column(Integer, primary_key=True)
     username = Column(String(64), unique=True, nullable=False)
@@ -28,6 +31,11 @@ class User(UserMixin, db.Model):
 
 class Client(db.Model):
     __tablename__ = 'clients'
+    __table_args__ = (
+        Index('ix_clients_name', 'name'),
+        Index('ix_clients_status_name', 'status', 'name'),
+        Index('ix_clients_created_at', 'created_at', 'id'),
+    )
     
     id = Column(Integer, primary_key=True)
     name = Column(String(200), nullable=False)
@@ -53,6 +61,12 @@ class Client(db.Model):
 
 class IncomeTaxReturn(db.Model):
     __tablename__ = 'income_tax_returns'
+    __table_args__ = (
+        Index('ix_income_tax_returns_status_due_date', 'status', 'due_date'),
+        Index('ix_income_tax_returns_client_id_created_at', 'client_id', 'created_at'),
+        Index('ix_income_tax_returns_created_at', 'created_at', 'id'),
+        Index('ix_income_tax_returns_acknowledgment_number', 'acknowledgment_number'),
+    )
     
     id = Column(Integer, primary_key=True)
     client_id = Column(Integer, ForeignKey('clients.id'), nullable=False)
@@ -70,6 +84,13 @@ class IncomeTaxReturn(db.Model):
 
 class TDSReturn(db.Model):
     __tablename__ = 'tds_returns'
+    __table_args__ = (
+        Index('ix_tds_returns_status_due_date', 'status', 'due_date'),
+        Index('ix_tds_returns_client_id_created_at', 'client_id', 'created_at'),
+        Index('ix_tds_returns_created_at', 'created_at', 'id'),
+        Index('ix_tds_returns_tan', 'tan'),
+        Index('ix_tds_returns_token_number', 'token_number'),
+    )
     
     id = Column(Integer, primary_key=True)
     client_id = Column(Integer, ForeignKey('clients.id'), nullable=False)
@@ -87,6 +108,13 @@ class TDSReturn(db.Model):
 
 class GSTReturn(db.Model):
     __tablename__ = 'gst_returns'
+    __table_args__ = (
+        Index('ix_gst_returns_status_due_date', 'status', 'due_date'),
+        Index('ix_gst_returns_client_id_created_at', 'client_id', 'created_at'),
+        Index('ix_gst_returns_created_at', 'created_at', 'id'),
+        Index('ix_gst_returns_gstin', 'gstin'),
+        Index('ix_gst_returns_arn_number', 'arn_number'),
+    )
     
     id = Column(Integer, primary_key=True)
     client_id = Column(Integer, ForeignKey('clients.id'), nullable=False)
@@ -104,6 +132,9 @@ class GSTReturn(db.Model):
 
 class Employee(db.Model):
     __tablename__ = 'employees'
+    __table_args__ = (
+        Index('ix_employees_created_at', 'created_at', 'id'),
+    )
     
     id = Column(Integer, primary_key=True)
     name = Column(String(200), nullable=False)
@@ -123,6 +154,10 @@ class Employee(db.Model):
 
 class Task(db.Model):
     __tablename__ = 'tasks'
+    __table_args__ = (
+        Index('ix_tasks_status_end_date', 'status', 'end_date'),
+        Index('ix_tasks_start_date', 'start_date'),
+    )
 
     id = Column(Integer, primary_key=True)
     employee_id = Column(Integer, ForeignKey('employees.id'), nullable=False)
@@ -138,6 +173,10 @@ class Task(db.Model):
 
 class PayrollEntry(db.Model):
     __tablename__ = 'payroll_entries'
+    __table_args__ = (
+        Index('ix_payroll_entries_employee_id_month_year', 'employee_id', 'month_year'),
+        Index('ix_payroll_entries_created_at', 'created_at', 'id'),
+    )
     
     id = Column(Integer, primary_key=True)
     employee_id = Column(Integer, ForeignKey('employees.id'), nullable=False)
@@ -153,6 +192,11 @@ class PayrollEntry(db.Model):
 
 class Document(db.Model):
     __tablename__ = 'documents'
+    __table_args__ = (
+        Index('ix_documents_client_id_upload_date', 'client_id', 'upload_date'),
+        Index('ix_documents_document_type', 'document_type'),
+        Index('ix_documents_upload_date', 'upload_date', 'id'),
+    )
     
     id = Column(Integer, primary_key=True)
     client_id = Column(Integer, ForeignKey('clients.id'))
@@ -166,8 +210,37 @@ class Document(db.Model):
 
     uploader = relationship("User", backref="uploaded_documents")
 
+    @property
+    def content_version(self):
+        """Changes whenever the file does; added to preview/download URLs so browsers can cache them"""
+        from blobstore import content_version
+        return content_version(self.file_path)
+
+class Blob(db.Model):
+    """A stored upload, addressed by content; see blobstore.py"""
+    __tablename__ = 'blobs'
+    __table_args__ = (
+        Index('ux_blobs_sha256_extension', 'sha256', 'extension', unique=True),
+        Index('ix_blobs_ref_count_released_at', 'ref_count', 'released_at'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    sha256 = Column(String(64), nullable=False)
+    extension = Column(String(10), nullable=False, default='')
+    size = Column(Integer, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)  # documents/reports pointing at the file
+    created_at = Column(DateTime, default=datetime.utcnow)
+    released_at = Column(DateTime)  # when ref_count last dropped to 0
+
 class OutstandingFee(db.Model):
     __tablename__ = 'outstanding_fees'
+    __table_args__ = (
+        Index('ix_outstanding_fees_status_due_date', 'status', 'due_date'),
+        Index('ix_outstanding_fees_status_created_at', 'status', 'created_at'),
+        Index('ix_outstanding_fees_client_id_due_date', 'client_id', 'due_date'),
+        Index('ix_outstanding_fees_due_date', 'due_date', 'id'),
+        Index('ix_outstanding_fees_created_at', 'created_at'),
+    )
     
     id = Column(Integer, primary_key=True)
     client_id = Column(Integer, ForeignKey('clients.id'), nullable=False)
@@ -198,6 +271,12 @@ class OutstandingFee(db.Model):
 
 class ROCForm(db.Model):
     __tablename__ = 'roc_forms'
+    __table_args__ = (
+        Index('ix_roc_forms_client_id_created_at', 'client_id', 'created_at'),
+        Index('ix_roc_forms_created_at', 'created_at', 'id'),
+        Index('ix_roc_forms_acknowledgment_number', 'acknowledgment_number'),
+        Index('ix_roc_forms_form_type', 'form_type'),
+    )
     
     id = Column(Integer, primary_key=True)
     client = db.relationship('Client', backref='roc_forms') # Establishing relationship with Client
@@ -215,6 +294,11 @@ class ROCForm(db.Model):
 
 class SFTReturn(db.Model):
     __tablename__ = 'sft_returns'
+    __table_args__ = (
+        Index('ix_sft_returns_client_id_created_at', 'client_id', 'created_at'),
+        Index('ix_sft_returns_created_at', 'created_at', 'id'),
+        Index('ix_sft_returns_acknowledgment_number', 'acknowledgment_number'),
+    )
     
     id = Column(Integer, primary_key=True)
     client = db.relationship('Client', backref='sft_returns') # Establishing relationship with Client
@@ -232,6 +316,10 @@ class SFTReturn(db.Model):
 
 class BalanceSheetAudit(db.Model):
     __tablename__ = 'balance_sheet_audits'
+    __table_args__ = (
+        Index('ix_balance_sheet_audits_client_id_created_at', 'client_id', 'created_at'),
+        Index('ix_balance_sheet_audits_created_at', 'created_at', 'id'),
+    )
     client = relationship('Client', backref='audits')
     id = Column(Integer, primary_key=True)
     client_id = Column(Integer, ForeignKey('clients.id'), nullable=False)
@@ -253,6 +341,10 @@ class BalanceSheetAudit(db.Model):
 
 class CMAReport(db.Model):
     __tablename__ = 'cma_reports'
+    __table_args__ = (
+        Index('ix_cma_reports_client_id_created_at', 'client_id', 'created_at'),
+        Index('ix_cma_reports_created_at', 'created_at', 'id'),
+    )
     
     id = Column(Integer, primary_key=True)
     client_id = Column(Integer, ForeignKey('clients.id'), nullable=False)
@@ -273,6 +365,10 @@ class CMAReport(db.Model):
 
 class AssessmentOrder(db.Model):
     __tablename__ = 'assessment_orders'
+    __table_args__ = (
+        Index('ix_assessment_orders_client_id_created_at', 'client_id', 'created_at'),
+        Index('ix_assessment_orders_created_at', 'created_at', 'id'),
+    )
     
     id = Column(Integer, primary_key=True)
     client_id = Column(Integer, ForeignKey('clients.id'), nullable=False)
@@ -295,6 +391,10 @@ class AssessmentOrder(db.Model):
 
 class XBRLReport(db.Model):
     __tablename__ = 'xbrl_reports'
+    __table_args__ = (
+        Index('ix_xbrl_reports_client_id_created_at', 'client_id', 'created_at'),
+        Index('ix_xbrl_reports_created_at', 'created_at', 'id'),
+    )
     
     id = Column(Integer, primary_key=True)
     client_id = Column(Integer, ForeignKey('clients.id'), nullable=False)
@@ -311,8 +411,58 @@ class XBRLReport(db.Model):
     created_at = Column(DateTime, default=datetime.utcnow)
     created_by = Column(Integer, ForeignKey('users.id'))
 
+    @property
+    def validation_issues(self):
+        """Structured issues from the last validation run (see xbrl.py)"""
+        from xbrl import validation_issues
+        return validation_issues(self.validation_errors)
+
+class XBRLValidationBatch(db.Model):
+    """A set of XBRL reports validated together by the worker pool in xbrl_batch.py"""
+    __tablename__ = 'xbrl_validation_batches'
+    __table_args__ = (
+        Index('ix_xbrl_validation_batches_status_created_at', 'status', 'created_at'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    status = Column(String(20), default='Queued')  # Queued, Running, Completed
+    total = Column(Integer, default=0)
+    valid = Column(Integer, default=0)
+    invalid = Column(Integer, default=0)
+    failed = Column(Integer, default=0)  # timed out or crashed; validation_status is left as it was
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    created_by = Column(Integer, ForeignKey('users.id'))
+
+    items = relationship('XBRLValidationItem', backref='batch', lazy='dynamic')
+
+class XBRLValidationItem(db.Model):
+    __tablename__ = 'xbrl_validation_items'
+    __table_args__ = (
+        Index('ix_xbrl_validation_items_status_id', 'status', 'id'),
+        Index('ix_xbrl_validation_items_batch_id_status', 'batch_id', 'status'),
+        Index('ix_xbrl_validation_items_report_id_status', 'report_id', 'status'),
+        Index('ix_xbrl_validation_items_claim_token', 'claim_token'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    batch_id = Column(Integer, ForeignKey('xbrl_validation_batches.id'), nullable=False)
+    report_id = Column(Integer, ForeignKey('xbrl_reports.id'), nullable=False)
+    status = Column(String(20), default='Queued')  # Queued, Running, Valid, Invalid, Failed
+    claim_token = Column(String(32))
+    claimed_at = Column(DateTime)
+    seconds = Column(Float)
+    error = Column(String(500))
+    finished_at = Column(DateTime)
+
 class ClientNote(db.Model):
     __tablename__ = 'client_notes'
+    __table_args__ = (
+        Index('ix_client_notes_client_id_created_at', 'client_id', 'created_at'),
+        Index('ix_client_notes_note_type_created_at', 'note_type', 'created_at'),
+        Index('ix_client_notes_created_at', 'created_at'),
+    )
     
     id = Column(Integer, primary_key=True)
     client_id = Column(Integer, ForeignKey('clients.id'), nullable=False)
@@ -333,22 +483,48 @@ class ClientNote(db.Model):
 
 class DocumentChecklist(db.Model):
     __tablename__ = 'document_checklists'
+    __table_args__ = (
+        Index('ix_document_checklists_client_id', 'client_id'),
+        Index('ix_document_checklists_due_date', 'due_date'),
+    )
     
     id = Column(Integer, primary_key=True)
     client = db.relationship('Client', backref='document_checklists')
     client_id = Column(Integer, ForeignKey('clients.id'), nullable=False)
     checklist_name = Column(String(200), nullable=False)
     service_type = Column(String(100))  # ITR, GST, Audit, ROC
-    documents_required = Column(Text)  # JSON list of documents
-    documents_received = Column(Text)  # JSON list of received documents
-    completion_percentage = Column(Float, default=0)
+    # Legacy JSON lists, moved into document_checklist_items at startup and left NULL
+    documents_required = Column(Text)
+    documents_received = Column(Text)
+    completion_percentage = Column(Float, default=0)  # received items / items, kept by checklists.refresh_completion
     due_date = Column(Date)
     status = Column(String(20), default='Pending')
     created_at = Column(DateTime, default=datetime.utcnow)
     created_by = Column(Integer, ForeignKey('users.id'))    
+    items = db.relationship('DocumentChecklistItem', backref='checklist', cascade='all, delete-orphan',
+                            order_by='DocumentChecklistItem.id')
+
+class DocumentChecklistItem(db.Model):
+    __tablename__ = 'document_checklist_items'
+    __table_args__ = (
+        Index('ix_document_checklist_items_checklist_id_received', 'checklist_id', 'received'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    checklist_id = Column(Integer, ForeignKey('document_checklists.id', ondelete='CASCADE'), nullable=False)
+    document_name = Column(String(200), nullable=False)
+    received = Column(Boolean, nullable=False, default=False)
+    received_at = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.utcnow)
 
 class ReturnTracker(db.Model):
     __tablename__ = 'return_tracker'
+    __table_args__ = (
+        Index('ix_return_tracker_status_due_date', 'status', 'due_date'),
+        Index('ix_return_tracker_return_type_due_date', 'return_type', 'due_date'),
+        Index('ix_return_tracker_client_id', 'client_id'),
+        Index('ix_return_tracker_due_date', 'due_date', 'id'),
+    )
     
     id = Column(Integer, primary_key=True)
     client_id = Column(Integer, ForeignKey('clients.id'), nullable=False)
@@ -363,8 +539,38 @@ class ReturnTracker(db.Model):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+class ReturnStatusCount(db.Model):
+    """Number of ReturnTracker rows per status, kept in step by return_status.py"""
+    __tablename__ = 'return_status_counts'
+
+    status = Column(String(20), primary_key=True)  # '' for returns without a status
+    count = Column(Integer, nullable=False, default=0)
+
+class ComplianceCalendar(db.Model):
+    """Statutory due dates generated per client and financial year by compliance.py"""
+    __tablename__ = 'compliance_calendar'
+    __table_args__ = (
+        Index('ux_compliance_calendar_client_id_form_period', 'client_id', 'form', 'period', unique=True),
+        Index('ix_compliance_calendar_due_date', 'due_date', 'id'),
+        Index('ix_compliance_calendar_client_id_financial_year', 'client_id', 'financial_year'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    client_id = Column(Integer, ForeignKey('clients.id'), nullable=False)
+    financial_year = Column(String(10), nullable=False)  # 2025-26
+    form = Column(String(20), nullable=False)  # GSTR-1, GSTR-3B, TDS-26Q, ITR, AOC-4, MGT-7
+    period = Column(String(20), nullable=False)  # Apr 2025, Q1 FY26, AY 2026-27, FY 2025-26
+    due_date = Column(Date, nullable=False)
+    status = Column(String(20), default='Pending')  # Pending, Filed
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    client = relationship("Client")
+
 class GSTValidation(db.Model):
     __tablename__ = 'gst_validations'
+    __table_args__ = (
+        Index('ix_gst_validations_last_validated', 'last_validated'),
+    )
     
     id = Column(Integer, primary_key=True)
     gstin = Column(String(15), nullable=False, unique=True)
@@ -380,8 +586,26 @@ class GSTValidation(db.Model):
     last_validated = Column(DateTime, default=datetime.utcnow)
     validation_source = Column(String(50), default='Manual')
 
+CHALLAN_STATUSES = ('Pending', 'Cleared', 'Failed', 'Bounced')
+_CHALLAN_STATUSES = {s.lower(): s for s in CHALLAN_STATUSES}
+
+
+def normalize_challan_status(value):
+    """Canonical spelling of a challan status (' cleared' -> 'Cleared'); blank means Pending"""
+    value = (value or '').strip()
+    return _CHALLAN_STATUSES.get(value.lower(), value or 'Pending')
+
+
 class ChallanManagement(db.Model):
     __tablename__ = 'challan_management'
+    __table_args__ = (
+        Index('ix_challan_management_client_id_created_at', 'client_id', 'created_at'),
+        Index('ix_challan_management_created_at', 'created_at', 'id'),
+        Index('ix_challan_management_status_payment_date', 'status', 'payment_date'),
+        # Covers the list page's totals by status without reading the table
+        Index('ix_challan_management_status_amount', 'status', 'amount'),
+        Index('ix_challan_management_challan_number', 'challan_number'),
+    )
     
     id = Column(Integer, primary_key=True)
     client_id = Column(Integer, ForeignKey('clients.id'), nullable=False)
@@ -401,6 +625,11 @@ class ChallanManagement(db.Model):
     created_by = Column(Integer, ForeignKey('users.id'))
     client = db.relationship('Client', backref='challans')
 
+    @validates('status')
+    def _normalize_status(self, key, value):
+        # Stored canonical so the totals can group on the indexed column as-is
+        return normalize_challan_status(value)
+
 class SMSTemplate(db.Model):
     __tablename__ = 'sms_templates'
     
@@ -428,6 +657,11 @@ class EmailTemplate(db.Model):
 
 class CommunicationLog(db.Model):
     __tablename__ = 'communication_logs'
+    __table_args__ = (
+        Index('ix_communication_logs_client_id_sent_at', 'client_id', 'sent_at'),
+        Index('ix_communication_logs_communication_type_sent_at', 'communication_type', 'sent_at'),
+        Index('ix_communication_logs_sent_at', 'sent_at'),
+    )
     
     id = Column(Integer, primary_key=True)
     client_id = Column(Integer, ForeignKey('clients.id'), nullable=False)
@@ -440,8 +674,95 @@ class CommunicationLog(db.Model):
     template_used = Column(String(100))
     created_by = Column(Integer, ForeignKey('users.id'))
 
+class EmailJob(db.Model):
+    __tablename__ = 'email_jobs'
+    __table_args__ = (
+        Index('ix_email_jobs_status_created_at', 'status', 'created_at'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    communication_type = Column(String(20), default='email')
+    subject = Column(String(200))
+    message = Column(Text)  # may contain {client_name}-style variables
+    template_used = Column(String(100))
+    status = Column(String(20), default='Queued')  # Queued, Running, Completed, Failed
+    total = Column(Integer, default=0)
+    sent = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    last_error = Column(String(500))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    created_by = Column(Integer, ForeignKey('users.id'))
+
+    recipients = relationship('EmailJobRecipient', backref='job', lazy='dynamic')
+
+class EmailJobRecipient(db.Model):
+    __tablename__ = 'email_job_recipients'
+    __table_args__ = (
+        Index('ix_email_job_recipients_job_id_status', 'job_id', 'status'),
+        Index('ix_email_job_recipients_status_next_attempt_at', 'status', 'next_attempt_at'),
+        Index('ix_email_job_recipients_claim_token', 'claim_token'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey('email_jobs.id'), nullable=False)
+    client_id = Column(Integer, ForeignKey('clients.id'), nullable=False)
+    email = Column(String(120))
+    status = Column(String(20), default='Pending')  # Pending, Sending, Sent, Failed
+    attempts = Column(Integer, default=0)
+    last_error = Column(String(500))
+    next_attempt_at = Column(DateTime)
+    claim_token = Column(String(32))  # set by the dispatcher that picked the row up
+    claimed_at = Column(DateTime)
+    sent_at = Column(DateTime)
+
+class SMSJob(db.Model):
+    __tablename__ = 'sms_jobs'
+    __table_args__ = (
+        Index('ix_sms_jobs_status_created_at', 'status', 'created_at'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    message = Column(Text)  # may contain {client_name}-style variables
+    template_used = Column(String(100))
+    status = Column(String(20), default='Queued')  # Queued, Running, Completed, Failed
+    total = Column(Integer, default=0)
+    sent = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    last_error = Column(String(500))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    created_by = Column(Integer, ForeignKey('users.id'))
+
+    recipients = relationship('SMSJobRecipient', backref='job', lazy='dynamic')
+
+class SMSJobRecipient(db.Model):
+    __tablename__ = 'sms_job_recipients'
+    __table_args__ = (
+        Index('ix_sms_job_recipients_job_id_status', 'job_id', 'status'),
+        Index('ix_sms_job_recipients_status_claimed_at', 'status', 'claimed_at'),
+        Index('ix_sms_job_recipients_claim_token', 'claim_token'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey('sms_jobs.id'), nullable=False)
+    client_id = Column(Integer, ForeignKey('clients.id'), nullable=False)
+    phone = Column(String(20))  # E.164, normalised when the job is queued
+    status = Column(String(20), default='Pending')  # Pending, Sending, Sent, Failed
+    attempts = Column(Integer, default=0)
+    message_sid = Column(String(64))
+    last_error = Column(String(500))
+    claim_token = Column(String(32))  # set by the dispatcher that picked the row up
+    claimed_at = Column(DateTime)
+    sent_at = Column(DateTime)
+
 class Configuration(db.Model):
     __tablename__ = 'configurations'
+    __table_args__ = (
+        Index('ix_configurations_user_id_type', 'user_id', 'type'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))  # each user can have config
@@ -455,6 +776,13 @@ class Configuration(db.Model):
 
 class Reminder(db.Model):
     __tablename__ = 'reminders'
+    __table_args__ = (
+        Index('ix_reminders_status_reminder_date', 'status', 'reminder_date'),
+        Index('ix_reminders_created_by_auto_created', 'created_by', 'auto_created'),
+        Index('ix_reminders_client_id_fee_id_reminder_date', 'client_id', 'fee_id', 'reminder_date'),
+        Index('ix_reminders_reminder_date', 'reminder_date', 'id'),
+        Index('ix_reminders_notification_sent_status_reminder_date', 'notification_sent', 'status', 'reminder_date'),
+    )
     
     id = Column(Integer, primary_key=True)
     client_id = Column(Integer, ForeignKey('clients.id'), nullable=True)
@@ -472,8 +800,33 @@ class Reminder(db.Model):
     client = relationship("Client", backref="reminders")
     fee = relationship("OutstandingFee", backref="reminders")
 
+class ReminderSource(db.Model):
+    """Links a scheduler-generated reminder to the return, fee or client it was made for"""
+    __tablename__ = 'reminder_sources'
+    __table_args__ = (
+        Index('ix_reminder_sources_source_source_id', 'source', 'source_id'),
+    )
+
+    reminder_id = Column(Integer, ForeignKey('reminders.id'), primary_key=True)
+    source = Column(String(20), nullable=False)  # itr, gst, fees, birthday
+    source_id = Column(Integer, nullable=False)
+
+    # Deleting a reminder takes its link with it; reminder_id is the primary key, so it can't be blanked
+    reminder = relationship("Reminder", backref=backref("source", uselist=False, cascade='all, delete-orphan'))
+
+class SchedulerState(db.Model):
+    """Named progress markers (e.g. the last fee id turned into reminders) kept across restarts"""
+    __tablename__ = 'scheduler_state'
+
+    name = Column(String(50), primary_key=True)
+    value = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 class AutoReminderSetting(db.Model):
     __tablename__ = 'auto_reminder_settings'
+    __table_args__ = (
+        Index('ix_auto_reminder_settings_user_id', 'user_id'),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
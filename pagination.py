@@ -0,0 +1,174 @@
+import base64
+import binascii
+import json
+import threading
+import time
+from datetime import date, datetime
+from flask import current_app, request
+from sqlalchemy import and_, or_, tuple_
+
+DEFAULT_PER_PAGE = 20
+DEFAULT_COUNT_TTL = 60  # seconds a cached row count may be shown before it is recounted
+_COUNT_CACHE_SIZE = 256
+
+_count_lock = threading.Lock()
+_count_cache = {}
+
+
+class KeysetPage:
+    """One page of a keyset-paginated list.
+
+    `items` keeps the attribute name of Flask-SQLAlchemy's Pagination so the
+    templates iterate pages the same way; `total` is a cached estimate or None.
+    """
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _decode_value(value, column):
+    if value is None:
+        return None
+    python_type = column.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type is date:
+        return date.fromisoformat(value)
+    return value
+
+
+def encode_cursor(direction, key_value, row_id):
+    """Opaque, URL-safe token for the row a page starts after ('n') or before ('p')"""
+    raw = json.dumps([direction, _encode_value(key_value), row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, key):
+    """Return (direction, key value, id), or None for a missing or tampered cursor"""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        direction, key_value, row_id = json.loads(raw)
+        if direction not in ('n', 'p') or not isinstance(row_id, int):
+            return None
+        return direction, _decode_value(key_value, key), row_id
+    except (binascii.Error, ValueError, TypeError):
+        return None
+
+
+def _seek_segments(key, id_col, key_value, row_id, greater):
+    """Criteria for the rows after (key_value, row_id), in scan order.
+
+    NULL keys sort lowest, as they do natively in SQLite. Rather than OR-ing
+    the NULL block into the range (which defeats the index), the NULL and
+    non-NULL runs are separate segments that are read one after another.
+    """
+    nullable = getattr(key.expression, 'nullable', True)
+    if key_value is None:
+        if greater:
+            return [and_(key.is_(None), id_col > row_id), key.isnot(None)]
+        return [and_(key.is_(None), id_col < row_id)]
+    if greater:
+        return [tuple_(key, id_col) > tuple_(key_value, row_id)]
+    segments = [tuple_(key, id_col) < tuple_(key_value, row_id)]
+    if nullable:
+        segments.append(key.is_(None))
+    return segments
+
+
+def estimate_count(query):
+    """Row count of `query`, cached for PAGINATION_COUNT_TTL seconds per distinct filter"""
+    ttl = current_app.config.get('PAGINATION_COUNT_TTL', DEFAULT_COUNT_TTL)
+    count_query = query.order_by(None)
+    compiled = count_query.statement.compile()
+    cache_key = (str(compiled), repr(sorted(compiled.params.items())))
+    now = time.monotonic()
+
+    with _count_lock:
+        cached = _count_cache.get(cache_key)
+        if cached and now - cached[1] < ttl:
+            return cached[0]
+
+    total = count_query.count()
+
+    with _count_lock:
+        if len(_count_cache) >= _COUNT_CACHE_SIZE:
+            _count_cache.pop(next(iter(_count_cache)))
+        _count_cache[cache_key] = (total, now)
+    return total
+
+
+def keyset_paginate(query, key, id_col, descending=True, cursor=None, per_page=DEFAULT_PER_PAGE,
+                    with_count=None):
+    """Seek-paginate `query` on (key, id_col) instead of OFFSET.
+
+    `cursor` defaults to the `cursor` request argument. Each page costs one
+    indexed range scan regardless of depth; the total is only computed when
+    `with_count` (default: the PAGINATION_ESTIMATE_COUNT setting) is on, and
+    then comes from a short-lived cache.
+    """
+    if cursor is None:
+        cursor = request.args.get('cursor')
+    if with_count is None:
+        with_count = current_app.config.get('PAGINATION_ESTIMATE_COUNT', True)
+
+    position = decode_cursor(cursor, key)
+    backwards = position is not None and position[0] == 'p'
+
+    # Walking backwards scans the reversed order and flips the rows afterwards
+    scan_descending = descending != backwards
+    # Spell out SQLite's native NULL placement so other databases page identically
+    if scan_descending:
+        order = (key.desc().nulls_last(), id_col.desc())
+    else:
+        order = (key.asc().nulls_first(), id_col.asc())
+
+    if position is None:
+        rows = query.order_by(*order).limit(per_page + 1).all()
+    else:
+        _, key_value, row_id = position
+        rows = []
+        for criterion in _seek_segments(key, id_col, key_value, row_id, greater=not scan_descending):
+            rows += query.filter(criterion).order_by(*order).limit(per_page + 1 - len(rows)).all()
+            if len(rows) > per_page:
+                break
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    next_cursor = prev_cursor = None
+    if rows:
+        first, last = rows[0], rows[-1]
+        if more or backwards:
+            next_cursor = encode_cursor('n', getattr(last, key.key), getattr(last, id_col.key))
+        if (more and backwards) or (position is not None and not backwards):
+            prev_cursor = encode_cursor('p', getattr(first, key.key), getattr(first, id_col.key))
+
+    total = estimate_count(query) if with_count else None
+    return KeysetPage(rows, per_page, next_cursor=next_cursor, prev_cursor=prev_cursor, total=total)
@@ -0,0 +1,96 @@
+import logging
+from datetime import date, datetime
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import delete, func, insert, select, update
+from main_app import db
+from database import upsert
+from models import ReturnStatusCount, ReturnTracker
+
+logger = logging.getLogger(__name__)
+
+# Statuses shown on the tracker's summary cards; their counters always exist
+TRACKED_STATUSES = ('Pending', 'Filed', 'Overdue', 'Processed')
+
+
+def _key(status):
+    return status or ''
+
+
+def _bump(status, delta):
+    stmt = upsert(ReturnStatusCount, db.session.get_bind().dialect.name, ['status'], increment_columns=['count'])
+    if stmt is not None:
+        db.session.connection().execute(stmt, {'status': _key(status), 'count': delta})
+        return
+    result = db.session.execute(
+        update(ReturnStatusCount)
+        .where(ReturnStatusCount.status == _key(status))
+        .values(count=ReturnStatusCount.count + delta)
+    )
+    if result.rowcount == 0:
+        db.session.execute(insert(ReturnStatusCount).values(status=_key(status), count=delta))
+
+
+def count_status_change(old, new, created=False):
+    """Move one return between status counters; the caller commits along with the return.
+
+    `created` marks a new return, which only adds to the counter for `new`.
+    """
+    if created:
+        _bump(new, 1)
+    elif _key(old) != _key(new):
+        _bump(old, -1)
+        _bump(new, 1)
+
+
+def status_counts():
+    """{status: number of returns} read from the counter table"""
+    counts = dict.fromkeys(TRACKED_STATUSES, 0)
+    counts.update(db.session.execute(select(ReturnStatusCount.status, ReturnStatusCount.count)).all())
+    return counts
+
+
+def rebuild_status_counts():
+    """Recount every status from return_tracker, replacing the counters; the caller commits.
+
+    Run once per database by migrations.run_once, and by `flask recount-return-statuses`
+    after return_tracker is edited outside the app.
+    """
+    status = func.coalesce(ReturnTracker.status, '')
+    counts = dict.fromkeys(TRACKED_STATUSES, 0)
+    counts.update(db.session.execute(select(status, func.count()).group_by(status)).all())
+    db.session.execute(delete(ReturnStatusCount))
+    db.session.execute(insert(ReturnStatusCount), [{'status': s, 'count': n} for s, n in counts.items()])
+    return counts
+
+
+def mark_overdue(today=None):
+    """Flip Pending returns whose due date has passed to Overdue with one UPDATE; the caller commits.
+
+    Run by each reminder scheduler sync and by the tracker page. An indexed
+    existence check comes first, so when nothing is due it takes no write lock.
+    """
+    today = today or date.today()
+    due = (ReturnTracker.status == 'Pending', ReturnTracker.due_date < today)
+    if db.session.scalar(select(ReturnTracker.id).where(*due).limit(1)) is None:
+        return 0
+    result = db.session.execute(
+        update(ReturnTracker)
+        .where(*due)
+        .values(status='Overdue', updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount:
+        _bump('Pending', -result.rowcount)
+        _bump('Overdue', result.rowcount)
+        logger.info("Marked %d returns overdue", result.rowcount)
+    return result.rowcount
+
+
+@click.command('recount-return-statuses')
+@with_appcontext
+def recount_return_statuses_command():
+    """Recount the return tracker's status counters from return_tracker."""
+    counts = rebuild_status_counts()
+    db.session.commit()
+    click.echo(', '.join(f"{status or '(none)'}: {count}" for status, count in counts.items()))
@@ -1,12 +1,35 @@
 import os
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app, make_response
+import io
+import re
+import csv
+import json
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app, make_response, Response, stream_with_context, abort, send_file
 from flask_login import login_required, current_user
 from main_app import db
 from models import *
 from forms import *
 from utils import allowed_file, save_uploaded_file
+from blobstore import release, send_stored_file
+from choices import get_client_choices, search_client_choices
+from database import in_month, in_months, month_starts, on_day, year_month
+from pagination import keyset_paginate
+from mailer import enqueue_email_job, email_job_progress
+from sms import SMSError, enqueue_sms_job, sms_job_progress, twilio_status
+from scheduler import reset_source_marks
+from xbrl_batch import enqueue_validation, queued_reports, validation_batch_progress
+from client_import import HEADERS as CLIENT_IMPORT_HEADERS, CLIENT_TYPES, ImportFileError, import_clients, report_path as import_report_path
+from gstin import BATCH_LIMIT, ERROR_MESSAGES, check_gstin, check_gstins, check_to_dict, gstins_from_csv, normalize_gstin, save_checks
+from exports import challan_filters, export_stream
+from checklists import add_items, checklist_rows, checklist_summary, refresh_completion, set_item_received
+from return_status import count_status_change, mark_overdue, status_counts
+from compliance import DUE_DATE_WINDOWS, mark_filed, refresh_client_calendar, statutory_due_date, upcoming_due_dates, upcoming_due_query
+from search import client_filter, search_filter, ranked_search, global_search, hit_filter
+from stats import (DEFAULT_SHARED_POLL, get_dashboard_stats, get_upcoming_reminders, stream_slot,
+                   sync_shared_versions, topic_versions, wait_for_change)
 from datetime import datetime, date, timedelta
-from sqlalchemy import func, extract, distinct, or_
+import time
+from sqlalchemy import case, func, distinct, or_
+from sqlalchemy.orm import joinedload
 from sqlalchemy.exc import IntegrityError
 from collections import OrderedDict
 from calendar import month_abbr
@@ -16,24 +39,20 @@ main_bp = Blueprint('main', __name__)
 @main_bp.route('/')
 @login_required
 def dashboard():
-    # Get dashboard statistics
-    total_clients = Client.query.count()
-    pending_returns = IncomeTaxReturn.query.filter_by(status='Pending').count()
-    pending_gst = GSTReturn.query.filter_by(status='Pending').count()
-    outstanding_fees = db.session.query(func.sum(OutstandingFee.amount)).filter_by(status='Pending').scalar() or 0
+    # Get dashboard statistics (cached, single query)
+    stats = get_dashboard_stats()
     
     # Get recent activities
     recent_clients = Client.query.order_by(Client.created_at.desc()).limit(5).all()
-    upcoming_reminders = Reminder.query.filter(
-        Reminder.reminder_date >= date.today(),
-        Reminder.status == 'Active'
-    ).order_by(Reminder.reminder_date).limit(5).all()
+    upcoming_reminders = get_upcoming_reminders()
+    upcoming_deadlines = upcoming_due_dates(days=30, limit=8)
     
     return render_template('dashboard.html',
-                         total_clients=total_clients,
-                         pending_returns=pending_returns,
-                         pending_gst=pending_gst,
-                         outstanding_fees=outstanding_fees,
+                         upcoming_deadlines=upcoming_deadlines,
+                         total_clients=stats['total_clients'],
+                         pending_returns=stats['pending_itr'],
+                         pending_gst=stats['pending_gst'],
+                         outstanding_fees=stats['total_outstanding'],
                          recent_clients=recent_clients,
                          upcoming_reminders=upcoming_reminders)
 
@@ -42,19 +61,12 @@ def dashboard():
 @login_required
 def clients():
     search = request.args.get('search', '')
-    page = request.args.get('page', 1, type=int)
     
     query = Client.query
     if search:
-        query = query.filter(or_(
-            Client.name.contains(search),
-            Client.pan.contains(search),
-            Client.gstin.contains(search)
-        ))
+        query = query.filter(client_filter(search))
     
-    clients_pagination = query.order_by(Client.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    clients_pagination = keyset_paginate(query, Client.created_at, Client.id)
     
     return render_template('clients/index.html', 
                          clients=clients_pagination.items,
@@ -84,6 +96,8 @@ def new_client():
             
             db.session.add(client)
             db.session.commit()
+            refresh_client_calendar(client.id)
+            db.session.commit()
             flash('Client created successfully!', 'success')
             return redirect(url_for('main.clients'))
         
@@ -96,6 +110,36 @@ def new_client():
             flash('Error Occured due to creating Client', 'danger')
         return redirect(url_for('main.clients'))
 
+@main_bp.route('/clients/import', methods=['GET', 'POST'])
+@login_required
+def import_clients_view():
+    result = None
+    if request.method == 'POST':
+        file = request.files.get('file')
+        if not file or not file.filename:
+            flash('Choose a CSV or XLSX file to import', 'danger')
+            return redirect(url_for('main.import_clients_view'))
+        try:
+            result = import_clients(file.stream, file.filename, current_user.id)
+        except ImportFileError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('main.import_clients_view'))
+        flash(f'Imported {result.imported} of {result.rows} clients.', 'success' if result.imported else 'warning')
+        if result.error:
+            flash(f'Reading stopped part-way: {result.error}. The rows listed above were processed; '
+                  f'fix the file and import the rest.', 'danger')
+
+    return render_template('clients/import.html', result=result, headers=CLIENT_IMPORT_HEADERS,
+                           client_types=CLIENT_TYPES)
+
+@main_bp.route('/clients/import/<token>/rejected.csv')
+@login_required
+def client_import_rejects(token):
+    if not re.fullmatch(r'[0-9a-f]{32}', token) or not os.path.exists(import_report_path(token)):
+        abort(404)
+    return send_file(import_report_path(token), mimetype='text/csv', as_attachment=True,
+                     download_name='rejected_clients.csv')
+
 @main_bp.route('/clients/<int:id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_client(id):
@@ -105,6 +149,9 @@ def edit_client(id):
     if form.validate_on_submit():
         form.populate_obj(client)
         db.session.commit()
+        # GSTIN or client type changes alter which returns are due
+        refresh_client_calendar(client.id)
+        db.session.commit()
         flash('Client updated successfully!', 'success')
         return redirect(url_for('main.clients'))
     
@@ -122,6 +169,7 @@ def delete_client(id):
         flash("Cannot delete client with existing outstanding fees. Please remove them first.", "danger")
         return redirect(url_for('main.clients'))
     
+    ComplianceCalendar.query.filter_by(client_id=client.id).delete()
     db.session.delete(client)
     db.session.commit()
     flash('Client deleted successfully.', 'success')
@@ -131,19 +179,14 @@ def delete_client(id):
 @main_bp.route('/tax/income-tax')
 @login_required
 def income_tax_returns():
-    page = request.args.get('page', 1, type=int)
-    returns = IncomeTaxReturn.query.join(Client).order_by(IncomeTaxReturn.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    returns = keyset_paginate(IncomeTaxReturn.query.join(Client).filter(hit_filter(IncomeTaxReturn)), IncomeTaxReturn.created_at, IncomeTaxReturn.id)
     form = IncomeTaxReturnForm()
-    form.client_id.choices = [(c.id, c.name) for c in Client.query.filter_by(status='Active').all()]
     return render_template('tax/income_tax.html', returns=returns, form=form, today=date.today())
 
 @main_bp.route('/tax/income-tax/new', methods=['GET', 'POST'])
 @login_required
 def new_income_tax_return():
     form = IncomeTaxReturnForm()
-    form.client_id.choices = [(c.id, c.name) for c in Client.query.filter_by(status='Active').all()]
     
     if form.validate_on_submit():
         itr = IncomeTaxReturn(
@@ -173,8 +216,6 @@ def edit_income_tax_return(itr_id):
     itr = IncomeTaxReturn.query.get_or_404(itr_id)
     form = IncomeTaxReturnForm(obj=itr)
 
-    form.client_id.choices = [(c.id, c.name) for c in Client.query.filter_by(status='Active').all()]
-
     if form.validate_on_submit():
         form.populate_obj(itr)
         db.session.commit()
@@ -197,19 +238,14 @@ def delete_income_tax_return(itr_id):
 @main_bp.route('/tax/tds')
 @login_required
 def tds_returns():
-    page = request.args.get('page', 1, type=int)
-    returns = TDSReturn.query.join(Client).order_by(TDSReturn.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    returns = keyset_paginate(TDSReturn.query.join(Client).filter(hit_filter(TDSReturn)), TDSReturn.created_at, TDSReturn.id)
     form = TDSReturnForm()
-    form.client_id.choices = [(c.id, c.name) for c in Client.query.filter_by(status='Active').all()]
     return render_template('tax/tds.html', returns=returns, form=form, today=date.today())
 
 @main_bp.route('/tax/tds/new', methods=['GET', 'POST'])
 @login_required
 def new_tds_return():
     form = TDSReturnForm()
-    form.client_id.choices = [(c.id, c.name) for c in Client.query.filter_by(status='Active').all()]
     
     if form.validate_on_submit():
         tds = TDSReturn(
@@ -228,6 +264,9 @@ def new_tds_return():
         
         db.session.add(tds)
         db.session.commit()
+        # A new TDS form type adds its quarterly due dates
+        refresh_client_calendar(tds.client_id)
+        db.session.commit()
         flash('TDS Return created successfully!', 'success')
         return redirect(url_for('main.tds_returns'))
     
@@ -239,11 +278,15 @@ def update_tds_return(tds_id):
     tds = TDSReturn.query.get_or_404(tds_id)
     form = TDSReturnForm(obj=tds)
 
-    form.client_id.choices = [(c.id, c.name) for c in Client.query.filter_by(status='Active').all()]
     
     if form.validate_on_submit():
+        client_ids = {tds.client_id}
         form.populate_obj(tds)        
         db.session.commit()
+        # The form type (or client) may have changed, which moves quarterly due dates
+        for client_id in client_ids | {tds.client_id}:
+            refresh_client_calendar(client_id)
+        db.session.commit()
         flash('TDS Return updated successfully!', 'success')
     
     return redirect(url_for('main.tds_returns'))
@@ -252,8 +295,12 @@ def update_tds_return(tds_id):
 @login_required
 def delete_tds_return(tds_id):
     tds = TDSReturn.query.get_or_404(tds_id)
+    client_id = tds.client_id
     db.session.delete(tds)
     db.session.commit()
+    # Drops pending due dates of a form type the client no longer files
+    refresh_client_calendar(client_id)
+    db.session.commit()
     flash('TDS Return deleted successfully!', 'success')
     return redirect(url_for('main.tds_returns'))
 
@@ -261,19 +308,14 @@ def delete_tds_return(tds_id):
 @main_bp.route('/tax/gst')
 @login_required
 def gst_returns():
-    page = request.args.get('page', 1, type=int)
-    returns = GSTReturn.query.join(Client).order_by(GSTReturn.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    returns = keyset_paginate(GSTReturn.query.join(Client).filter(hit_filter(GSTReturn)), GSTReturn.created_at, GSTReturn.id)
     form = GSTReturnForm()
-    form.client_id.choices = [(c.id, c.name) for c in Client.query.filter_by(status='Active').all()]
     return render_template('tax/gst.html', returns=returns, form=form, today=date.today())
 
 @main_bp.route('/tax/gst/new', methods=['GET', 'POST'])
 @login_required
 def new_gst_return():
     form = GSTReturnForm()
-    form.client_id.choices = [(c.id, c.name) for c in Client.query.filter_by(status='Active').all()]
     
     if form.validate_on_submit():
         gst = GSTReturn(
@@ -303,8 +345,6 @@ def edit_gst_return(gst_id):
     gst = GSTReturn.query.get_or_404(gst_id)
     form = GSTReturnForm(obj=gst)
 
-    form.client_id.choices = [(c.id, c.name) for c in Client.query.filter_by(status='Active').all()]
-
     if form.validate_on_submit():
         form.populate_obj(gst)
         db.session.commit()
@@ -327,10 +367,7 @@ def delete_gst_return(gst_id):
 @main_bp.route('/admin/employees')
 @login_required
 def employees():
-    page = request.args.get('page', 1, type=int)
-    employees_pagination = Employee.query.order_by(Employee.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    employees_pagination = keyset_paginate(Employee.query, Employee.created_at, Employee.id)
     form = EmployeeForm()
     # Total employee count
     total_employees = Employee.query.count()
@@ -406,10 +443,7 @@ def delete_employee(id):
 @main_bp.route('/admin/payroll', methods=['GET'])
 @login_required
 def payroll():
-    page = request.args.get('page', 1, type=int)
-    payroll_pagination = PayrollEntry.query.join(Employee).order_by(PayrollEntry.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    payroll_pagination = keyset_paginate(PayrollEntry.query.join(Employee), PayrollEntry.created_at, PayrollEntry.id)
     form = PayrollEntryForm()
     form.employee_id.choices = [(e.id, e.name) for e in Employee.query.filter_by(status='Active').all()]
     emp_id = request.args.get('emp_id')
@@ -512,10 +546,19 @@ def delete_payroll_entry(id):
 @main_bp.route('/admin/documents')
 @login_required
 def documents():
-    page = request.args.get('page', 1, type=int)
-    documents_pagination = Document.query.join(Client, isouter=True).order_by(Document.upload_date.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    search = request.args.get('search', '')
+    document_type = request.args.get('document_type', '')
+    client_id = request.args.get('client_id', type=int)
+
+    query = Document.query.join(Client, isouter=True)
+    if search:
+        query = query.filter(search_filter('documents', search))
+    if document_type:
+        query = query.filter(Document.document_type == document_type)
+    if client_id:
+        query = query.filter(Document.client_id == client_id)
+
+    documents_pagination = keyset_paginate(query, Document.upload_date, Document.id)
     
     # Stats
     total_documents = db.session.query(func.count(Document.id)).scalar()
@@ -523,13 +566,11 @@ def documents():
 
     now = datetime.utcnow()
     documents_this_month = db.session.query(func.count(Document.id)).filter(
-        extract('month', Document.upload_date) == now.month,
-        extract('year', Document.upload_date) == now.year
+        in_month(Document.upload_date, now)
     ).scalar()
 
     # Form
     form = DocumentForm()
-    form.client_id.choices = [(0, 'Select Client')] + [(c.id, c.name) for c in Client.query.filter_by(status='Active').all()]
 
     document_types_count = len(form.document_type.choices) or 0
     
@@ -540,14 +581,15 @@ def documents():
         total_documents=total_documents,
         total_file_size=total_file_size,
         documents_this_month=documents_this_month,
-        document_types_count=document_types_count
+        document_types_count=document_types_count,
+        search=search,
+        document_type=document_type
     )
 
 @main_bp.route('/admin/documents/new', methods=['GET', 'POST'])
 @login_required
 def new_document():
     form = DocumentForm()
-    form.client_id.choices = [(0, 'Select Client')] + [(c.id, c.name) for c in Client.query.filter_by(status='Active').all()]
     
     if form.validate_on_submit():
         file_path = None
@@ -593,8 +635,10 @@ def edit_document(id):
 
     if file:
         file_path, file_size = save_uploaded_file(file)
-        document.file_path = file_path
-        document.file_size = file_size
+        if file_path:
+            release(document.file_path)
+            document.file_path = file_path
+            document.file_size = file_size
 
     db.session.commit()
     flash('Document updated successfully!', 'success')
@@ -605,6 +649,7 @@ def edit_document(id):
 @login_required
 def delete_document(id):
     document = Document.query.get_or_404(id)
+    release(document.file_path)
     db.session.delete(document)
     db.session.commit()
     flash('Document deleted successfully!', 'success')
@@ -615,10 +660,9 @@ def delete_document(id):
 @login_required
 def preview_document(id):
     document = Document.query.get_or_404(id)
-    if document.file_path:
-        from flask import send_file
-
-        return send_file(document.file_path)
+    response = send_stored_file(document.file_path) if document.file_path else None
+    if response is not None:
+        return response
     flash('File not found.', 'warning')
     return redirect(url_for('main.documents'))
 
@@ -628,8 +672,7 @@ def preview_document(id):
 def download_document(id):
     document = Document.query.get_or_404(id)
     
-    if document.file_path and os.path.exists(document.file_path):
-        from flask import send_file
+    if document.file_path:
         from werkzeug.utils import secure_filename
 
         # Get the file extension from the file path
@@ -638,7 +681,9 @@ def download_document(id):
         # Sanitize and construct the full filename with extension
         filename = secure_filename(document.title or 'document') + file_ext
 
-        return send_file(document.file_path, as_attachment=True, download_name=filename)
+        response = send_stored_file(document.file_path, download_name=filename, as_attachment=True)
+        if response is not None:
+            return response
 
     flash('File not found.', 'warning')
     return redirect(url_for('main.documents'))
@@ -647,51 +692,41 @@ def download_document(id):
 @main_bp.route('/reports/outstanding')
 @login_required
 def outstanding_reports():
-    page = request.args.get('page', 1, type=int)
-    outstanding_pagination = OutstandingFee.query.join(Client, Client.id == OutstandingFee.client_id).order_by(OutstandingFee.due_date).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    outstanding_pagination = keyset_paginate(OutstandingFee.query.join(Client, Client.id == OutstandingFee.client_id), OutstandingFee.due_date, OutstandingFee.id, descending=False)
 
     today = date.today()
-    month = today.month
-    year = today.year
-
-    # Add below these lines:
-    pending_count = OutstandingFee.query.filter_by(status='Pending').count()
-
-    this_month_collection = db.session.query(func.sum(OutstandingFee.amount)) \
-        .filter_by(status='Paid') \
-        .filter(extract('month', OutstandingFee.created_at) == month) \
-        .filter(extract('year', OutstandingFee.created_at) == year) \
-        .scalar() or 0
-    
-    # Calculate totals
-    total_outstanding = db.session.query(func.sum(OutstandingFee.amount)).scalar() or 0
-    overdue_count = OutstandingFee.query.filter(
-        OutstandingFee.status == 'Overdue',
-        OutstandingFee.due_date < date.today()
-    ).count()
-
     form = OutstandingFeeForm()
-    form.client_id.choices = [(c.id, c.name) for c in Client.query.filter_by(status='Active').all()]
-
-    trend_data = OrderedDict()
-    for i in range(5, -1, -1):  # last 6 months
-        month_date = today - timedelta(days=i*30)
-        key = month_abbr[month_date.month]
-        total = db.session.query(func.sum(OutstandingFee.amount)).filter(
-            extract('month', OutstandingFee.created_at) == month_date.month,
-            extract('year', OutstandingFee.created_at) == month_date.year
-        ).scalar() or 0
-        trend_data[key] = total
-
-    # Status Breakdown
-    status_data = {
-        'Pending': OutstandingFee.query.filter_by(status='Pending').count(),
-        'Overdue': OutstandingFee.query.filter_by(status='Overdue').count(),
-        'Paid': OutstandingFee.query.filter_by(status='Paid').count()
-    }
-    
+
+    # Status breakdown, totals and past-due overdue fees in one grouped scan
+    status_rows = db.session.query(
+        OutstandingFee.status,
+        func.count(OutstandingFee.id),
+        func.coalesce(func.sum(OutstandingFee.amount), 0),
+        func.count(case((OutstandingFee.due_date < today, OutstandingFee.id)))
+    ).group_by(OutstandingFee.status).all()
+
+    status_counts = {status: count for status, count, _, _ in status_rows}
+    total_outstanding = sum(amount for _, _, amount, _ in status_rows)
+    overdue_count = sum(past_due for status, _, _, past_due in status_rows if status == 'Overdue')
+    pending_count = status_counts.get('Pending', 0)
+    status_data = {status: status_counts.get(status, 0) for status in ('Pending', 'Overdue', 'Paid')}
+
+    # Last six calendar months of billing (and this month's collections) in one GROUP BY
+    months = month_starts(today, 6)
+    month_key = year_month(OutstandingFee.created_at)
+    month_rows = db.session.query(
+        month_key,
+        func.coalesce(func.sum(OutstandingFee.amount), 0),
+        func.coalesce(func.sum(case((OutstandingFee.status == 'Paid', OutstandingFee.amount), else_=0)), 0)
+    ).filter(in_months(OutstandingFee.created_at, months[0], today)).group_by(month_key).all()
+
+    billed = {key: total for key, total, _ in month_rows}
+    collected = {key: paid for key, _, paid in month_rows}
+    trend_data = OrderedDict(
+        (month_abbr[start.month], billed.get(start.strftime('%Y-%m'), 0)) for start in months
+    )
+    this_month_collection = collected.get(today.strftime('%Y-%m'), 0)
+
     return render_template('reports/outstanding.html', 
                         form=form, 
                         outstanding=outstanding_pagination,
@@ -704,11 +739,26 @@ def outstanding_reports():
                         trend_labels=list(trend_data.keys()),
                         status_data=status_data)
 
+@main_bp.route('/api/reports/<name>/export')
+@login_required
+def export_report(name):
+    """Download a list view as CSV, gzipped CSV or XLSX, streamed from the database in batches.
+
+    Takes the same filter args as the list page, plus `format` (csv, csv.gz or xlsx).
+    """
+    export = export_stream(name, request.args.get('format', 'csv'), request.args)
+    if export is None:
+        abort(404)
+    body, mimetype, filename = export
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @main_bp.route('/reports/outstanding/new', methods=['GET', 'POST'])
 @login_required
 def new_outstanding_fee():
     form = OutstandingFeeForm()
-    form.client_id.choices = [(c.id, c.name) for c in Client.query.filter_by(status='Active').all()]
     
     if form.validate_on_submit():
         fee = OutstandingFee(
@@ -733,7 +783,6 @@ def new_outstanding_fee():
 def edit_outstanding_fee(id):
     fee = OutstandingFee.query.get_or_404(id)
     form = OutstandingFeeForm(obj=fee)
-    form.client_id.choices = [(c.id, c.name) for c in Client.query.filter_by(status='Active').all()]
 
     if form.validate_on_submit():
         form.populate_obj(fee)
@@ -777,7 +826,7 @@ def send_payment_reminder(id):
     existing = Reminder.query.filter(
         Reminder.client_id == client.id,
         Reminder.fee_id == fee.id,
-        func.date(Reminder.reminder_date) == today
+        on_day(Reminder.reminder_date, today)
     ).first()
     if existing:
         flash(f"Reminder already sent today for {client.name}!", 'warning')
@@ -808,10 +857,7 @@ def users():
         flash('Access denied. Admin privileges required.', 'error')
         return redirect(url_for('main.dashboard'))
     
-    page = request.args.get('page', 1, type=int)
-    users_pagination = User.query.join(Role).order_by(User.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    users_pagination = keyset_paginate(User.query.join(Role), User.created_at, User.id)
     
     form = UserForm()
     form.role_id.choices = [(r.id, r.name) for r in Role.query.all()]
@@ -944,13 +990,7 @@ def reset_password(id):
 @login_required
 def api_search_clients():
     query = request.args.get('q', '')
-    clients = Client.query.filter(
-        or_(
-            Client.name.contains(query),
-            Client.pan.contains(query),
-            Client.gstin.contains(query)
-        )
-    ).limit(10).all()
+    clients = ranked_search('clients', query, limit=10)
     
     return jsonify([{
         'id': c.id,
@@ -959,12 +999,30 @@ def api_search_clients():
         'gstin': c.gstin
     } for c in clients])
 
+@main_bp.route('/api/search')
+@login_required
+def api_global_search():
+    limit = max(1, min(request.args.get('limit', 20, type=int), 50))
+    results = global_search(request.args.get('q', ''), limit=limit)
+    return jsonify([{
+        'type': r['type'],
+        'title': r['title'],
+        'description': r['description'],
+        'url': url_for(r['endpoint'], **r['params'])
+    } for r in results])
+
+@main_bp.route('/api/clients/choices')
+@login_required
+def api_client_choices():
+    # Typeahead source for ClientSelectField
+    choices = search_client_choices(request.args.get('q', ''), active_only=bool(request.args.get('active')))
+    return jsonify([{'id': c.id, 'text': c.name} for c in choices])
+
 # CRM Routes
 @main_bp.route('/reminders')
 @login_required
 def reminders():
     search = request.args.get('search', '')
-    page = request.args.get('page', 1, type=int)
     
     query = Reminder.query
     if search:
@@ -973,9 +1031,7 @@ def reminders():
             Reminder.description.contains(search)
         ))
     
-    reminders = query.order_by(Reminder.reminder_date.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    reminders = keyset_paginate(query, Reminder.reminder_date, Reminder.id)
     
     # Get overdue reminders
     overdue_reminders = Reminder.query.filter(
@@ -992,7 +1048,6 @@ def reminders():
 @login_required
 def new_reminder():
     form = ReminderForm()
-    form.client_id.choices = [(0, 'Select Client')] + [(c.id, c.name) for c in Client.query.all()]
     
     if form.validate_on_submit():
         reminder = Reminder(
@@ -1016,7 +1071,6 @@ def new_reminder():
 def edit_reminder(id):
     reminder = Reminder.query.get_or_404(id)
     form = ReminderForm(obj=reminder)
-    form.client_id.choices = [(0, 'Select Client')] + [(c.id, c.name) for c in Client.query.all()]
     
     if form.validate_on_submit():
         reminder.client_id = form.client_id.data if form.client_id.data else None
@@ -1282,9 +1336,9 @@ def delete_inventory_item(id):
 @main_bp.route('/analytics')
 @login_required
 def analytics():
-    # Use SQLite's strftime to extract the 'YYYY-MM' format for the month
+    # 'YYYY-MM' buckets; year_month renders strftime/to_char for the active database
     monthly_revenue = db.session.query(
-        func.strftime('%Y-%m', OutstandingFee.created_at).label('month'),
+        year_month(OutstandingFee.created_at).label('month'),
         func.sum(OutstandingFee.amount).label('total')
     ).filter(OutstandingFee.status == 'Paid').group_by('month').all()
     
@@ -1300,36 +1354,93 @@ def analytics():
 @main_bp.route('/api/dashboard/stats')
 @login_required
 def api_dashboard_stats():
-    stats = {
-        'total_clients': Client.query.count(),
-        'pending_itr': IncomeTaxReturn.query.filter_by(status='Pending').count(),
-        'pending_tds': TDSReturn.query.filter_by(status='Pending').count(),
-        'pending_gst': GSTReturn.query.filter_by(status='Pending').count(),
-        'total_outstanding': db.session.query(func.sum(OutstandingFee.amount)).filter_by(status='Pending').scalar() or 0
-    }
-    return jsonify(stats)
+    return jsonify(get_dashboard_stats())
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def _reminders_payload(reminders):
+    return [{
+        'id': r.id,
+        'title': r.title,
+        'description': r.description,
+        'client_name': r.client.name if r.client else 'General',
+        'reminder_date': r.reminder_date.strftime('%d/%m/%Y'),
+        'reminder_type': r.reminder_type
+    } for r in reminders]
+
+@main_bp.route('/api/dashboard/stream')
+@login_required
+def api_dashboard_stream():
+    # Server-Sent Events: push stat deltas / reminder changes only when the tables change.
+    # Streams wake on this process's commits and, every DASHBOARD_SHARED_POLL seconds, on
+    # other processes' (see stats.sync_shared_versions). Each holds a worker thread, so a
+    # process serves at most DASHBOARD_STREAM_LIMIT; the page falls back to polling beyond
+    # that. EventSource reconnects after max_age.
+    keepalive = current_app.config.get('DASHBOARD_STREAM_KEEPALIVE', 15)
+    max_age = current_app.config.get('DASHBOARD_STREAM_MAX_AGE', 300)
+    poll = current_app.config.get('DASHBOARD_SHARED_POLL', DEFAULT_SHARED_POLL)
+
+    def generate():
+        with stream_slot() as acquired:
+            if not acquired:
+                yield _sse('busy', {'poll': url_for('main.api_dashboard_stats')})
+                return
+            started = idle_since = time.monotonic()
+            seen = {}
+            last_stats = {}
+            last_reminders = None
+            yield 'retry: 1000\n\n'
+            while time.monotonic() - started < max_age:
+                if seen:
+                    wait_for_change(seen, timeout=min(poll, keepalive))
+                sync_shared_versions()
+                versions = topic_versions()
+
+                if versions.get('stats') != seen.get('stats'):
+                    stats = get_dashboard_stats()
+                    delta = {k: v for k, v in stats.items() if last_stats.get(k) != v}
+                    if delta:
+                        yield _sse('stats', delta)
+                    last_stats = stats
+
+                if versions.get('reminders') != seen.get('reminders'):
+                    reminders = _reminders_payload(get_upcoming_reminders())
+                    if reminders != last_reminders:
+                        yield _sse('reminders', reminders)
+                    last_reminders = reminders
+
+                if versions != seen:
+                    idle_since = time.monotonic()
+                elif time.monotonic() - idle_since >= keepalive:
+                    yield ': keepalive\n\n'
+                    idle_since = time.monotonic()
+                seen = versions
+                # Release the DB connection while idle
+                db.session.remove()
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 # ROC Forms Routes
 @main_bp.route('/roc_forms')
 @login_required
 def roc_forms():
     search = request.args.get('search', '')
-    page = request.args.get('page', 1, type=int)
     
-    query = ROCForm.query
+    query = ROCForm.query.filter(hit_filter(ROCForm))
     if search:
         query = query.join(Client).filter(or_(
-            Client.name.contains(search),
+            client_filter(search),
             ROCForm.form_type.contains(search),
             ROCForm.acknowledgment_number.contains(search)
         ))
     
-    roc_forms = query.order_by(ROCForm.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    roc_forms = keyset_paginate(query, ROCForm.created_at, ROCForm.id)
 
     form = ROCFormForm()
-    form.client_id.choices = [(c.id, c.name) for c in Client.query.all()]
     
     return render_template('compliance/roc_forms.html', roc_forms=roc_forms, Rform=form, search=search, today=date.today())
 
@@ -1337,7 +1448,6 @@ def roc_forms():
 @login_required
 def new_roc_form():
     form = ROCFormForm()
-    form.client_id.choices = [(c.id, c.name) for c in Client.query.all()]
     
     if form.validate_on_submit():
         roc_form = ROCForm(
@@ -1366,8 +1476,6 @@ def edit_roc_form(roc_id):
     roc_form = ROCForm.query.get_or_404(roc_id)
     form = ROCFormForm(obj=roc_form)
 
-    form.client_id.choices = [(c.id, c.name) for c in Client.query.all()]
-
     if form.validate_on_submit():
         form.populate_obj(roc_form)        
         db.session.commit()
@@ -1389,21 +1497,17 @@ def delete_roc_form(roc_id):
 @login_required
 def sft_returns():
     search = request.args.get('search', '')
-    page = request.args.get('page', 1, type=int)
     
-    query = SFTReturn.query
+    query = SFTReturn.query.filter(hit_filter(SFTReturn))
     if search:
         query = query.join(Client).filter(or_(
-            Client.name.contains(search),
+            client_filter(search),
             SFTReturn.acknowledgment_number.contains(search)
         ))
     
-    sft_returns = query.order_by(SFTReturn.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    sft_returns = keyset_paginate(query, SFTReturn.created_at, SFTReturn.id)
 
     form = SFTReturnForm()
-    form.client_id.choices = [(c.id, c.name) for c in Client.query.all()]
     
     return render_template('compliance/sft_returns.html', sft_returns=sft_returns, Sform=form, search=search, today=date.today())
 
@@ -1411,7 +1515,6 @@ def sft_returns():
 @login_required
 def new_sft_return():
     form = SFTReturnForm()
-    form.client_id.choices = [(c.id, c.name) for c in Client.query.all()]
     
     if form.validate_on_submit():
         sft_return = SFTReturn(
@@ -1439,7 +1542,6 @@ def new_sft_return():
 def edit_sft_return(sft_id):
     sft = SFTReturn.query.get_or_404(sft_id)
     form = SFTReturnForm(obj=sft)
-    form.client_id.choices = [(c.id, c.name) for c in Client.query.all()]
 
     if form.validate_on_submit():
         form.populate_obj(sft)
@@ -1461,21 +1563,17 @@ def delete_sft_form(sft_id):
 @login_required
 def balance_sheet_audits():
     form = BalanceSheetAuditForm()
-    form.client_id.choices = [(c.id, c.name) for c in Client.query.all()]
 
     search = request.args.get('search', '')
-    page = request.args.get('page', 1, type=int)
     
     query = BalanceSheetAudit.query
     if search:
         query = query.join(Client).filter(or_(
-            Client.name.contains(search),
+            client_filter(search),
             BalanceSheetAudit.auditor_name.contains(search)
         ))
     
-    audits = query.order_by(BalanceSheetAudit.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    audits = keyset_paginate(query, BalanceSheetAudit.created_at, BalanceSheetAudit.id)
 
     return render_template('compliance/balance_sheet_audits.html', form=form, audits=audits, search=search)
 
@@ -1484,7 +1582,6 @@ def balance_sheet_audits():
 @login_required
 def new_balance_sheet_audit():
     form = BalanceSheetAuditForm()
-    form.client_id.choices = [(c.id, c.name) for c in Client.query.all()]
     
     if form.validate_on_submit():
         audit = BalanceSheetAudit(
@@ -1517,7 +1614,6 @@ def new_balance_sheet_audit():
 def edit_balance_sheet_audit(bsa_id):
     audit = BalanceSheetAudit.query.get_or_404(bsa_id)
     form = BalanceSheetAuditForm(obj=audit)
-    form.client_id.choices = [(c.id, c.name) for c in Client.query.all()]
 
     if form.validate_on_submit():
         form.populate_obj(audit)
@@ -1540,18 +1636,15 @@ def delete_balance_sheet_audit(bsa_id):
 @login_required
 def cma_reports():
     search = request.args.get('search', '')
-    page = request.args.get('page', 1, type=int)
     
     query = CMAReport.query
     if search:
         query = query.join(Client).filter(or_(
-            Client.name.contains(search),
+            client_filter(search),
             CMAReport.reporting_period.contains(search)
         ))
     
-    cma_reports = query.order_by(CMAReport.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    cma_reports = keyset_paginate(query, CMAReport.created_at, CMAReport.id)
     
     return render_template('compliance/cma_reports.html', cma_reports=cma_reports, search=search)
 
@@ -1559,7 +1652,6 @@ def cma_reports():
 @login_required
 def new_cma_report():
     form = CMAReportForm()
-    form.client_id.choices = [(c.id, c.name) for c in Client.query.all()]
     
     if form.validate_on_submit():
         cma_report = CMAReport(
@@ -1591,9 +1683,6 @@ def edit_cma_report(report_id):
     report = CMAReport.query.get_or_404(report_id)
     form = CMAReportForm(obj=report)
 
-    # Populate dynamic client choices
-    form.client_id.choices = [(client.id, client.name) for client in Client.query.all()]
-
     if form.validate_on_submit():
         form.populate_obj(report)
         db.session.commit()
@@ -1615,18 +1704,15 @@ def delete_cma_report(report_id):
 @login_required
 def assessment_orders():
     search = request.args.get('search', '')
-    page = request.args.get('page', 1, type=int)
     
     query = AssessmentOrder.query
     if search:
         query = query.join(Client).filter(or_(
-            Client.name.contains(search),
+            client_filter(search),
             AssessmentOrder.order_number.contains(search)
         ))
     
-    orders = query.order_by(AssessmentOrder.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    orders = keyset_paginate(query, AssessmentOrder.created_at, AssessmentOrder.id)
     
     return render_template('compliance/assessment_orders.html', orders=orders, search=search)
 
@@ -1635,7 +1721,6 @@ def assessment_orders():
 @login_required
 def new_assessment_order():
     form = AssessmentOrderForm()
-    form.client_id.choices = [(c.id, c.name) for c in Client.query.all()]
     
     if form.validate_on_submit():
         order = AssessmentOrder(
@@ -1668,7 +1753,6 @@ def new_assessment_order():
 def edit_assessment_order(order_id):
     order = AssessmentOrder.query.get_or_404(order_id)
     form = AssessmentOrderForm(obj=order)
-    form.client_id.choices = [(client.id, client.name) for client in Client.query.all()]
 
     if form.validate_on_submit():
         form.populate_obj(order)
@@ -1692,33 +1776,34 @@ def delete_assessment_order(order_id):
 @login_required
 def xbrl_reports():
     search = request.args.get('search', '')
-    page = request.args.get('page', 1, type=int)
     
     query = XBRLReport.query
     if search:
         query = query.join(Client).filter(or_(
-            Client.name.contains(search),
+            client_filter(search),
             XBRLReport.acknowledgment_number.contains(search)
         ))
     
-    xbrl_reports = query.order_by(XBRLReport.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    xbrl_reports = keyset_paginate(query, XBRLReport.created_at, XBRLReport.id)
+    queued = queued_reports([r.id for r in xbrl_reports.items])
+    validation_batches = XBRLValidationBatch.query.filter(or_(
+        XBRLValidationBatch.status.in_(('Queued', 'Running')),
+        XBRLValidationBatch.finished_at >= datetime.utcnow() - timedelta(hours=1),
+    )).order_by(XBRLValidationBatch.created_at.desc()).limit(5).all()
     
-    return render_template('compliance/xbrl_reports.html', xbrl_reports=xbrl_reports, search=search)
+    return render_template('compliance/xbrl_reports.html', xbrl_reports=xbrl_reports, search=search,
+                           queued=queued, validation_batches=validation_batches)
 
 @main_bp.route('/xbrl_reports/new', methods=['GET', 'POST'])
 @login_required
 def new_xbrl_report():
     form = XBRLReportForm()
-    form.client_id.choices = [(c.id, c.name) for c in Client.query.all()]
 
     xbrl_file_path = None  # Always initialize your path
 
     if form.validate_on_submit():
         if form.xbrl_file.data:
-            xbrl_file_path, file_size = save_uploaded_file(form.xbrl_file.data, 'xbrl')  # ✅ Use correct folder & unpack tuple
-            print(f"File saved to: {xbrl_file_path}")  # Optional debug
+            xbrl_file_path, file_size = save_uploaded_file(form.xbrl_file.data)
 
         xbrl_report = XBRLReport(
             client_id=form.client_id.data,
@@ -1736,6 +1821,9 @@ def new_xbrl_report():
 
         db.session.add(xbrl_report)
         db.session.commit()
+        if xbrl_file_path:
+            # The uploaded instance decides the validation outcome, not the form
+            enqueue_validation([xbrl_report.id], current_user.id)
         flash('XBRL Report created successfully!', 'success')
         return redirect(url_for('main.xbrl_reports'))
 
@@ -1746,7 +1834,6 @@ def new_xbrl_report():
 def xbrl_edit(report_id):
     report = XBRLReport.query.get_or_404(report_id)
     form = XBRLReportForm(obj=report)
-    form.client_id.choices = [(c.id, c.name) for c in Client.query.all()]
 
     if form.validate_on_submit():
         report.client_id = form.client_id.data
@@ -1762,14 +1849,48 @@ def xbrl_edit(report_id):
         flash('XBRL Report updated successfully!', 'success')
         return redirect(url_for('main.xbrl_reports'))
 
-    return render_template('compliance/xbrl_form.html', form=form, title='Edit XBRL Report')
+    return render_template('compliance/xbrl_form.html', form=form, title='Edit XBRL Report', report=report)
+
+@main_bp.route('/xbrl_reports/<int:report_id>/validate', methods=['POST'])
+@login_required
+def xbrl_validate(report_id):
+    report = XBRLReport.query.get_or_404(report_id)
+    if enqueue_validation([report.id], current_user.id):
+        flash('XBRL validation queued.', 'info')
+    else:
+        flash('This report has no XBRL file or is already being validated.', 'warning')
+    return redirect(url_for('main.xbrl_reports'))
+
+@main_bp.route('/xbrl_reports/validate-batch', methods=['POST'])
+@login_required
+def xbrl_validate_batch():
+    scope = request.form.get('scope', 'selected')
+    if scope == 'pending':
+        report_ids = [r.id for r in XBRLReport.query.with_entities(XBRLReport.id)
+                      .filter(XBRLReport.validation_status == 'Pending')]
+    else:
+        report_ids = [int(i) for i in request.form.getlist('report_ids') if i.isdigit()]
+    batch = enqueue_validation(report_ids, current_user.id)
+    if batch:
+        flash(f'Validating {batch.total} XBRL report(s) in the background.', 'info')
+    else:
+        flash('No reports with an XBRL file to validate.', 'warning')
+    return redirect(url_for('main.xbrl_reports'))
+
+@main_bp.route('/xbrl_reports/batches/<int:batch_id>')
+@login_required
+def xbrl_batch_status(batch_id):
+    batch = XBRLValidationBatch.query.get_or_404(batch_id)
+    return jsonify(validation_batch_progress(batch))
 
 # Route: Delete XBRL Report
 @main_bp.route('/xbrl_reports/delete/<int:report_id>', methods=['POST'])
 @login_required
 def xbrl_delete(report_id):
     report = XBRLReport.query.get_or_404(report_id)
-    if report.xbrl_file_path:
+    XBRLValidationItem.query.filter_by(report_id=report.id).delete()
+    if report.xbrl_file_path and not release(report.xbrl_file_path):
+        # Uploaded before the blob store: the file belongs to this report alone
         try:
             abs_path = os.path.join(current_app.root_path, report.xbrl_file_path)
             if os.path.exists(abs_path):
@@ -1808,64 +1929,92 @@ def gst_validator():
 @main_bp.route('/smart/validate-gst', methods=['POST'])
 @login_required
 def validate_gst():
-    gstin = request.form.get('gstin', '').strip()
+    gstin = normalize_gstin(request.form.get('gstin'))
     
     if not gstin or len(gstin) != 15:
         flash('Please enter a valid 15-digit GSTIN', 'error')
         return redirect(url_for('main.gst_validator'))
     
-    # Check if already validated recently
-    existing = GSTValidation.query.filter_by(gstin=gstin).first()
-    
-    # Simple validation logic - in production, integrate with GST API
-    is_valid = len(gstin) == 15 and gstin.isalnum()
-    
-    if existing:
-        existing.last_validated = datetime.utcnow()
-        existing.is_valid = is_valid
-    else:
-        validation = GSTValidation(
-            gstin=gstin,
-            is_valid=is_valid,
-            business_name=f"Business for {gstin[:2]}" if is_valid else None,
-            status="Active" if is_valid else "Invalid",
-            state_code=gstin[:2] if is_valid else None,
-            state_name=f"State {gstin[:2]}" if is_valid else None,
-            taxpayer_type="Regular" if is_valid else None,
-            constitution="Private Limited" if is_valid else None
-        )
-        db.session.add(validation)
-        existing = validation
-    
+    # Offline check: state code, embedded PAN and check digit
+    check = check_gstin(gstin)
+    save_checks([check])
     db.session.commit()
     
+    validation = GSTValidation.query.filter_by(gstin=gstin).first()
     recent_validations = GSTValidation.query.order_by(GSTValidation.last_validated.desc()).limit(10).all()
     return render_template('smart/gst_validator.html', 
-                         validation_result=existing, 
+                         validation_result=validation, 
+                         validation_error=ERROR_MESSAGES.get(check.error),
                          recent_validations=recent_validations)
 
+@main_bp.route('/smart/validate-gst/batch', methods=['POST'])
+@login_required
+def validate_gst_batch():
+    """Validate many GSTINs at once.
+
+    Accepts a JSON list (or {"gstins": [...]}), an uploaded CSV file, or a
+    text/csv body. Answers with JSON, or with a CSV of results for CSV input.
+    """
+    upload = request.files.get('file')
+    if upload:
+        values = gstins_from_csv(io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline=''))
+        as_csv = True
+    elif request.is_json:
+        data = request.get_json(silent=True)
+        values = data.get('gstins') if isinstance(data, dict) else data
+        if not isinstance(values, list):
+            return jsonify({'error': 'Expected a list of GSTINs'}), 400
+        as_csv = False
+    elif request.mimetype == 'text/csv':
+        values = gstins_from_csv(io.StringIO(request.get_data(as_text=True), newline=''))
+        as_csv = True
+    else:
+        return jsonify({'error': 'Send a JSON list of GSTINs or a CSV file'}), 400
+    as_csv = request.args.get('format', 'csv' if as_csv else 'json') == 'csv'
+
+    checks = check_gstins(values)
+    if len(checks) > BATCH_LIMIT:
+        return jsonify({'error': f'At most {BATCH_LIMIT} GSTINs can be validated per request'}), 413
+    save_checks(checks.values(), source='Offline batch')
+    db.session.commit()
+
+    results = [check_to_dict(c) for c in checks.values()]
+    if as_csv:
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=list(results[0]) if results else ['gstin'])
+        writer.writeheader()
+        writer.writerows(results)
+        response = make_response(out.getvalue())
+        response.headers['Content-Type'] = 'text/csv; charset=utf-8'
+        response.headers['Content-Disposition'] = 'attachment; filename=gstin_validation.csv'
+        return response
+    valid = sum(1 for c in checks.values() if c.is_valid)
+    return jsonify({'total': len(results), 'valid': valid, 'invalid': len(results) - valid, 'results': results})
+
 
 @main_bp.route('/smart/challan-management', methods=['GET', 'POST'])
 @login_required
 def challan_management():
     form = ChallanManagementForm()
-    query = ChallanManagement.query
+    filters, criteria = challan_filters(request.values)
 
-    if form.validate_on_submit():
-        if form.status.data:
-            query = query.filter_by(status=form.status.data)
+    query = ChallanManagement.query.options(joinedload(ChallanManagement.client)).filter(*criteria, hit_filter(ChallanManagement))
+    challans = keyset_paginate(query, ChallanManagement.created_at, ChallanManagement.id)
 
-    challans = query.order_by(ChallanManagement.created_at.desc()).all()
-
-        # 📊 Metric calculations
-    total_challans = len(challans)
-    pending_amount = sum(c.amount for c in challans if c.status.lower() != 'cleared')
-    cleared_amount = sum(c.amount for c in challans if c.status.lower() == 'cleared')
+    # 📊 Metric calculations, grouped by status in SQL; ix_challan_management_status_amount covers it
+    totals = db.session.query(
+        ChallanManagement.status, func.count(), func.coalesce(func.sum(ChallanManagement.amount), 0)
+    ).filter(*criteria).group_by(ChallanManagement.status).all()
+    total_challans = sum(count for _, count, _ in totals)
+    cleared_amount = sum(amount for status, _, amount in totals if status == 'Cleared')
+    pending_amount = sum(amount for status, _, amount in totals if status != 'Cleared')
 
     return render_template(
         'smart/challan_management.html',
         challans=challans,
         form=form,
+        filters=filters,
+        clients=get_client_choices(),
         total_challans=total_challans,
         pending_amount=pending_amount,
         cleared_amount=cleared_amount
@@ -1875,7 +2024,6 @@ def challan_management():
 @login_required
 def new_challan():
     form = ChallanManagementForm()
-    form.client_id.choices = [(c.id, c.name) for c in Client.query.all()]
 
     if form.validate_on_submit():
         challan = ChallanManagement(
@@ -1908,7 +2056,6 @@ def new_challan():
 def edit_challan(challan_id):
     challan = ChallanManagement.query.get_or_404(challan_id)
     form = ChallanManagementForm(obj=challan)
-    form.client_id.choices = [(c.id, c.name) for c in Client.query.all()]
 
     if form.validate_on_submit():
         form.populate_obj(challan)
@@ -1948,29 +2095,40 @@ def print_pdf(id):
 @login_required
 def return_tracker():
     filter_type = request.args.get('filter', '')
-    clients = Client.query.order_by(Client.name).all()
+    clients = get_client_choices()
+
+    # The overdue sweep also runs here, so returns turn Overdue without the reminder scheduler
+    if mark_overdue():
+        db.session.commit()
 
+    query = ReturnTracker.query.options(joinedload(ReturnTracker.client))
     if filter_type:
         # Match entries like 'ITR-1', 'ITR-2', etc., using LIKE
-        returns = ReturnTracker.query.filter(ReturnTracker.return_type.like(f"{filter_type}%"))\
-                                     .order_by(ReturnTracker.due_date).all()
-    else:
-        returns = ReturnTracker.query.order_by(ReturnTracker.due_date).all()
+        query = query.filter(ReturnTracker.return_type.like(f"{filter_type}%"))
+    returns = keyset_paginate(query, ReturnTracker.due_date, ReturnTracker.id, descending=False)
+
+    # Status counters, maintained by add_return() and the overdue sweep
+    counts = status_counts()
 
-    # Status counters
-    pending_count = ReturnTracker.query.filter_by(status='Pending').count()
-    filed_count = ReturnTracker.query.filter_by(status='Filed').count()
-    overdue_count = ReturnTracker.query.filter_by(status='Overdue').count()
-    processed_count = ReturnTracker.query.filter_by(status='Processed').count()
+    window = request.args.get('window', 30, type=int)
+    if window not in DUE_DATE_WINDOWS:
+        window = 30
+    # Paged separately from the returns list, on its own cursor argument
+    upcoming = keyset_paginate(upcoming_due_query(days=window, family=filter_type or None),
+                               ComplianceCalendar.due_date, ComplianceCalendar.id, descending=False,
+                               cursor=request.args.get('due_cursor'))
 
     return render_template(
         'smart/return_tracker.html',
+        upcoming=upcoming,
+        window=window,
+        windows=DUE_DATE_WINDOWS,
         returns=returns,
         clients=clients,
-        pending_count=pending_count,
-        filed_count=filed_count,
-        overdue_count=overdue_count,
-        processed_count=processed_count,
+        pending_count=counts['Pending'],
+        filed_count=counts['Filed'],
+        overdue_count=counts['Overdue'],
+        processed_count=counts['Processed'],
         filter_type=filter_type  # Pass the filter value to keep dropdown selection
     )
 
@@ -1991,16 +2149,26 @@ def add_return():
         due_date = datetime.strptime(due_date, '%Y-%m-%d').date() if due_date else None
         filing_date = datetime.strptime(filing_date, '%Y-%m-%d').date() if filing_date else None
 
+        if not due_date:
+            # Fall back to the statutory due date for this return and period
+            client = Client.query.get(int(client_id))
+            due_date = statutory_due_date(client, return_type, period) if client else None
+            if not due_date:
+                flash("Enter a due date; none is known for this return type and period.", "danger")
+                return redirect(url_for('main.return_tracker'))
+
         if return_id:
             # Edit existing
             rtn = ReturnTracker.query.get(int(return_id))
             if not rtn:
                 flash("Return not found.", "danger")
                 return redirect(url_for('main.return_tracker'))
+            old_status = rtn.status
         else:
             # New
             rtn = ReturnTracker()
             db.session.add(rtn)
+            old_status = None
 
         # Common fields
         rtn.client_id = int(client_id)
@@ -2011,6 +2179,8 @@ def add_return():
         rtn.status = status
         rtn.acknowledgment_number = ack_number
         rtn.remarks = remarks
+        mark_filed(rtn.client_id, return_type, period, filed=status in ('Filed', 'Processed'))
+        count_status_change(old_status, status, created=not return_id)
 
         db.session.commit()
         flash("Return saved successfully.", "success")
@@ -2090,20 +2260,14 @@ def save_auto_reminder():
 @login_required
 def client_search():
     search = request.args.get('search', '')
-    clients = Client.query
+    search_type = request.args.get('search_type', 'all')
     
     if search:
-        clients = clients.filter(
-            db.or_(
-                Client.name.contains(search),
-                Client.pan.contains(search),
-                Client.gstin.contains(search),
-                Client.email.contains(search)
-            )
-        )
-    
-    clients = clients.order_by(Client.name).all()
-    return render_template('crm/client_search.html', clients=clients, search=search)
+        columns = (search_type,) if search_type in ('name', 'pan', 'gstin', 'email') else None
+        clients = ranked_search('clients', search, columns=columns)
+    else:
+        clients = Client.query.order_by(Client.name).all()
+    return render_template('crm/client_search.html', clients=clients, search=search, search_type=search_type)
 
 @main_bp.route('/crm/client-notes', methods=['GET', 'POST'])
 @login_required
@@ -2142,18 +2306,21 @@ def client_notes():
     # GET: Handle filters
     note_type = request.args.get('note_type', '')
     client_id = request.args.get('client_id', '')
+    search = request.args.get('search', '')
 
     notes_query = ClientNote.query.order_by(ClientNote.created_at.desc())
 
+    if search:
+        notes_query = notes_query.filter(search_filter('client_notes', search))
     if note_type:
         notes_query = notes_query.filter(ClientNote.note_type == note_type)
     if client_id:
         notes_query = notes_query.filter(ClientNote.client_id == int(client_id))
 
     notes = notes_query.all()
-    clients = Client.query.all()
+    clients = get_client_choices()
 
-    return render_template('crm/client_notes.html', notes=notes, clients=clients, note_type=note_type)
+    return render_template('crm/client_notes.html', notes=notes, clients=clients, note_type=note_type, search=search)
 
 @main_bp.route('/crm/client-notes/delete/<int:note_id>', methods=['POST'])
 @login_required
@@ -2222,43 +2389,24 @@ def get_actions(status):
 @main_bp.route('/crm/document-checklists')
 @login_required
 def document_checklists():
-    raw_checklists = DocumentChecklist.query.order_by(DocumentChecklist.due_date).all()
-    clients = Client.query.order_by(Client.name).all()
+    clients = get_client_choices()
+    today = date.today()
 
     checklists = []
-    active_count = completed_count = overdue_count = 0
-    total_docs = completed_docs = 0
-
-    for c in raw_checklists:
-        required_docs = json.loads(c.documents_required or "[]")
-        received_docs = json.loads(c.documents_received or "[]")
-        total = len(required_docs)
-        received = len(received_docs)
-        progress = int((received / total) * 100) if total else 0
-
-        # Tally for dashboard cards
-        if c.status.lower() == "completed":
-            completed_count += 1
-        elif c.due_date and c.due_date < date.today() and progress < 100:
-            overdue_count += 1
-        else:
-            active_count += 1
-
-        total_docs += total
-        completed_docs += received
-
+    for c in checklist_rows():
+        progress = int(c.completion_percentage or 0)
         checklist = {
             'id': c.id,
-            'client': c.client.name if c.client else 'N/A',
+            'client': c.client_name or 'N/A',
             'description': c.checklist_name,
             'service': c.service_type,
             'service_color': get_service_color(c.service_type),
             'due_date': c.due_date.strftime('%d-%m-%Y') if c.due_date else 'N/A',
-            'overdue': c.due_date < date.today() and progress < 100 if c.due_date else False,
+            'overdue': c.due_date < today and progress < 100 if c.due_date else False,
             'progress': progress,
             'progress_color': get_progress_color(progress),
-            'received': received,
-            'total': total,
+            'received': c.received,
+            'total': c.total,
             'status': c.status,
             'status_color': get_status_color(c.status),
             'actions': get_actions(c.status)
@@ -2266,17 +2414,16 @@ def document_checklists():
 
         checklists.append(checklist)
 
-    # Compute avg completion
-    avg_completion_rate = round((completed_docs / total_docs) * 100, 1) if total_docs else 0
+    summary = checklist_summary(today)
 
     return render_template(
         'crm/document_checklists.html',
         checklists=checklists,
         clients=clients,
-        active_checklists_count=active_count,
-        completed_checklists_count=completed_count,
-        overdue_checklists_count=overdue_count,
-        avg_completion_rate=avg_completion_rate
+        active_checklists_count=summary['active'],
+        completed_checklists_count=summary['completed'],
+        overdue_checklists_count=summary['overdue'],
+        avg_completion_rate=summary['avg_completion_rate']
     )
 
 
@@ -2301,24 +2448,19 @@ def create_checklist():
         # all_documents includes required ones (checkboxes + custom text names)
         all_documents = required_docs + [doc for doc in custom_docs if doc not in required_docs]
 
-        # Now total and checked count
-        total_docs = len(all_documents)
-        checked_docs = len(documents)
-        percentage = int((checked_docs / total_docs) * 100) if total_docs else 0
-
         new_checklist = DocumentChecklist(
             client_id=client_id,
             checklist_name=checklist_name,
             service_type=service_type,
-            documents_required=json.dumps(all_documents),
-            documents_received=json.dumps(documents),
-            completion_percentage=percentage,
             due_date=due_date,
             status="Pending",
             created_by=current_user.id
         )
 
         db.session.add(new_checklist)
+        db.session.flush()
+        add_items(new_checklist.id, all_documents, received=documents)
+        refresh_completion([new_checklist.id])
         db.session.commit()
 
         flash("Checklist created successfully!", "success")
@@ -2330,6 +2472,31 @@ def create_checklist():
         return redirect(url_for("main.document_checklists"))
 
 
+@main_bp.route('/crm/document-checklists/<int:checklist_id>/items')
+@login_required
+def checklist_items(checklist_id):
+    checklist = DocumentChecklist.query.get_or_404(checklist_id)
+    return jsonify([{
+        'id': item.id,
+        'document_name': item.document_name,
+        'received': item.received,
+        'received_at': item.received_at.strftime('%d-%m-%Y %H:%M') if item.received_at else None,
+    } for item in checklist.items])
+
+
+@main_bp.route('/crm/document-checklists/<int:checklist_id>/items/<int:item_id>', methods=['POST'])
+@login_required
+def update_checklist_item(checklist_id, item_id):
+    item = DocumentChecklistItem.query.filter_by(id=item_id, checklist_id=checklist_id).first_or_404()
+    data = request.get_json(silent=True) or request.form
+    set_item_received(item, str(data.get('received')).lower() in ('1', 'true', 'on'))
+    db.session.flush()
+    refresh_completion([checklist_id])
+    db.session.commit()
+    return jsonify({'success': True, 'received': item.received,
+                    'progress': int(item.checklist.completion_percentage or 0)})
+
+
 @main_bp.route('/delete_checklist/<int:checklist_id>', methods=['POST'])
 @login_required
 def delete_checklist(checklist_id):
@@ -2349,21 +2516,18 @@ def delete_checklist(checklist_id):
 def communications():
     # Communication Logs
     logs = CommunicationLog.query.order_by(CommunicationLog.sent_at.desc()).limit(100).all()
-    clients = Client.query.filter_by(status='Active').all()  # assuming a Client model exists
+    clients = get_client_choices(active_only=True)
 
     # Stats
-    current_month = datetime.utcnow().month
-    current_year = datetime.utcnow().year
+    now = datetime.utcnow()
     sms_count = CommunicationLog.query.filter(
         CommunicationLog.communication_type == 'SMS',
-        func.extract('month', CommunicationLog.sent_at) == current_month,
-        func.extract('year', CommunicationLog.sent_at) == current_year
+        in_month(CommunicationLog.sent_at, now)
     ).count()
 
     email_count = CommunicationLog.query.filter(
         CommunicationLog.communication_type == 'email',
-        func.extract('month', CommunicationLog.sent_at) == current_month,
-        func.extract('year', CommunicationLog.sent_at) == current_year
+        in_month(CommunicationLog.sent_at, now)
     ).count()
 
     auto_reminders = AutoReminderSetting.query.filter_by(user_id=current_user.id).first()
@@ -2379,10 +2543,13 @@ def communications():
 
     # Simulated configuration statuses (you would fetch these from settings/config DB table)
     config = {
-        "twilio_status": "NotConfigured",  # handle this later
+        "twilio_status": twilio_status(current_app.config),
         "smtp_status": email_config.status if email_config else "NotConfigured"
     }
 
+    email_jobs = EmailJob.query.order_by(EmailJob.created_at.desc()).limit(5).all()
+    sms_jobs = SMSJob.query.order_by(SMSJob.created_at.desc()).limit(5).all()
+
     smsForm = SMSTemplateForm()
 
     return render_template('crm/communications.html',
@@ -2397,6 +2564,8 @@ def communications():
                            auto_reminders=auto_reminders,
                            templates_count=templates_count,
                            config=config,
+                           email_jobs=email_jobs,
+                           sms_jobs=sms_jobs,
                            timedelta=timedelta)
 
 @main_bp.route('/crm/setup-email', methods=['POST'])
@@ -2438,8 +2607,10 @@ def reset_email_config():
 @main_bp.route('/crm/send-email', methods=['POST'])
 @login_required
 def send_email():
-    import smtplib
-    from email.message import EmailMessage
+    # The send dialog posts both message types here
+    if request.form.get('message_type') == 'sms':
+        return send_sms()
+
     # Check SMTP config for current user
     smtp_config = Configuration.query.filter_by(user_id=current_user.id, type='email', status='Configured').first()
     if not smtp_config:
@@ -2447,79 +2618,60 @@ def send_email():
         return redirect(url_for('main.communications'))
 
     # Extract form data
-    message_type = request.form.get('message_type')  # should be 'email'
+    message_type = request.form.get('message_type') or 'email'
     subject = request.form.get('subject')
     body = request.form.get('message')
     template_id = request.form.get('template_id')
     recipient_ids = request.form.getlist('recipients')
 
-    # Prepare recipients
-    if 'all' in recipient_ids:
-        clients = Client.query.filter_by(status='Active').all()
-    else:
-        clients = Client.query.filter(Client.id.in_(recipient_ids)).all()
+    if not recipient_ids:
+        flash('Please select at least one recipient.', 'warning')
+        return redirect(url_for('main.communications'))
 
-    template_name = EmailTemplate.query.get_or_404(template_id).template_name
+    template = EmailTemplate.query.get(int(template_id)) if template_id and template_id.isdigit() else None
+    template_name = template.template_name if template else 'Custom'
 
-    # Send emails
-    try:
-        with smtplib.SMTP(smtp_config.smtp_server, smtp_config.smtp_port) as server:
-            server.starttls()
-            server.login(smtp_config.email_address, smtp_config.email_password)
-
-            for client in clients:
-                # Replace placeholders in subject and body
-                personalized_subject = substitute_vars(subject, client)
-                personalized_body = substitute_vars(body, client)
-
-                msg = EmailMessage()
-                msg['From'] = smtp_config.email_address
-                msg['To'] = client.email  # assumes Client model has .email
-                msg['Subject'] = personalized_subject
-                msg.set_content(personalized_body)
-
-                server.send_message(msg)
-
-                # Log communication
-                log = CommunicationLog(
-                    client_id=client.id,
-                    communication_type=message_type,
-                    subject=personalized_subject,
-                    message=personalized_body,
-                    recipient=client.name,
-                    status='Sent',
-                    template_used=template_name or 'Custom',
-                    created_by=current_user.id
-                )
-                db.session.add(log)
+    # Delivery happens in the background dispatcher; progress is shown on the communications page
+    job = enqueue_email_job(current_user.id, subject, body, recipient_ids,
+                            template_used=template_name, communication_type=message_type)
+    flash(f"Email queued for {job.total} client(s). Delivery progress is shown under Email Jobs.", 'success')
+    return redirect(url_for('main.communications'))
 
-            db.session.commit()
-        flash(f"Email sent to {len(clients)} client(s) successfully!", 'success')
-    
-    except smtplib.SMTPAuthenticationError:
-        flash('Authentication failed. Please check your email address and password.', 'danger')
-    except smtplib.SMTPException as e:
-        flash(f"SMTP error occurred: {str(e)}", 'danger')
-    except Exception as e:
-        flash(f"Unexpected error occurred: {str(e)}", 'danger')
+@main_bp.route('/crm/send-sms', methods=['POST'])
+@login_required
+def send_sms():
+    body = request.form.get('message')
+    template_id = request.form.get('template_id')
+    recipient_ids = request.form.getlist('recipients')
+
+    if not recipient_ids:
+        flash('Please select at least one recipient.', 'warning')
+        return redirect(url_for('main.communications'))
+
+    template = SMSTemplate.query.get(int(template_id)) if template_id and template_id.isdigit() else None
+    template_name = template.template_name if template else 'Custom'
 
+    # Delivery happens in the background SMS dispatcher; progress is shown on the communications page
+    try:
+        job = enqueue_sms_job(current_user.id, body, recipient_ids, template_used=template_name)
+    except SMSError as e:
+        flash(f'{e}. Set TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN and TWILIO_FROM_NUMBER to enable SMS.', 'warning')
+        return redirect(url_for('main.communications'))
+
+    flash(f"SMS queued for {job.total} client(s). Delivery progress is shown under SMS Jobs.", 'success')
     return redirect(url_for('main.communications'))
 
-def substitute_vars(template, client):
-    # Fetch the most recent OutstandingFee entry for the client (if exists)
-    fee = OutstandingFee.query.filter_by(client_id=client.id).order_by(OutstandingFee.due_date.desc()).first()
-
-    # Replace variables with client-specific values
-    vars = {
-        '{client_name}': client.name,
-        '{due_date}': fee.due_date.strftime('%d-%m-%Y') if fee and fee.due_date else '',
-        '{amount}': str(fee.amount) if fee and fee.amount else '',
-        '{status}': fee.status if fee and fee.status else '',
-        '{invoice_number}': fee.invoice_number if fee and fee.invoice_number else ''
-    }
-    for var, value in vars.items():
-        template = template.replace(var, value)
-    return template
+@main_bp.route('/crm/email-jobs/<int:job_id>')
+@login_required
+def email_job_status(job_id):
+    job = EmailJob.query.get_or_404(job_id)
+    return jsonify(email_job_progress(job))
+
+@main_bp.route('/crm/sms-jobs/<int:job_id>')
+@login_required
+def sms_job_status(job_id):
+    job = SMSJob.query.get_or_404(job_id)
+    return jsonify(sms_job_progress(job))
 
 @main_bp.route('/crm/delete_log/<int:id>', methods=['POST'])
 @login_required
@@ -2547,10 +2699,18 @@ def update_auto_reminders():
         db.session.add(setting)
 
     # Update values from checkboxes
-    setting.itr = bool(request.form.get('autoITR'))
-    setting.gst = bool(request.form.get('autoGST'))
-    setting.birthday = bool(request.form.get('autoBirthday'))
-    setting.fees = bool(request.form.get('autoFees'))
+    enabled = {
+        'itr': bool(request.form.get('autoITR')),
+        'gst': bool(request.form.get('autoGST')),
+        'birthday': bool(request.form.get('autoBirthday')),
+        'fees': bool(request.form.get('autoFees')),
+    }
+    # Categories switched back on are rescanned so the scheduler fills in reminders it skipped
+    switched_on = [name for name, on in enabled.items() if on and getattr(setting, name) is False]
+    for name, on in enabled.items():
+        setattr(setting, name, on)
+    if switched_on:
+        reset_source_marks(*switched_on)
 
     db.session.commit()
     flash('Auto reminder settings updated successfully.', 'success')
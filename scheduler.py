@@ -0,0 +1,367 @@
+import heapq
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select, update
+from main_app import db
+from compliance import extend_calendars
+from mailer import dispatcher, enqueue_email_job
+from return_status import mark_overdue
+from models import (AutoReminderSetting, Client, GSTReturn, IncomeTaxReturn, OutstandingFee, Reminder,
+                    ReminderSource, SchedulerState)
+
+logger = logging.getLogger(__name__)
+
+# Scheduler settings; each can be overridden in app.config
+SCHEDULER_DEFAULTS = {
+    'SCHEDULER_SYNC_INTERVAL': 300,    # seconds between checks for new returns, fees, clients and reminders
+    'SCHEDULER_BATCH': 500,            # source rows turned into reminders per query
+    'SCHEDULER_SEND_HOUR': 9,          # local hour at which generated reminders fall due
+    'SCHEDULER_MAX_LATENESS': 86400,   # seconds; older missed reminders are marked sent without notifying
+}
+
+
+class _Rule:
+    """How one AutoReminderSetting category turns source rows into reminders"""
+    model = None
+    setting = None
+    title = None
+    reminder_type = 'Due Date'
+
+    def first_due(self, row, now, send_at):
+        """When the first reminder for `row` should fire, or None for no reminder"""
+        raise NotImplementedError
+
+    def describe(self, row):
+        raise NotImplementedError
+
+    def is_current(self, row):
+        """Whether a reminder for `row` should still go out"""
+        return True
+
+    def next_due(self, row, reminder_date, send_at):
+        """When the following reminder fires, for repeating categories"""
+        return None
+
+
+class _ReturnRule(_Rule):
+    lead_days = 0
+
+    def first_due(self, row, now, send_at):
+        if row.status != 'Pending' or not row.due_date or row.due_date < now.date():
+            return None
+        return max(send_at(row.due_date - timedelta(days=self.lead_days)), now)
+
+    def is_current(self, row):
+        return row.status == 'Pending'
+
+
+class _ITRRule(_ReturnRule):
+    model = IncomeTaxReturn
+    setting = 'itr'
+    title = 'ITR filing due'
+    lead_days = 7
+
+    def describe(self, row):
+        return (f"Dear {{client_name}}, your income tax return for AY {row.assessment_year} is due on "
+                f"{row.due_date:%d-%m-%Y}. Please share any pending documents so we can file on time.")
+
+
+class _GSTRule(_ReturnRule):
+    model = GSTReturn
+    setting = 'gst'
+    title = 'GST return due'
+    lead_days = 3
+
+    def describe(self, row):
+        return (f"Dear {{client_name}}, your {row.return_type or 'GST'} return for {row.month_year} is due on "
+                f"{row.due_date:%d-%m-%Y}. Please send your sales and purchase details.")
+
+
+class _FeeRule(_Rule):
+    model = OutstandingFee
+    setting = 'fees'
+    title = 'Payment reminder'
+    reminder_type = 'Outstanding Fee'
+    interval = timedelta(days=7)
+
+    def first_due(self, row, now, send_at):
+        if not self.is_current(row):
+            return None
+        return max(send_at(row.due_date), now) if row.due_date else now
+
+    def describe(self, row):
+        due = f" was due on {row.due_date:%d-%m-%Y}" if row.due_date else " is pending"
+        return (f"Dear {{client_name}}, payment of ₹{row.amount} for invoice {row.invoice_number or '-'}{due}. "
+                f"Please arrange payment at the earliest.")
+
+    def is_current(self, row):
+        return row.status in ('Pending', 'Overdue')
+
+    def next_due(self, row, reminder_date, send_at):
+        return send_at(reminder_date.date() + self.interval)
+
+
+class _BirthdayRule(_Rule):
+    model = Client
+    setting = 'birthday'
+    title = 'Birthday wishes'
+    reminder_type = 'Birthday'
+
+    @staticmethod
+    def _birthday_in(dob, year):
+        try:
+            return dob.replace(year=year)
+        except ValueError:  # 29 February outside a leap year
+            return dob.replace(year=year, day=28)
+
+    def first_due(self, row, now, send_at):
+        if not self.is_current(row):
+            return None
+        birthday = self._birthday_in(row.date_of_birth, now.year)
+        if birthday < now.date():
+            birthday = self._birthday_in(row.date_of_birth, now.year + 1)
+        return max(send_at(birthday), now)
+
+    def describe(self, row):
+        return "Dear {client_name}, wishing you a very happy birthday and a wonderful year ahead!"
+
+    def is_current(self, row):
+        return row.status == 'Active' and row.date_of_birth is not None
+
+    def next_due(self, row, reminder_date, send_at):
+        return send_at(self._birthday_in(row.date_of_birth, reminder_date.year + 1))
+
+
+RULES = {rule.setting: rule for rule in (_ITRRule(), _GSTRule(), _FeeRule(), _BirthdayRule())}
+
+
+def _mark_name(source):
+    return f'reminders.{source}.last_id'
+
+
+def reset_source_marks(*sources):
+    """Make the scheduler re-read every row of these categories, e.g. after they are switched on.
+
+    Rows that already have a reminder are skipped, so this only fills gaps.
+    """
+    db.session.execute(
+        update(SchedulerState)
+        .where(SchedulerState.name.in_([_mark_name(source) for source in sources]))
+        .values(value=0)
+    )
+
+
+class ReminderScheduler:
+    """Fires reminders at their reminder_date and generates auto reminders as new data arrives.
+
+    Due reminders within the next couple of sync intervals sit in a min-heap
+    keyed on reminder_date, so the loop sleeps until the earliest one (or the
+    next sync) instead of polling. Each sync turns source rows added since the
+    last one into reminders, using per-category id watermarks stored in
+    scheduler_state. Everything else lives in the reminders table, so a
+    restart rebuilds the heap and carries on where it left off. Syncs also
+    extend the compliance calendar to newly added clients and mark tracked
+    returns past their due date as Overdue.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._heap = []
+        self._next_sync = datetime.min
+        self._stop = threading.Event()
+
+    def setting(self, key):
+        return self.app.config.get(key, SCHEDULER_DEFAULTS[key])
+
+    def stop(self):
+        self._stop.set()
+
+    def _send_at(self, day):
+        return datetime.combine(day, time(self.setting('SCHEDULER_SEND_HOUR')))
+
+    def run(self, once=False):
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    now = datetime.now()
+                    if once or now >= self._next_sync:
+                        self.sync(now)
+                    self.fire_due(datetime.now())
+                except Exception:
+                    logger.exception("Reminder scheduler cycle failed")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            if once:
+                return
+            wake = self._next_sync
+            if self._heap and self._heap[0][0] < wake:
+                wake = self._heap[0][0]
+            self._stop.wait(max((wake - datetime.now()).total_seconds(), 0.05))
+
+    # --- Sync -----------------------------------------------------------------
+
+    def sync(self, now):
+        extend_calendars(now.date())
+        if mark_overdue(now.date()):
+            db.session.commit()
+        generated = sum(self._generate(source, now) for source in RULES)
+        interval = timedelta(seconds=self.setting('SCHEDULER_SYNC_INTERVAL'))
+        self._load_heap(now + 2 * interval)
+        self._next_sync = now + interval
+        if generated:
+            logger.info("Generated %d auto reminders", generated)
+
+    def _load_heap(self, horizon):
+        rows = db.session.execute(
+            select(Reminder.reminder_date, Reminder.id)
+            .where(Reminder.notification_sent == False,  # noqa: E712
+                   Reminder.status == 'Active',
+                   Reminder.reminder_date < horizon)
+        ).all()
+        self._heap = [tuple(row) for row in rows]
+        heapq.heapify(self._heap)
+
+    def _owner_settings(self):
+        return {s.user_id: s for s in AutoReminderSetting.query}
+
+    @staticmethod
+    def _enabled(settings, user_id, category):
+        setting = settings.get(user_id)
+        # Users who never saved their settings get the column defaults (all on)
+        return setting is None or getattr(setting, category) is not False
+
+    def _generate(self, source, now):
+        rule = RULES[source]
+        model = rule.model
+        state = db.session.get(SchedulerState, _mark_name(source))
+        if state is None:
+            state = SchedulerState(name=_mark_name(source), value=0)
+            db.session.add(state)
+        settings = self._owner_settings()
+        batch = self.setting('SCHEDULER_BATCH')
+
+        created = 0
+        while True:
+            rows = db.session.scalars(
+                select(model).where(model.id > (state.value or 0)).order_by(model.id).limit(batch)
+            ).all()
+            if not rows:
+                break
+            existing = set(db.session.scalars(
+                select(ReminderSource.source_id)
+                .where(ReminderSource.source == source, ReminderSource.source_id.in_([row.id for row in rows]))
+            ))
+            for row in rows:
+                if row.id in existing or not self._enabled(settings, row.created_by, rule.setting):
+                    continue
+                when = rule.first_due(row, now, self._send_at)
+                if when is not None:
+                    self._add_reminder(rule, source, row, when)
+                    created += 1
+            state.value = rows[-1].id
+            db.session.commit()
+        db.session.commit()
+        return created
+
+    def _add_reminder(self, rule, source, row, when):
+        reminder = Reminder(
+            client_id=row.id if rule.model is Client else row.client_id,
+            fee_id=row.id if rule.model is OutstandingFee else None,
+            title=rule.title,
+            description=rule.describe(row),
+            reminder_date=when,
+            reminder_type=rule.reminder_type,
+            status='Active',
+            auto_created=True,
+            notification_sent=False,
+            created_by=row.created_by,
+        )
+        reminder.source = ReminderSource(source=source, source_id=row.id)
+        db.session.add(reminder)
+        return reminder
+
+    # --- Firing ---------------------------------------------------------------
+
+    def fire_due(self, now):
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due.append(heapq.heappop(self._heap)[1])
+        if not due:
+            return 0
+
+        reminders = Reminder.query.filter(Reminder.id.in_(due)).all()
+        sources = {s.reminder_id: s for s in ReminderSource.query.filter(ReminderSource.reminder_id.in_(due))}
+        source_rows = {}
+        by_source = defaultdict(set)
+        for s in sources.values():
+            by_source[s.source].add(s.source_id)
+        for source, ids in by_source.items():
+            model = RULES[source].model
+            source_rows[source] = {row.id: row for row in model.query.filter(model.id.in_(ids))}
+        settings = self._owner_settings()
+        max_lateness = timedelta(seconds=self.setting('SCHEDULER_MAX_LATENESS'))
+
+        notifications = defaultdict(list)
+        follow_ups = []
+        fired = 0
+        for reminder in reminders:
+            if reminder.status != 'Active' or reminder.notification_sent:
+                continue
+            if reminder.reminder_date > now:
+                # Moved later since the heap was loaded
+                heapq.heappush(self._heap, (reminder.reminder_date, reminder.id))
+                continue
+
+            source = sources.get(reminder.id)
+            row = rule = None
+            if source is not None:
+                rule = RULES[source.source]
+                row = source_rows[source.source].get(source.source_id)
+                if row is None or not rule.is_current(row) \
+                        or not self._enabled(settings, reminder.created_by, rule.setting):
+                    reminder.status = 'Cancelled'
+                    continue
+
+            reminder.notification_sent = True
+            fired += 1
+            if now - reminder.reminder_date > max_lateness:
+                logger.warning("Reminder %d was due at %s; marked sent without notifying",
+                               reminder.id, reminder.reminder_date)
+            elif reminder.auto_created and reminder.client_id:
+                # Reminders with the same text go out to all their clients as one email job
+                notifications[(reminder.created_by, reminder.title, reminder.description)].append(reminder.client_id)
+
+            if rule is not None:
+                following = rule.next_due(row, reminder.reminder_date, self._send_at)
+                if following is not None:
+                    follow_ups.append(self._add_reminder(rule, source.source, row, max(following, now)))
+
+        db.session.flush()
+        for reminder in follow_ups:
+            if reminder.reminder_date < self._next_sync:
+                heapq.heappush(self._heap, (reminder.reminder_date, reminder.id))
+        for (user_id, subject, message), client_ids in notifications.items():
+            enqueue_email_job(user_id, subject, message, client_ids, template_used='Auto Reminder', commit=False)
+        db.session.commit()
+        if notifications:
+            dispatcher.wake()
+        logger.info("Fired %d reminders (%d notification jobs)", fired, len(notifications))
+        return fired
+
+
+@click.command('reminder-scheduler')
+@click.option('--once', is_flag=True, help='Generate and fire whatever is due now, then exit (for cron).')
+@with_appcontext
+def reminder_scheduler_command(once):
+    """Run the reminder scheduler: generate auto reminders and send them when due."""
+    scheduler = ReminderScheduler(current_app._get_current_object())
+    try:
+        scheduler.run(once=once)
+    except KeyboardInterrupt:
+        scheduler.stop()
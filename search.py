@@ -0,0 +1,335 @@
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, request
+from sqlalchemy import and_, func, insert, or_, select, literal_column, table, true
+from sqlalchemy.orm import joinedload
+from main_app import db
+from models import (Client, ClientNote, Document, IncomeTaxReturn, TDSReturn, GSTReturn,
+                    ChallanManagement, ROCForm, SFTReturn)
+
+logger = logging.getLogger(__name__)
+
+# FTS5 external-content indexes: (fts table, source table, indexed columns, bm25 column weights)
+FTS_INDEXES = {
+    'clients': ('clients_fts', 'clients', ('name', 'pan', 'gstin', 'email'), (10.0, 5.0, 5.0, 1.0)),
+    'client_notes': ('client_notes_fts', 'client_notes', ('title', 'content'), (5.0, 1.0)),
+    'documents': ('documents_fts', 'documents', ('title', 'notes'), (5.0, 1.0)),
+}
+
+# Fallback LIKE columns when FTS5 isn't available (e.g. non-SQLite databases)
+_LIKE_COLUMNS = {
+    'clients': (Client.name, Client.pan, Client.gstin, Client.email),
+    'client_notes': (ClientNote.title, ClientNote.content),
+    'documents': (Document.title, Document.notes),
+}
+_MODELS = {'clients': Client, 'client_notes': ClientNote, 'documents': Document}
+
+_state = {'enabled': False}
+
+
+def _create_index(conn, fts, source, columns):
+    cols = ', '.join(columns)
+    new_cols = ', '.join(f'new.{c}' for c in columns)
+    old_cols = ', '.join(f'old.{c}' for c in columns)
+
+    exists = conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts,)
+    ).first()
+
+    conn.exec_driver_sql(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"{cols}, content='{source}', content_rowid='id', "
+        f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+    conn.exec_driver_sql(_insert_trigger_sql(fts, source, columns))
+    conn.exec_driver_sql(
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {source} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_cols}); END"
+    )
+    conn.exec_driver_sql(
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {source} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_cols}); "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_cols}); END"
+    )
+
+    if not exists:
+        # Index rows that existed before the FTS table was created
+        conn.exec_driver_sql(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def _insert_trigger_sql(fts, source, columns):
+    cols = ', '.join(columns)
+    new_cols = ', '.join(f'new.{c}' for c in columns)
+    return (
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {source} BEGIN "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_cols}); END"
+    )
+
+
+def bulk_insert(kind, rows):
+    """Insert many rows into the table behind `kind`, indexing them in one statement.
+
+    The per-row insert trigger costs several times the insert itself, so for a
+    batch it is dropped, the rows are added to the FTS table with a single
+    INSERT ... SELECT, and the trigger is recreated. The first row is inserted
+    normally to take SQLite's write lock, which keeps the DDL inside this
+    transaction and other connections from writing in between. The caller commits.
+    """
+    model = _MODELS[kind]
+    if not fts_enabled() or len(rows) < 2:
+        if rows:
+            db.session.execute(insert(model), rows)
+        return
+    fts, source, columns, _ = FTS_INDEXES[kind]
+    cols = ', '.join(columns)
+    db.session.execute(insert(model), rows[:1])
+    first_id = db.session.scalar(select(func.max(model.id)))
+    conn = db.session.connection()
+    conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {fts}_ai")
+    db.session.execute(insert(model), rows[1:])
+    conn.exec_driver_sql(f"INSERT INTO {fts}(rowid, {cols}) SELECT id, {cols} FROM {source} WHERE id > ?", (first_id,))
+    conn.exec_driver_sql(_insert_trigger_sql(fts, source, columns))
+
+
+def init_search_index(engine):
+    """Create the FTS5 tables and sync triggers; falls back to LIKE search if unsupported"""
+    if engine.dialect.name != 'sqlite':
+        _state['enabled'] = False
+        return False
+    try:
+        with engine.begin() as conn:
+            for fts, source, columns, _ in FTS_INDEXES.values():
+                _create_index(conn, fts, source, columns)
+    except Exception as e:
+        logger.warning("FTS5 search index unavailable, using LIKE search: %s", e)
+        _state['enabled'] = False
+        return False
+    _state['enabled'] = True
+    return True
+
+
+def fts_enabled():
+    return _state['enabled']
+
+
+def build_match_query(search, columns=None):
+    """Turn free text into an FTS5 prefix query: 'ram trad' -> "ram"* "trad"*"""
+    tokens = re.findall(r'\w+', search or '')
+    if not tokens:
+        return None
+    expr = ' '.join(f'"{t}"*' for t in tokens)
+    if columns:
+        expr = '{%s} : (%s)' % (' '.join(columns), expr)
+    return expr
+
+
+def _match_stmt(kind, expr):
+    fts, _, _, weights = FTS_INDEXES[kind]
+    rank = literal_column(f"bm25({fts}, {', '.join(str(w) for w in weights)})")
+    return (
+        select(literal_column('rowid').label('id'))
+        .select_from(table(fts))
+        .where(literal_column(fts).op('MATCH')(expr))
+        .order_by(rank)
+    )
+
+
+def search_filter(kind, search, columns=None):
+    """SQL criterion matching rows of `kind` ('clients', 'client_notes', 'documents')"""
+    model = _MODELS[kind]
+    if fts_enabled():
+        expr = build_match_query(search, columns)
+        if expr is None:
+            return model.id.in_([])
+        return model.id.in_(_match_stmt(kind, expr).order_by(None))
+
+    like_columns = _LIKE_COLUMNS[kind]
+    if columns:
+        like_columns = [getattr(model, c) for c in columns]
+    return or_(*[c.contains(search) for c in like_columns])
+
+
+def ranked_ids(kind, search, limit=None, columns=None):
+    """Matching primary keys, best match first"""
+    if fts_enabled():
+        expr = build_match_query(search, columns)
+        if expr is None:
+            return []
+        stmt = _match_stmt(kind, expr)
+        if limit:
+            stmt = stmt.limit(limit)
+        return list(db.session.execute(stmt).scalars())
+
+    model = _MODELS[kind]
+    stmt = select(model.id).where(search_filter(kind, search, columns))
+    if limit:
+        stmt = stmt.limit(limit)
+    return list(db.session.execute(stmt).scalars())
+
+
+def ranked_search(kind, search, limit=None, columns=None, query=None):
+    """Load matching model instances ordered by relevance"""
+    ids = ranked_ids(kind, search, limit=limit, columns=columns)
+    if not ids:
+        return []
+    model = _MODELS[kind]
+    query = query if query is not None else model.query
+    by_id = {obj.id: obj for obj in query.filter(model.id.in_(ids)).all()}
+    return [by_id[i] for i in ids if i in by_id]
+
+
+def client_filter(search):
+    """Criterion on Client for the list views that search by client name"""
+    return search_filter('clients', search)
+
+
+# --- Global search ------------------------------------------------------------
+
+GLOBAL_SEARCH_LIMIT = 20
+_PER_ENTITY_LIMIT = 8
+_CLIENT_MATCH_LIMIT = 50
+
+_executor = ThreadPoolExecutor(max_workers=6, thread_name_prefix='global-search')
+
+# (type label, model, indexed identifier columns matched by prefix, title, description,
+#  list endpoint, which narrows to the hit with ?id=)
+_RECORD_SEARCHES = (
+    ('Income Tax Return', IncomeTaxReturn, ('acknowledgment_number',),
+     lambda r: f"{r.return_type or 'ITR'} AY {r.assessment_year}",
+     lambda r: r.acknowledgment_number or r.status, 'main.income_tax_returns'),
+    ('TDS Return', TDSReturn, ('tan', 'token_number'),
+     lambda r: f"{r.return_type or 'TDS'} {r.quarter} FY {r.financial_year}",
+     lambda r: f"TAN {r.tan}", 'main.tds_returns'),
+    ('GST Return', GSTReturn, ('gstin', 'arn_number'),
+     lambda r: f"{r.return_type or 'GST'} {r.month_year}",
+     lambda r: r.arn_number or r.gstin, 'main.gst_returns'),
+    ('Challan', ChallanManagement, ('challan_number',),
+     lambda r: f"Challan {r.challan_number}",
+     lambda r: f"{r.tax_type or ''} ₹{r.amount:,.2f}".strip(), 'main.challan_management'),
+    ('ROC Form', ROCForm, ('acknowledgment_number', 'form_type'),
+     lambda r: f"{r.form_type} FY {r.financial_year}",
+     lambda r: r.acknowledgment_number or r.status, 'main.roc_forms'),
+    ('SFT Return', SFTReturn, ('acknowledgment_number',),
+     lambda r: f"{r.form_type or 'SFT'} FY {r.financial_year}",
+     lambda r: r.acknowledgment_number or r.status, 'main.sft_returns'),
+)
+
+
+def _client_scores(q):
+    """Ranked client matches -> {client_id: score}, best match scoring 1.0"""
+    ids = ranked_ids('clients', q, limit=_CLIENT_MATCH_LIMIT)
+    return {cid: 1.0 / (1 + pos) for pos, cid in enumerate(ids)}
+
+
+def _starts_with(col, prefix):
+    """`col` starts with `prefix`, as a range an index on `col` can seek.
+
+    SQLite can't use an index for LIKE 'x%' (its LIKE is case-insensitive),
+    so identifiers, which are stored upper-case, are matched on the range
+    [prefix, prefix with its last character incremented).
+    """
+    return and_(col >= prefix, col < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+
+def _search_records(app, spec, q, client_scores):
+    label, model, ident_cols, title, describe, endpoint = spec
+    upper = q.upper()
+    # One query per criterion rather than OR-ing them, so each seeks its own
+    # index (ix_<table>_<identifier> or ix_<table>_client_id_created_at)
+    criteria = [_starts_with(getattr(model, col), upper) for col in ident_cols]
+    if client_scores:
+        criteria.append(model.client_id.in_(list(client_scores)))
+
+    with app.app_context():
+        matched = {}
+        for criterion in criteria:
+            for record, client_name in db.session.execute(
+                select(model, Client.name)
+                .join(Client, Client.id == model.client_id)
+                .where(criterion)
+                .order_by(model.created_at.desc())
+                .limit(_PER_ENTITY_LIMIT)
+            ):
+                matched[record.id] = (record, client_name)
+        rows = sorted(matched.values(), key=lambda row: (row[0].created_at, row[0].id), reverse=True)
+        rows = rows[:_PER_ENTITY_LIMIT]
+
+        results = []
+        for record, client_name in rows:
+            values = [str(getattr(record, col) or '').upper() for col in ident_cols]
+            if upper in values:
+                score = 1.5
+            elif any(v.startswith(upper) for v in values):
+                score = 1.2
+            else:
+                score = 0.8 * client_scores.get(record.client_id, 0)
+            results.append({
+                'type': label,
+                'title': title(record),
+                'description': f"{client_name} - {describe(record)}",
+                'endpoint': endpoint,
+                'params': {'id': record.id},
+                'score': score,
+            })
+        return results
+
+
+def _search_notes(app, q):
+    with app.app_context():
+        notes = ranked_search('client_notes', q, limit=_PER_ENTITY_LIMIT,
+                              query=ClientNote.query.options(joinedload(ClientNote.client)))
+        return [{
+            'type': 'Note',
+            'title': n.title,
+            'description': f"{n.client.name if n.client else 'General'} - {n.note_type}",
+            'endpoint': 'main.client_notes',
+            'params': {'client_id': n.client_id},
+            'score': 0.9 / (1 + pos),
+        } for pos, n in enumerate(notes)]
+
+
+def hit_filter(model):
+    """Criterion narrowing a list view to the search hit it was opened from (?id=)"""
+    record_id = request.args.get('id', type=int)
+    return model.id == record_id if record_id else true()
+
+
+def global_search(q, limit=GLOBAL_SEARCH_LIMIT):
+    """Search clients, returns, challans, ROC/SFT forms and notes concurrently.
+
+    Returns at most `limit` dicts (type, title, description, endpoint, params, score),
+    best match first. Each entity lookup runs in its own app context/session.
+    """
+    q = (q or '').strip()
+    if len(q) < 2:
+        return []
+
+    app = current_app._get_current_object()
+    client_scores = _client_scores(q)
+
+    futures = [_executor.submit(_search_records, app, spec, q, client_scores) for spec in _RECORD_SEARCHES]
+    futures.append(_executor.submit(_search_notes, app, q))
+
+    top_clients = list(client_scores)[:_PER_ENTITY_LIMIT]
+    results = []
+    if top_clients:
+        rows = db.session.execute(
+            select(Client.id, Client.name, Client.pan, Client.gstin).where(Client.id.in_(top_clients))
+        ).all()
+        for row in rows:
+            results.append({
+                'type': 'Client',
+                'title': row.name,
+                'description': ' | '.join(filter(None, [row.pan and f"PAN: {row.pan}", row.gstin and f"GSTIN: {row.gstin}"])) or 'Client',
+                'endpoint': 'main.edit_client',
+                'params': {'id': row.id},
+                # Clients edge out records that only matched through their client
+                'score': client_scores[row.id] + 0.1,
+            })
+
+    for future in futures:
+        results.extend(future.result())
+
+    results.sort(key=lambda r: r['score'], reverse=True)
+    return results[:limit]
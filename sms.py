@@ -0,0 +1,444 @@
+import asyncio
+import base64
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import insert, select, update
+from main_app import db
+from mailmerge import MailMerge
+from models import Client, CommunicationLog, SMSJob, SMSJobRecipient
+
+logger = logging.getLogger(__name__)
+
+# Sender settings; each can be overridden in app.config
+SMS_DEFAULTS = {
+    'SMS_CONCURRENCY': 10,          # requests in flight to the provider at once
+    'SMS_RATE_LIMIT': 10,           # messages started per second; 0 disables throttling
+    'SMS_MAX_ATTEMPTS': 3,          # tries per message for throttling (429), 5xx and network errors
+    'SMS_RETRY_DELAY': 1.0,         # seconds before the first retry; doubles on each further attempt
+    'SMS_TIMEOUT': 15,              # seconds per provider request
+    'SMS_CLAIM_BATCH': 100,         # recipients picked up, sent and then logged in one commit
+    'SMS_POLL_INTERVAL': 5.0,       # seconds between queue checks when idle
+    'SMS_CLAIM_TIMEOUT': 600,       # seconds after which a 'Sending' row from a dead process is requeued
+    'SMS_DEFAULT_COUNTRY_CODE': '+91',
+    'SMS_DISPATCHER_AUTOSTART': True,  # start on the first request a process serves
+}
+
+# Twilio credentials come from app.config or the environment, like SESSION_SECRET and DATABASE_URL
+TWILIO_SETTINGS = ('TWILIO_ACCOUNT_SID', 'TWILIO_AUTH_TOKEN', 'TWILIO_FROM_NUMBER', 'TWILIO_API_BASE')
+TWILIO_API_BASE = 'https://api.twilio.com'
+
+
+class SMSError(Exception):
+    """A failed send; `retryable` is set for throttling, server errors and network failures"""
+
+    def __init__(self, message, retryable=False, status=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.status = status
+
+
+class TwilioTransport:
+    """Sends through Twilio's Messages REST resource.
+
+    `base_url` can point at the fake server in fake_twilio.py to exercise the
+    whole pipeline offline. Requests are plain HTTPS calls made on worker
+    threads, so the asyncio sender can keep many of them in flight.
+    """
+
+    def __init__(self, account_sid, auth_token, from_number, base_url=TWILIO_API_BASE, timeout=15):
+        self.from_number = from_number
+        self.timeout = timeout
+        self.url = f"{base_url.rstrip('/')}/2010-04-01/Accounts/{account_sid}/Messages.json"
+        credentials = base64.b64encode(f"{account_sid}:{auth_token}".encode()).decode()
+        self._authorization = f"Basic {credentials}"
+
+    def _post(self, to, body):
+        data = urllib.parse.urlencode({'To': to, 'From': self.from_number, 'Body': body}).encode()
+        req = urllib.request.Request(self.url, data=data, method='POST',
+                                     headers={'Authorization': self._authorization})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                return json.load(response)
+        except urllib.error.HTTPError as e:
+            try:
+                detail = json.load(e).get('message') or e.reason
+            except ValueError:
+                detail = e.reason
+            raise SMSError(f"{e.code}: {detail}", retryable=e.code == 429 or e.code >= 500, status=e.code)
+        except (urllib.error.URLError, OSError) as e:
+            raise SMSError(str(getattr(e, 'reason', e)), retryable=True)
+
+    async def send(self, to, body):
+        """Send one message and return the provider's message SID"""
+        result = await asyncio.to_thread(self._post, to, body)
+        return result.get('sid')
+
+
+def twilio_settings(config):
+    values = {key: config.get(key) or os.environ.get(key) for key in TWILIO_SETTINGS}
+    values['TWILIO_API_BASE'] = values['TWILIO_API_BASE'] or TWILIO_API_BASE
+    return values
+
+
+def twilio_status(config):
+    settings = twilio_settings(config)
+    configured = all(settings[key] for key in ('TWILIO_ACCOUNT_SID', 'TWILIO_AUTH_TOKEN', 'TWILIO_FROM_NUMBER'))
+    return 'Configured' if configured else 'NotConfigured'
+
+
+def get_transport(app):
+    """The configured transport: app.config['SMS_TRANSPORT'] if set, else Twilio"""
+    transport = app.config.get('SMS_TRANSPORT')
+    if transport is not None:
+        return transport
+    if twilio_status(app.config) != 'Configured':
+        return None
+    settings = twilio_settings(app.config)
+    return TwilioTransport(settings['TWILIO_ACCOUNT_SID'], settings['TWILIO_AUTH_TOKEN'],
+                           settings['TWILIO_FROM_NUMBER'], settings['TWILIO_API_BASE'],
+                           timeout=app.config.get('SMS_TIMEOUT', SMS_DEFAULTS['SMS_TIMEOUT']))
+
+
+def normalize_phone(phone, default_country_code='+91'):
+    """E.164 form of a stored phone number, or None if it can't be one"""
+    if not phone:
+        return None
+    digits = ''.join(ch for ch in phone if ch.isdigit())
+    if phone.strip().startswith('+'):
+        number = '+' + digits
+    elif phone.strip().startswith('00'):
+        number = '+' + digits[2:]
+    else:
+        number = default_country_code + digits.lstrip('0')
+    return number if 8 <= len(number) <= 16 else None
+
+
+class SMSSender:
+    """Send many messages concurrently with a cap on in-flight requests and start rate"""
+
+    def __init__(self, transport, concurrency=10, rate_limit=10, max_attempts=3, retry_delay=1.0):
+        self.transport = transport
+        self.concurrency = concurrency
+        self.rate_limit = rate_limit
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+    async def _throttle(self):
+        if not self.rate_limit:
+            return
+        async with self._rate_lock:
+            now = time.monotonic()
+            wait = self._next_start - now
+            self._next_start = max(now, self._next_start) + 1 / self.rate_limit
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def _send_one(self, key, to, body, on_result):
+        error = None
+        for attempt in range(1, self.max_attempts + 1):
+            async with self._slots:
+                await self._throttle()
+                try:
+                    sid = await self.transport.send(to, body)
+                except SMSError as e:
+                    error = e
+                except Exception as e:
+                    logger.exception("Unexpected error sending SMS to %s", to)
+                    error = SMSError(str(e) or type(e).__name__)
+                else:
+                    on_result(key, sid, None, attempt)
+                    return
+            if not error.retryable or attempt == self.max_attempts:
+                break
+            await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+        on_result(key, None, str(error), attempt)
+
+    async def send_all(self, messages, on_result):
+        """Send (key, to, body) messages; on_result(key, sid, error, attempts) is called as each finishes"""
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._rate_lock = asyncio.Lock()
+        self._next_start = time.monotonic()
+        # Blocking transports run on this loop's executor; give it a thread per slot
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(self.concurrency))
+        await asyncio.gather(*(self._send_one(key, to, body, on_result) for key, to, body in messages))
+
+
+class SMSDispatcher:
+    """Background sender for SMSJob rows.
+
+    Like the email dispatcher, the queue lives in the database: a
+    coordinator thread claims a batch of pending recipients, renders their
+    messages, sends the batch through SMSSender's asyncio loop and, once the
+    whole batch is back, writes the outcomes (CommunicationLog rows,
+    recipient status, job counters) in one commit. Jobs survive restarts;
+    recipients left 'Sending' by a dead process are requeued after
+    SMS_CLAIM_TIMEOUT.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._wake = threading.Event()
+        self._started = False
+        self._start_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['sms_dispatcher'] = self
+        # Started by the first request a process serves, as the email dispatcher is
+        app.before_request(self._start_on_request)
+
+    def setting(self, key):
+        return self.app.config.get(key, SMS_DEFAULTS[key])
+
+    def _start_on_request(self):
+        # The setting is read per request, so it can still be switched off after init_app (tests)
+        if not self._started and self.setting('SMS_DISPATCHER_AUTOSTART'):
+            self.start()
+
+    def start(self):
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._coordinate, name='sms-dispatcher', daemon=True).start()
+
+    def wake(self):
+        """Pick up newly queued work now instead of at the next poll"""
+        self._wake.set()
+
+    def _coordinate(self):
+        with self.app.app_context():
+            self._requeue_stale()
+        while True:
+            try:
+                with self.app.app_context():
+                    if not self.send_batch():
+                        if not self._wake.wait(self.setting('SMS_POLL_INTERVAL')):
+                            self._requeue_stale()
+                        self._wake.clear()
+            except Exception:
+                logger.exception("SMS dispatcher cycle failed")
+                db.session.rollback()
+                time.sleep(self.setting('SMS_POLL_INTERVAL'))
+
+    def _requeue_stale(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=self.setting('SMS_CLAIM_TIMEOUT'))
+        result = db.session.execute(
+            update(SMSJobRecipient)
+            .where(SMSJobRecipient.status == 'Sending', SMSJobRecipient.claimed_at < cutoff)
+            .values(status='Pending', claim_token=None)
+        )
+        db.session.commit()
+        if result.rowcount:
+            logger.warning("Requeued %d SMS recipients abandoned mid-send", result.rowcount)
+
+    def _claim(self):
+        active_jobs = select(SMSJob.id).where(SMSJob.status.in_(('Queued', 'Running')))
+        ids = db.session.scalars(
+            select(SMSJobRecipient.id)
+            .where(SMSJobRecipient.status == 'Pending', SMSJobRecipient.job_id.in_(active_jobs))
+            .order_by(SMSJobRecipient.job_id, SMSJobRecipient.id)
+            .limit(self.setting('SMS_CLAIM_BATCH'))
+        ).all()
+        if not ids:
+            return []
+
+        # The status guard makes the claim safe against other processes polling the same table
+        now = datetime.utcnow()
+        token = uuid.uuid4().hex
+        db.session.execute(
+            update(SMSJobRecipient)
+            .where(SMSJobRecipient.id.in_(ids), SMSJobRecipient.status == 'Pending')
+            .values(status='Sending', claim_token=token, claimed_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        rows = db.session.execute(
+            select(SMSJobRecipient.id, SMSJobRecipient.job_id, SMSJobRecipient.client_id, SMSJobRecipient.phone)
+            .where(SMSJobRecipient.claim_token == token)
+            .order_by(SMSJobRecipient.job_id, SMSJobRecipient.id)
+        ).all()
+        db.session.execute(
+            update(SMSJob)
+            .where(SMSJob.id.in_({row.job_id for row in rows}), SMSJob.status == 'Queued')
+            .values(status='Running', started_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return rows
+
+    def send_batch(self):
+        """Claim, send and record one batch; returns the number of recipients claimed"""
+        rows = self._claim()
+        if not rows:
+            return 0
+        jobs = {job.id: job for job in SMSJob.query.filter(SMSJob.id.in_({row.job_id for row in rows}))}
+
+        transport = get_transport(self.app)
+        if transport is None:
+            self._fail_jobs(jobs, 'SMS is not configured')
+            return len(rows)
+
+        # Only the columns the merge variables read, not whole Client objects
+        clients = {c.id: c for c in db.session.execute(
+            select(Client.id, Client.name, Client.pan, Client.gstin, Client.email, Client.phone)
+            .where(Client.id.in_({row.client_id for row in rows}))
+        )}
+        messages = []
+        for job_id, job in jobs.items():
+            job_rows = [row for row in rows if row.job_id == job_id]
+            rendered = {client.id: body for client, body
+                        in MailMerge(job.message).render([clients[r.client_id] for r in job_rows if r.client_id in clients])}
+            messages.extend((row, row.phone, rendered.get(row.client_id, job.message)) for row in job_rows)
+        # Release the connection while the batch is out at the provider
+        db.session.commit()
+
+        results = []
+        sender = SMSSender(
+            transport,
+            concurrency=self.setting('SMS_CONCURRENCY'),
+            rate_limit=self.setting('SMS_RATE_LIMIT'),
+            max_attempts=self.setting('SMS_MAX_ATTEMPTS'),
+            retry_delay=self.setting('SMS_RETRY_DELAY'),
+        )
+        # The loop only sends; the outcomes are written below, after the gather
+        asyncio.run(sender.send_all(messages, lambda *result: results.append(result)))
+        bodies = {row.id: body for row, _, body in messages}
+        self._record(jobs, clients, bodies, results)
+        return len(rows)
+
+    def _record(self, jobs, clients, bodies, results):
+        now = datetime.utcnow()
+        logs, recipient_updates = [], []
+        sent, failed = Counter(), Counter()
+        for row, sid, error, attempts in results:
+            job = jobs[row.job_id]
+            client = clients.get(row.client_id)
+            if error:
+                logger.warning("SMS to client %s failed after %d attempt(s): %s", row.client_id, attempts, error)
+                failed[row.job_id] += 1
+            else:
+                sent[row.job_id] += 1
+            recipient_updates.append({
+                'id': row.id, 'status': 'Failed' if error else 'Sent', 'attempts': attempts,
+                'message_sid': sid, 'last_error': error[:500] if error else None,
+                'sent_at': None if error else now, 'claim_token': None,
+            })
+            logs.append({
+                'client_id': row.client_id,
+                'communication_type': 'SMS',
+                'subject': None,
+                'message': bodies[row.id],
+                'recipient': client.name if client else '',
+                'status': 'Failed' if error else 'Sent',
+                'sent_at': now,
+                'template_used': job.template_used or 'Custom',
+                'created_by': job.created_by,
+            })
+
+        if logs:
+            db.session.execute(insert(CommunicationLog), logs)
+        if recipient_updates:
+            db.session.execute(update(SMSJobRecipient), recipient_updates)
+        for job_id, job in jobs.items():
+            job.sent = (job.sent or 0) + sent[job_id]
+            job.failed = (job.failed or 0) + failed[job_id]
+            self._finish_if_done(job, now)
+        db.session.commit()
+
+    def _fail_jobs(self, jobs, error):
+        now = datetime.utcnow()
+        for job_id, job in jobs.items():
+            result = db.session.execute(
+                update(SMSJobRecipient)
+                .where(SMSJobRecipient.job_id == job_id, SMSJobRecipient.status.in_(('Pending', 'Sending')))
+                .values(status='Failed', last_error=error, claim_token=None)
+                .execution_options(synchronize_session=False)
+            )
+            job.failed = (job.failed or 0) + result.rowcount
+            job.status = 'Failed'
+            job.last_error = error
+            job.finished_at = now
+        db.session.commit()
+
+    @staticmethod
+    def _finish_if_done(job, now):
+        if job.status == 'Running' and not db.session.scalar(
+            select(SMSJobRecipient.id)
+            .where(SMSJobRecipient.job_id == job.id, SMSJobRecipient.status.in_(('Pending', 'Sending')))
+            .limit(1)
+        ):
+            job.status = 'Completed'
+            job.finished_at = now
+
+
+dispatcher = SMSDispatcher()
+
+
+def enqueue_sms_job(user_id, message, recipient_ids, template_used=None):
+    """Queue a bulk SMS and return the SMSJob.
+
+    `recipient_ids` is a list of client ids, or contains 'all' for every
+    active client. Clients without a usable phone number are recorded as
+    failed recipients straight away.
+    """
+    if get_transport(current_app) is None:
+        raise SMSError('SMS is not configured')
+
+    stmt = select(Client.id, Client.phone)
+    if 'all' in recipient_ids:
+        stmt = stmt.where(Client.status == 'Active')
+    else:
+        stmt = stmt.where(Client.id.in_([int(i) for i in recipient_ids]))
+    recipients = db.session.execute(stmt.order_by(Client.id)).all()
+
+    job = SMSJob(message=message, template_used=template_used, status='Queued', total=len(recipients),
+                 sent=0, failed=0, created_by=user_id)
+    db.session.add(job)
+    db.session.flush()
+
+    country_code = current_app.config.get('SMS_DEFAULT_COUNTRY_CODE', SMS_DEFAULTS['SMS_DEFAULT_COUNTRY_CODE'])
+    rows = []
+    for client_id, phone in recipients:
+        row = {'job_id': job.id, 'client_id': client_id, 'phone': normalize_phone(phone, country_code),
+               'status': 'Pending', 'attempts': 0}
+        if not row['phone']:
+            row.update(status='Failed', last_error='Client has no usable phone number')
+            job.failed += 1
+        rows.append(row)
+    if rows:
+        db.session.execute(insert(SMSJobRecipient), rows)
+    if job.failed == job.total:
+        job.status = 'Completed'
+        job.finished_at = datetime.utcnow()
+    db.session.commit()
+    dispatcher.wake()
+    return job
+
+
+def sms_job_progress(job):
+    done = (job.sent or 0) + (job.failed or 0)
+    return {
+        'id': job.id,
+        'status': job.status,
+        'total': job.total,
+        'sent': job.sent,
+        'failed': job.failed,
+        'pending': max(job.total - done, 0),
+        'percent': round(100 * done / job.total) if job.total else 100,
+        'last_error': job.last_error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
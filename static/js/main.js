@@ -17,6 +17,7 @@ $(document).ready(function() {
     
     // Initialize search functionality
     initializeSearch();
+    initializeClientTypeahead();
 });
 
 /**
@@ -106,8 +107,58 @@ function initializeSearch() {
             searchTimeout = setTimeout(() => {
                 performGlobalSearch(query);
             }, 300);
+        } else {
+            $('#searchResults').empty().hide();
         }
     });
+
+    // Hide results when clicking outside
+    $(document).on('click', function(e) {
+        if (!$(e.target).closest('#globalSearch, #searchResults').length) {
+            $('#searchResults').hide();
+        }
+    });
+}
+
+/**
+ * Turn large client pickers (select[data-typeahead-url]) into AJAX typeaheads
+ */
+function initializeClientTypeahead() {
+    $('select[data-typeahead-url]').each(function() {
+        const select = this;
+        const $select = $(select);
+        const $input = $('<input type="search" class="form-control form-control-sm mb-1" placeholder="Type to search clients..." autocomplete="off">');
+        let typeaheadTimeout;
+
+        $select.before($input);
+        $input.on('input', function() {
+            clearTimeout(typeaheadTimeout);
+            const query = $(this).val();
+            if (query.length < 2) {
+                return;
+            }
+            typeaheadTimeout = setTimeout(() => {
+                const url = new URL($select.data('typeahead-url'), window.location.origin);
+                url.searchParams.set('q', query);
+                fetch(url)
+                    .then(response => response.json())
+                    .then(clients => {
+                        // Keep the placeholder and current selection, replace the rest
+                        $select.find('option').not('[value="0"]').not(':selected').remove();
+                        clients.forEach(client => {
+                            if (!$select.find(`option[value="${client.id}"]`).length) {
+                                $select.append($('<option>').val(client.id).text(client.text));
+                            }
+                        });
+                        select.size = Math.min(Math.max(select.options.length, 2), 8);
+                    })
+                    .catch(error => console.error('Client lookup error:', error));
+            }, 250);
+        });
+        $select.on('change blur', function() {
+            select.size = 1;
+        });
+    });
 }
 
 /**
@@ -132,22 +183,25 @@ function displaySearchResults(results) {
     $resultsContainer.empty();
     
     if (results.length === 0) {
-        $resultsContainer.html('<p class="text-muted">No results found</p>');
+        $resultsContainer.html('<p class="text-muted p-2 mb-0">No results found</p>').show();
         return;
     }
     
     results.forEach(result => {
         const $item = $(`
             <div class="search-result-item p-2 border-bottom">
-                <strong>${result.title}</strong>
-                <br><small class="text-muted">${result.type} - ${result.description}</small>
+                <strong></strong>
+                <br><small class="text-muted"></small>
             </div>
         `);
+        $item.find('strong').text(result.title);
+        $item.find('small').text(`${result.type} - ${result.description}`);
         $item.on('click', () => {
             window.location.href = result.url;
         });
         $resultsContainer.append($item);
     });
+    $resultsContainer.show();
 }
 
 /**
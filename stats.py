@@ -0,0 +1,232 @@
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date
+from flask import current_app
+from sqlalchemy import event, func, select, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session
+from main_app import db
+from database import upsert
+from models import Client, IncomeTaxReturn, TDSReturn, GSTReturn, OutstandingFee, Reminder, SchedulerState
+
+logger = logging.getLogger(__name__)
+
+# Any insert/update/delete on these tables makes the matching dashboard topic stale
+TOPIC_MODELS = {
+    'stats': (Client, IncomeTaxReturn, TDSReturn, GSTReturn, OutstandingFee),
+    'reminders': (Reminder, Client),
+    'clients': (Client,),
+}
+WATCHED_MODELS = TOPIC_MODELS['stats']
+
+DEFAULT_TTL = 60  # seconds; safety net for raw SQL writes that bypass the session hooks
+DEFAULT_SHARED_POLL = 0.5  # seconds between checks for commits made by other processes
+# Open dashboard streams per process, each holding a worker thread; keep it below
+# gunicorn's --threads (see .replit) so pages still get served
+DEFAULT_STREAM_LIMIT = 8
+
+_lock = threading.Lock()
+_changed = threading.Condition(_lock)
+_cache = {'stats': None, 'loaded_at': 0.0}
+_versions = {topic: 0 for topic in TOPIC_MODELS}
+_shared = {'versions': None, 'polled_at': 0.0}
+_streams = {'open': 0}
+
+
+def _count(model, *criteria):
+    return select(func.count(model.id)).where(*criteria).scalar_subquery()
+
+
+def _query_stats():
+    """Compute every dashboard figure in a single SELECT"""
+    stmt = select(
+        _count(Client).label('total_clients'),
+        _count(IncomeTaxReturn, IncomeTaxReturn.status == 'Pending').label('pending_itr'),
+        _count(TDSReturn, TDSReturn.status == 'Pending').label('pending_tds'),
+        _count(GSTReturn, GSTReturn.status == 'Pending').label('pending_gst'),
+        select(func.coalesce(func.sum(OutstandingFee.amount), 0))
+            .where(OutstandingFee.status == 'Pending')
+            .scalar_subquery().label('total_outstanding'),
+    )
+    row = db.session.execute(stmt).one()
+    return dict(row._mapping)
+
+
+def get_dashboard_stats():
+    """Return cached dashboard statistics, recomputing them only when stale"""
+    sync_shared_versions()
+    ttl = current_app.config.get('DASHBOARD_STATS_TTL', DEFAULT_TTL)
+    with _lock:
+        stats = _cache['stats']
+        version = _versions['stats']
+        if stats is not None and time.monotonic() - _cache['loaded_at'] < ttl:
+            return dict(stats)
+
+    stats = _query_stats()
+
+    with _lock:
+        # Don't store a result that raced with an invalidation
+        if _versions['stats'] == version:
+            _cache['stats'] = stats
+            _cache['loaded_at'] = time.monotonic()
+    return dict(stats)
+
+
+def get_upcoming_reminders(limit=5):
+    """Active reminders from today onwards, soonest first"""
+    return Reminder.query.filter(
+        Reminder.reminder_date >= date.today(),
+        Reminder.status == 'Active'
+    ).order_by(Reminder.reminder_date).limit(limit).all()
+
+
+def stats_version():
+    """Monotonic counter bumped on every stats invalidation"""
+    return _versions['stats']
+
+
+def topic_versions():
+    with _lock:
+        return dict(_versions)
+
+
+def wait_for_change(seen, timeout):
+    """Block until any topic version differs from `seen` or the timeout expires.
+
+    Returns the current versions; idle callers sleep on a condition variable
+    instead of polling the database.
+    """
+    with _changed:
+        _changed.wait_for(lambda: _versions != seen, timeout=timeout)
+        return dict(_versions)
+
+
+def invalidate(*topics):
+    """Mark topics as changed and wake any waiting stream"""
+    topics = topics or tuple(TOPIC_MODELS)
+    with _changed:
+        for topic in topics:
+            _versions[topic] += 1
+        if 'stats' in topics:
+            _cache['stats'] = None
+        _changed.notify_all()
+
+
+def invalidate_dashboard_stats():
+    """Drop the cached statistics; call after bulk writes that bypass the ORM session"""
+    invalidate('stats')
+
+
+# --- Cross-process versions ---------------------------------------------------
+#
+# The versions above only see commits made in this process. Each commit that
+# touches a topic also bumps a dashboard.<topic> counter row in
+# scheduler_state, and every process polls those rows, at most once per
+# DASHBOARD_SHARED_POLL seconds, to pick up the other workers' writes.
+
+def _shared_name(topic):
+    return f'dashboard.{topic}'
+
+
+def _publish(engine, topics):
+    """Bump the shared counters of `topics` in a short transaction of their own"""
+    rows = [{'name': _shared_name(topic), 'value': 1} for topic in sorted(topics)]
+    stmt = upsert(SchedulerState, engine.dialect.name, ['name'], increment_columns=['value'])
+    try:
+        with engine.begin() as conn:
+            if stmt is not None:
+                conn.execute(stmt, rows)
+                return
+            for row in rows:
+                bumped = conn.execute(
+                    update(SchedulerState).where(SchedulerState.name == row['name'])
+                    .values(value=SchedulerState.value + 1)
+                ).rowcount
+                if not bumped:
+                    conn.execute(SchedulerState.__table__.insert().values(**row))
+    except (IntegrityError, OperationalError) as e:
+        # The change itself is committed; other processes catch up after DASHBOARD_STATS_TTL
+        logger.warning("Could not publish dashboard change for %s: %s", ', '.join(sorted(topics)), e)
+
+
+def sync_shared_versions():
+    """Invalidate topics another process has changed since the last poll.
+
+    Runs one query per poll interval per process, however many requests and
+    streams call it. Local invalidation drops the cached stats and wakes this
+    process's streams.
+    """
+    interval = current_app.config.get('DASHBOARD_SHARED_POLL', DEFAULT_SHARED_POLL)
+    with _lock:
+        if time.monotonic() - _shared['polled_at'] < interval:
+            return
+        _shared['polled_at'] = time.monotonic()
+    rows = db.session.execute(
+        select(SchedulerState.name, SchedulerState.value)
+        .where(SchedulerState.name.in_([_shared_name(topic) for topic in TOPIC_MODELS]))
+    ).all()
+    current = {topic: None for topic in TOPIC_MODELS}
+    current.update({name.split('.', 1)[1]: value for name, value in rows})
+    with _lock:
+        previous, _shared['versions'] = _shared['versions'], current
+    if previous is not None:
+        changed = [topic for topic in TOPIC_MODELS if current[topic] != previous[topic]]
+        if changed:
+            invalidate(*changed)
+
+
+@contextmanager
+def stream_slot():
+    """Yield True if this process has room for another dashboard stream (DASHBOARD_STREAM_LIMIT)"""
+    limit = current_app.config.get('DASHBOARD_STREAM_LIMIT', DEFAULT_STREAM_LIMIT)
+    with _lock:
+        acquired = _streams['open'] < limit
+        if acquired:
+            _streams['open'] += 1
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            with _lock:
+                _streams['open'] -= 1
+
+
+# --- Invalidation hooks -------------------------------------------------------
+
+_DIRTY_KEY = 'dashboard_dirty_topics'
+
+
+def _topics_for(cls):
+    return {topic for topic, models in TOPIC_MODELS.items() if issubclass(cls, models)}
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_flushed_changes(session, flush_context):
+    dirty = session.info.setdefault(_DIRTY_KEY, set())
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        dirty |= _topics_for(type(obj))
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _track_bulk_changes(orm_execute_state):
+    # query.update() / query.delete() don't go through the flush
+    if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None:
+            orm_execute_state.session.info.setdefault(_DIRTY_KEY, set()).update(_topics_for(mapper.class_))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_on_commit(session):
+    topics = session.info.pop(_DIRTY_KEY, None)
+    if topics:
+        invalidate(*topics)
+        _publish(session.get_bind(), topics)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_on_rollback(session, previous_transaction):
+    session.info.pop(_DIRTY_KEY, None)
@@ -0,0 +1,71 @@
+"""Shared fixtures for tests that need the Flask app.
+
+main_app binds its database when it is imported, so the whole session runs
+against one database: a scratch SQLite file by default, or TEST_DATABASE_URL
+(e.g. a throwaway PostgreSQL database) when it is set. Run the suite once per
+backend. Every table except users and roles is emptied before each test.
+"""
+import os
+import re
+import shutil
+import tempfile
+import pytest
+
+_DATA_DIR = tempfile.mkdtemp(prefix='aiditor-tests-')
+
+# Set before main_app is imported; test modules then import models and the app modules freely
+os.environ['DATABASE_URL'] = os.environ.get('TEST_DATABASE_URL') or f"sqlite:///{os.path.join(_DATA_DIR, 'test.db')}"
+
+import main_app  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    app = main_app.app
+    app.config.update(
+        TESTING=True,
+        # Tests drive the background workers directly
+        EMAIL_DISPATCHER_AUTOSTART=False,
+        SMS_DISPATCHER_AUTOSTART=False,
+        XBRL_VALIDATOR_AUTOSTART=False,
+    )
+    yield app
+    shutil.rmtree(_DATA_DIR, ignore_errors=True)
+
+
+@pytest.fixture(autouse=True)
+def _empty_tables(request):
+    if 'app' not in request.fixturenames:
+        yield
+        return
+    app = request.getfixturevalue('app')
+    db = main_app.db
+    with app.app_context():
+        for table in reversed(db.metadata.sorted_tables):
+            if table.name not in ('users', 'roles'):
+                db.session.execute(table.delete())
+        db.session.commit()
+    with app.app_context():
+        yield
+        db.session.rollback()
+
+
+@pytest.fixture
+def db(app):
+    return main_app.db
+
+
+@pytest.fixture
+def admin(app, db):
+    from models import User
+    return User.query.filter_by(username='admin').one()
+
+
+@pytest.fixture
+def client(app, admin):
+    client = app.test_client()
+    page = client.get('/auth/login').get_data(as_text=True)
+    token = re.search(r'name="csrf_token"[^>]*value="([^"]+)"', page).group(1)
+    response = client.post('/auth/login', data={'username': 'admin', 'password': 'admin123', 'csrf_token': token})
+    assert response.status_code == 302
+    return client
@@ -0,0 +1,112 @@
+"""Blob store reference counting and garbage collection"""
+import io
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+import pytest
+import blobstore
+from blobstore import collect_garbage, recount_references, release, store
+from models import Blob, Document
+
+
+@pytest.fixture
+def uploads(app, monkeypatch, tmp_path):
+    monkeypatch.setattr(app, 'root_path', str(tmp_path))
+    return tmp_path
+
+
+def _store(content, extension='.pdf'):
+    path, _ = store(io.BytesIO(content), extension)
+    return path
+
+
+def _blob(db):
+    db.session.expire_all()
+    return Blob.query.one()
+
+
+def _release_long_ago(db, path):
+    release(path)
+    db.session.query(Blob).update({'released_at': datetime.utcnow() - timedelta(hours=2)})
+    db.session.commit()
+
+
+def test_identical_uploads_share_one_file(db, uploads):
+    first = _store(b'%PDF-1.4 balance sheet')
+    second = _store(b'%PDF-1.4 balance sheet', '.PDF')
+    db.session.commit()
+
+    assert first == second and (uploads / first).is_file()
+    assert _blob(db).ref_count == 2
+    assert os.listdir(uploads / 'uploads' / 'blobs' / 'tmp') == []
+
+
+def test_released_blob_is_collected_after_grace(db, uploads):
+    path = _store(b'%PDF-1.4 balance sheet')
+    _store(b'%PDF-1.4 balance sheet')
+    db.session.commit()
+
+    release(path)
+    db.session.commit()
+    assert _blob(db).released_at is None
+    release(path)
+    db.session.commit()
+    assert _blob(db).ref_count == 0 and _blob(db).released_at is not None
+    assert collect_garbage()['blobs'] == 0
+
+    _release_long_ago(db, path)
+    stats = collect_garbage()
+    assert (stats['blobs'], stats['bytes']) == (1, len(b'%PDF-1.4 balance sheet'))
+    assert not (uploads / path).exists()
+    assert Blob.query.count() == 0
+
+
+def test_recount_and_stray_files(db, uploads, admin):
+    path = _store(b'PAN card scan', '.png')
+    db.session.add(Document(title='PAN card', document_type='PAN', file_path=path, uploaded_by=admin.id))
+    db.session.commit()
+    db.session.query(Blob).update({'ref_count': 5})
+    db.session.commit()
+    assert recount_references() == 1
+    assert _blob(db).ref_count == 1
+
+    # A file left behind by a rolled-back upload
+    stray = uploads / blobstore.blob_path('0' * 64, '.pdf')
+    stray.parent.mkdir(parents=True, exist_ok=True)
+    stray.write_bytes(b'orphan')
+    assert collect_garbage()['strays'] == 0
+    os.utime(stray, (time.time() - 7200,) * 2)
+    assert collect_garbage()['strays'] == 1
+    assert not stray.exists() and (uploads / path).is_file()
+
+
+def test_store_during_collection_keeps_its_file(app, db, uploads, monkeypatch):
+    content = b'%PDF-1.4 balance sheet'
+    path = _store(content)
+    db.session.commit()
+    _release_long_ago(db, path)
+
+    stored = {}
+
+    def upload_again():
+        with app.app_context():
+            stored['path'] = _store(content)
+            blobstore.db.session.commit()
+
+    unlink = os.unlink
+
+    def racing_unlink(name):
+        # The same content is uploaded while the collector is removing the file
+        if name.endswith(path):
+            uploader.start()
+            time.sleep(0.3)
+        unlink(name)
+
+    uploader = threading.Thread(target=upload_again)
+    monkeypatch.setattr(blobstore.os, 'unlink', racing_unlink)
+    assert collect_garbage()['blobs'] == 1
+    uploader.join(10)
+
+    assert stored['path'] == path and (uploads / path).read_bytes() == content
+    assert _blob(db).ref_count == 1
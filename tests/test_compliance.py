@@ -0,0 +1,57 @@
+"""Compliance calendar generation as clients and TDS returns are added"""
+import io
+import re
+from datetime import date
+import pytest
+from client_import import import_clients
+from compliance import active_financial_years, extend_calendars
+from models import Client, ComplianceCalendar, TDSReturn
+
+
+def _forms(client_id):
+    return {form for form, in ComplianceCalendar.query.with_entities(ComplianceCalendar.form)
+            .filter_by(client_id=client_id)}
+
+
+@pytest.fixture
+def company(db, admin):
+    company = Client(name='Sita Traders Pvt Ltd', client_type='Company', status='Active', created_by=admin.id)
+    db.session.add(company)
+    db.session.commit()
+    return company
+
+
+def test_extend_calendars_covers_new_clients_once(db, company):
+    assert extend_calendars() > 0
+    assert 'AOC-4' in _forms(company.id)
+    assert {fy for fy, in db.session.query(ComplianceCalendar.financial_year).distinct()} \
+        == set(active_financial_years())
+    assert extend_calendars() == 0
+
+
+def test_import_generates_calendars(db, admin):
+    extend_calendars()
+    csv = b"name,pan,client type\nRam Traders,ABCDE1234F,Individual\n"
+    result = import_clients(io.BytesIO(csv), 'clients.csv', admin.id)
+    assert result.imported == 1
+    imported = Client.query.filter_by(pan='ABCDE1234F').one()
+    assert 'ITR' in _forms(imported.id)
+
+
+def test_tds_returns_add_and_drop_their_due_dates(client, db, company):
+    extend_calendars()
+    assert not any(form.startswith('TDS-') for form in _forms(company.id))
+
+    page = client.get('/tax/tds/new').get_data(as_text=True)
+    token = re.search(r'name="csrf_token"[^>]*value="([^"]+)"', page).group(1)
+    response = client.post('/tax/tds/new', data={
+        'csrf_token': token, 'client_id': company.id, 'tan': 'MUMS12345A', 'quarter': 'Q1',
+        'financial_year': active_financial_years()[0], 'return_type': '27Q', 'status': 'Pending',
+        'due_date': date.today().isoformat(),
+    })
+    assert response.status_code == 302
+    assert 'TDS-27Q' in _forms(company.id)
+
+    tds = TDSReturn.query.one()
+    assert client.post(f'/tax/tds/delete/{tds.id}').status_code == 302
+    assert 'TDS-27Q' not in _forms(company.id)
@@ -0,0 +1,117 @@
+"""Portable SQL helpers in database.py, run against each configured database.
+
+SQLite (in memory) always runs. Set TEST_DATABASE_URL to a scratch PostgreSQL
+database to run the same tests there; they create and drop their own tables.
+The PostgreSQL SQL is also compiled, without a server, on every run.
+"""
+import os
+from datetime import date, datetime
+import pytest
+from sqlalchemy import Column, Date, DateTime, Integer, String, create_engine, func, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import declarative_base
+from database import in_month, in_months, on_day, upsert, year_month
+
+Base = declarative_base()
+
+
+class Event(Base):
+    __tablename__ = 'test_database_events'
+    id = Column(Integer, primary_key=True)
+    happened_at = Column(DateTime)
+    day = Column(Date)
+
+
+class Tally(Base):
+    __tablename__ = 'test_database_tallies'
+    name = Column(String(20), primary_key=True)
+    label = Column(String(20))
+    count = Column(Integer, nullable=False, default=0)
+
+
+def _database_urls():
+    urls = [pytest.param('sqlite://', id='sqlite')]
+    url = os.environ.get('TEST_DATABASE_URL')
+    if url:
+        if url.startswith('postgres://'):
+            url = 'postgresql://' + url[len('postgres://'):]
+        urls.append(pytest.param(url, id=url.split(':', 1)[0].split('+', 1)[0]))
+    return urls
+
+
+@pytest.fixture(params=_database_urls())
+def engine(request):
+    engine = create_engine(request.param)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    yield engine
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+
+
+EVENTS = [
+    (datetime(2024, 1, 1, 0, 0, 0), date(2024, 1, 1)),
+    (datetime(2024, 1, 31, 23, 59, 59), date(2024, 1, 31)),
+    (datetime(2024, 2, 1, 0, 0, 0), date(2024, 2, 1)),
+    (datetime(2024, 2, 29, 12, 0, 0), date(2024, 2, 29)),
+    (datetime(2023, 12, 31, 23, 59, 59), date(2023, 12, 31)),
+]
+
+
+@pytest.fixture
+def events(engine):
+    with engine.begin() as conn:
+        conn.execute(Event.__table__.insert(), [{'happened_at': at, 'day': day} for at, day in EVENTS])
+    return engine
+
+
+def test_year_month_buckets(events):
+    bucket = year_month(Event.happened_at)
+    with events.connect() as conn:
+        rows = dict(conn.execute(select(bucket, func.count()).group_by(bucket)).all())
+    assert rows == {'2023-12': 1, '2024-01': 2, '2024-02': 2}
+
+
+@pytest.mark.parametrize('column', [Event.happened_at, Event.day], ids=['datetime', 'date'])
+def test_month_ranges(events, column):
+    with events.connect() as conn:
+        def count(criterion):
+            return conn.scalar(select(func.count()).select_from(Event).where(criterion))
+
+        assert count(in_month(column, date(2024, 1, 15))) == 2
+        assert count(in_month(column, date(2024, 2, 1))) == 2
+        assert count(in_months(column, date(2023, 12, 1), date(2024, 1, 1))) == 3
+        assert count(on_day(column, date(2024, 1, 31))) == 1
+        assert count(on_day(column, date(2024, 3, 1))) == 0
+
+
+def test_upsert_updates_and_increments(engine):
+    stmt = upsert(Tally, engine.dialect.name, ['name'], update_columns=['label'], increment_columns=['count'])
+    skip = upsert(Tally, engine.dialect.name, ['name'])
+    with engine.begin() as conn:
+        conn.execute(stmt, [{'name': 'a', 'label': 'first', 'count': 2}, {'name': 'b', 'label': 'b', 'count': 1}])
+        conn.execute(stmt, {'name': 'a', 'label': 'second', 'count': 3})
+        conn.execute(stmt, {'name': 'a', 'label': 'third', 'count': -1})
+        assert conn.execute(skip, {'name': 'b', 'label': 'ignored', 'count': 9}).rowcount == 0
+        rows = conn.execute(select(Tally.name, Tally.label, Tally.count).order_by(Tally.name)).all()
+    assert [tuple(row) for row in rows] == [('a', 'third', 4), ('b', 'b', 1)]
+
+
+def test_upsert_unsupported_dialect():
+    assert upsert(Tally, 'mssql', ['name']) is None
+
+
+def test_postgresql_sql():
+    dialect = postgresql.dialect()
+    sql = str(select(year_month(Event.happened_at)).compile(dialect=dialect))
+    assert "to_char(test_database_events.happened_at, 'YYYY-MM')" in sql
+
+    sql = str(upsert(Tally, 'postgresql', ['name'], update_columns=['label'], increment_columns=['count'])
+              .compile(dialect=dialect))
+    assert 'ON CONFLICT (name) DO UPDATE SET label = excluded.label' in sql
+    assert 'count = (test_database_tallies.count + excluded.count)' in sql
+    assert 'ON CONFLICT (name) DO NOTHING' in str(upsert(Tally, 'postgresql', ['name']).compile(dialect=dialect))
+
+    sql = str(select(Event.id).where(in_month(Event.day, date(2024, 2, 10))).compile(
+        dialect=dialect, compile_kwargs={'literal_binds': True}))
+    assert "test_database_events.day >= '2024-02-01'" in sql and "test_database_events.day < '2024-03-01'" in sql
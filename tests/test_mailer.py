@@ -0,0 +1,109 @@
+"""Email queue: claiming recipients, requeueing stale claims and counting outcomes"""
+import smtplib
+from datetime import datetime, timedelta
+import pytest
+from mailer import EmailDispatcher, _Outcome, enqueue_email_job
+from models import Client, CommunicationLog, Configuration, EmailJob, EmailJobRecipient
+
+
+@pytest.fixture
+def dispatcher(app):
+    # Driven by hand: no threads, so claims and outcomes happen step by step
+    dispatcher = EmailDispatcher()
+    dispatcher.app = app
+    return dispatcher
+
+
+@pytest.fixture
+def job(db, admin):
+    db.session.add(Configuration(user_id=admin.id, type='email', email_address='office@example.com',
+                                 smtp_server='smtp.example.com', smtp_port=587, status='Configured'))
+    clients = [Client(name=f'Client {i}', client_type='Individual', status='Active',
+                      email=f'client{i}@example.com' if i else None) for i in range(4)]
+    db.session.add_all(clients)
+    db.session.commit()
+    return enqueue_email_job(admin.id, 'Documents due', 'Dear {client_name}, please send them.', ['all'])
+
+
+def _statuses(db):
+    db.session.expire_all()
+    return sorted(r.status for r in EmailJobRecipient.query)
+
+
+def _report(dispatcher, outcomes):
+    for outcome in outcomes:
+        dispatcher._results.put(outcome)
+    buffer = []
+    dispatcher._drain(buffer, timeout=0)
+    dispatcher._flush(buffer)
+
+
+def _tasks(dispatcher):
+    tasks = []
+    while not dispatcher._tasks.empty():
+        tasks.append(dispatcher._tasks.get())
+    return tasks
+
+
+def test_claim_takes_each_recipient_once(db, dispatcher, job):
+    assert job.failed == 1  # the client without an email address
+    assert dispatcher._claim() == 3
+    assert dispatcher._claim() == 0
+    assert _statuses(db) == ['Failed', 'Sending', 'Sending', 'Sending']
+    assert db.session.get(EmailJob, job.id).status == 'Running'
+
+    tasks = _tasks(dispatcher)
+    assert [task.attempts for task in tasks] == [1, 1, 1]
+    assert tasks[0].body == f'Dear {tasks[0].client_name}, please send them.'
+
+
+def test_stale_claims_are_requeued(app, db, dispatcher, job):
+    dispatcher._claim()
+    dispatcher._requeue_stale()
+    assert _statuses(db).count('Sending') == 3
+
+    EmailJobRecipient.query.filter_by(status='Sending').update(
+        {'claimed_at': datetime.utcnow() - timedelta(seconds=dispatcher.setting('EMAIL_CLAIM_TIMEOUT') + 1)})
+    db.session.commit()
+    dispatcher._requeue_stale()
+    assert _statuses(db) == ['Failed', 'Pending', 'Pending', 'Pending']
+    assert dispatcher._claim() == 3
+
+
+def test_outcomes_are_counted_and_retried(db, dispatcher, job):
+    dispatcher._claim()
+    sent, retry, refused = _tasks(dispatcher)
+    _report(dispatcher, [
+        _Outcome(sent, True, False, False, False, None),
+        _Outcome(retry, False, False, False, False, 'Connection unexpectedly closed'),
+        _Outcome(refused, False, True, False, False, '550 No such user'),
+    ])
+
+    job = db.session.get(EmailJob, job.id)
+    assert (job.status, job.sent, job.failed) == ('Running', 1, 2)
+    assert CommunicationLog.query.count() == 2
+    pending = EmailJobRecipient.query.filter_by(status='Pending').one()
+    assert pending.next_attempt_at > datetime.utcnow()
+
+    pending.next_attempt_at = None
+    db.session.commit()
+    assert dispatcher._claim() == 1
+    _report(dispatcher, [_Outcome(_tasks(dispatcher)[0], True, False, False, False, None)])
+    job = db.session.get(EmailJob, job.id)
+    assert (job.status, job.sent, job.failed) == ('Completed', 2, 2)
+
+
+def test_outcomes_after_a_fatal_error_are_not_counted_twice(db, dispatcher, job):
+    dispatcher._claim()
+    first, second, late = _tasks(dispatcher)
+    error = str(smtplib.SMTPAuthenticationError(535, b'Bad credentials'))
+    _report(dispatcher, [_Outcome(first, True, False, False, False, None),
+                         _Outcome(second, False, True, True, False, error)])
+    job = db.session.get(EmailJob, job.id)
+    assert (job.status, job.sent, job.failed) == ('Failed', 1, 3)
+
+    # Still in flight when the job was stopped
+    _report(dispatcher, [_Outcome(late, True, False, False, False, None)])
+    job = db.session.get(EmailJob, job.id)
+    assert (job.sent, job.failed) == (1, 3)
+    assert job.sent + job.failed == job.total
@@ -0,0 +1,90 @@
+"""Pages and write paths through the test client, on the session's database (see conftest.py)"""
+from datetime import date, datetime, timedelta
+import pytest
+from models import (ChallanManagement, Client, GSTReturn, IncomeTaxReturn, Reminder, ReturnTracker, ROCForm,
+                    SchedulerState, SFTReturn, TDSReturn)
+from return_status import status_counts
+
+
+@pytest.fixture
+def records(db, admin):
+    client = Client(name='Ramesh Traders', client_type='Individual', pan='ABCDE1234F', status='Active')
+    db.session.add(client)
+    db.session.flush()
+    today = date.today()
+    db.session.add_all([
+        IncomeTaxReturn(client_id=client.id, assessment_year='2025-26', status='Pending',
+                        acknowledgment_number='123456789012345'),
+        TDSReturn(client_id=client.id, tan='MUMR12345A', quarter='Q1', financial_year='2025-26', status='Pending'),
+        GSTReturn(client_id=client.id, gstin='27ABCDE1234F1Z5', month_year='04-2025', status='Pending'),
+        ROCForm(client_id=client.id, form_type='AOC-4', financial_year='2024-25'),
+        SFTReturn(client_id=client.id, financial_year='2024-25'),
+        ChallanManagement(client_id=client.id, challan_number='CH00991', amount=1500.0, status='Pending',
+                          payment_date=today),
+        Reminder(client_id=client.id, title='File GSTR-3B', reminder_date=datetime.now() + timedelta(days=2),
+                 status='Active', created_by=admin.id),
+        ReturnTracker(client_id=client.id, return_type='GSTR-1', period='04-2025', due_date=today,
+                      status='Pending'),
+    ])
+    db.session.commit()
+    return client
+
+
+@pytest.mark.parametrize('url', [
+    '/', '/clients', '/tax/income-tax', '/tax/tds', '/tax/gst', '/roc_forms', '/sft_returns',
+    '/smart/challan-management', '/reminders', '/smart/return-tracker', '/reports/outstanding',
+    '/crm/communications', '/admin/documents', '/api/dashboard/stats',
+])
+def test_pages_render(client, records, url):
+    assert client.get(url).status_code == 200
+
+
+def test_dashboard_stats_follow_writes(client, records, db):
+    assert client.get('/api/dashboard/stats').get_json()['total_clients'] == 1
+    db.session.add(Client(name='Sita Co', client_type='Company'))
+    db.session.commit()
+    stats = client.get('/api/dashboard/stats').get_json()
+    assert stats['total_clients'] == 2
+    assert stats['pending_itr'] == 1
+
+
+def test_commits_publish_dashboard_versions(client, records, db):
+    # Upsert-incremented counters other processes poll (stats._publish)
+    before = db.session.get(SchedulerState, 'dashboard.stats').value
+    db.session.add(Client(name='Sita Co', client_type='Company'))
+    db.session.commit()
+    db.session.expire_all()
+    assert db.session.get(SchedulerState, 'dashboard.stats').value == before + 1
+
+
+def test_return_status_counters(client, records, db):
+    form = {'client_id': records.id, 'return_type': 'GSTR-3B', 'period': '05-2025',
+            'due_date': (date.today() + timedelta(days=20)).isoformat(), 'status': 'Pending'}
+    assert client.post('/smart/add-return', data=form).status_code == 302
+    assert client.post('/smart/add-return', data=dict(form, period='06-2025')).status_code == 302
+    saved = ReturnTracker.query.filter_by(return_type='GSTR-3B', period='05-2025').one()
+    client.post('/smart/add-return', data=dict(form, return_id=saved.id, status='Filed',
+                                               filing_date=date.today().isoformat()))
+
+    # The fixture's return was inserted directly, so it isn't in the counters
+    counts = status_counts()
+    assert (counts['Pending'], counts['Filed']) == (1, 1)
+
+
+def test_list_views_narrow_to_search_hit(client, records):
+    hits = client.get('/api/search?q=27abcde1234f&limit=-5').get_json()
+    assert [hit['type'] for hit in hits] == ['GST Return']
+    gst = GSTReturn.query.one()
+    assert hits[0]['url'] == f'/tax/gst?id={gst.id}'
+    assert '27ABCDE1234F1Z5' in client.get(hits[0]['url']).get_data(as_text=True)
+    assert '27ABCDE1234F1Z5' not in client.get(f'/tax/gst?id={gst.id + 1}').get_data(as_text=True)
+
+
+def test_challan_status_filter_is_normalised(client, records, db):
+    db.session.add(ChallanManagement(client_id=records.id, challan_number='CH00992', amount=2500.0, status=' cleared'))
+    db.session.commit()
+    assert ChallanManagement.query.filter_by(challan_number='CH00992').one().status == 'Cleared'
+
+    page = client.get('/smart/challan-management?status=CLEARED').get_data(as_text=True)
+    assert 'CH00992' in page and 'CH00991' not in page
+    assert '₹2,500.00' in page  # cleared total
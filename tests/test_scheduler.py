@@ -0,0 +1,52 @@
+"""Reminder scheduler: generating, firing and deleting auto reminders"""
+from datetime import date, datetime, timedelta
+import pytest
+from models import Client, EmailJob, IncomeTaxReturn, Reminder, ReminderSource
+from scheduler import ReminderScheduler
+
+
+@pytest.fixture
+def itr(db, admin):
+    client = Client(name='Ramesh Traders', client_type='Individual', email='ramesh@example.com',
+                    status='Active', created_by=admin.id)
+    db.session.add(client)
+    db.session.flush()
+    itr = IncomeTaxReturn(client_id=client.id, assessment_year='2025-26', status='Pending',
+                          due_date=date.today() + timedelta(days=30), created_by=admin.id)
+    db.session.add(itr)
+    db.session.commit()
+    return itr
+
+
+def test_sync_generates_one_reminder_per_row(app, db, itr):
+    scheduler = ReminderScheduler(app)
+    scheduler.sync(datetime.now())
+    scheduler.sync(datetime.now())
+
+    reminder = Reminder.query.one()
+    assert reminder.auto_created and reminder.source.source == 'itr'
+    assert reminder.source.source_id == itr.id
+    assert reminder.reminder_date.date() == itr.due_date - timedelta(days=7)
+
+
+def test_fire_due_queues_one_email_job(app, db, itr):
+    scheduler = ReminderScheduler(app)
+    scheduler.sync(datetime.now())
+    reminder = Reminder.query.one()
+    # Only reminders due before the next couple of syncs are loaded
+    assert scheduler.fire_due(reminder.reminder_date) == 0
+
+    scheduler.sync(reminder.reminder_date)
+    assert scheduler.fire_due(reminder.reminder_date) == 1
+    assert db.session.get(Reminder, reminder.id).notification_sent
+    assert EmailJob.query.one().total == 1
+
+
+def test_delete_generated_reminder(app, db, client, itr):
+    ReminderScheduler(app).sync(datetime.now())
+    reminder = Reminder.query.one()
+
+    assert client.post(f'/reminders/{reminder.id}/delete').status_code == 302
+    db.session.expire_all()
+    assert Reminder.query.count() == 0
+    assert ReminderSource.query.count() == 0
@@ -0,0 +1,96 @@
+"""SMS queue: claiming recipients, requeueing stale claims and counting outcomes"""
+from datetime import datetime, timedelta
+import pytest
+from models import Client, CommunicationLog, SMSJob, SMSJobRecipient
+from sms import SMSDispatcher, SMSError, enqueue_sms_job
+
+
+class FakeTransport:
+    """Accepts every number except those in `refuse`; `flaky` numbers fail once, retryably"""
+
+    def __init__(self, refuse=(), flaky=()):
+        self.refuse = set(refuse)
+        self.flaky = set(flaky)
+        self.sent = []
+
+    async def send(self, to, body):
+        if to in self.refuse:
+            raise SMSError('Invalid number', status=400)
+        if to in self.flaky:
+            self.flaky.discard(to)
+            raise SMSError('Too many requests', retryable=True, status=429)
+        self.sent.append((to, body))
+        return f'SM{len(self.sent):032d}'
+
+
+@pytest.fixture
+def transport(app, monkeypatch):
+    transport = FakeTransport()
+    monkeypatch.setitem(app.config, 'SMS_TRANSPORT', transport)
+    monkeypatch.setitem(app.config, 'SMS_RETRY_DELAY', 0)
+    return transport
+
+
+@pytest.fixture
+def dispatcher(app):
+    # Driven by hand: no coordinator thread
+    dispatcher = SMSDispatcher()
+    dispatcher.app = app
+    return dispatcher
+
+
+@pytest.fixture
+def job(db, admin, transport):
+    phones = ['98765 43210', '+91 91234 56789', '080-2345678', None]
+    db.session.add_all([Client(name=f'Client {i}', client_type='Individual', status='Active', phone=phone)
+                        for i, phone in enumerate(phones)])
+    db.session.commit()
+    return enqueue_sms_job(admin.id, 'Dear {client_name}, your GST return is due.', ['all'])
+
+
+def _statuses(db):
+    db.session.expire_all()
+    return sorted(r.status for r in SMSJobRecipient.query)
+
+
+def test_claim_takes_each_recipient_once(db, dispatcher, job):
+    assert job.failed == 1  # the client without a phone number
+    assert [row.phone for row in dispatcher._claim()] == ['+919876543210', '+919123456789', '+91802345678']
+    assert dispatcher._claim() == []
+    assert _statuses(db) == ['Failed', 'Sending', 'Sending', 'Sending']
+    assert db.session.get(SMSJob, job.id).status == 'Running'
+
+
+def test_stale_claims_are_requeued(db, dispatcher, job):
+    dispatcher._claim()
+    dispatcher._requeue_stale()
+    assert _statuses(db).count('Sending') == 3
+
+    SMSJobRecipient.query.filter_by(status='Sending').update(
+        {'claimed_at': datetime.utcnow() - timedelta(seconds=dispatcher.setting('SMS_CLAIM_TIMEOUT') + 1)})
+    db.session.commit()
+    dispatcher._requeue_stale()
+    assert _statuses(db) == ['Failed', 'Pending', 'Pending', 'Pending']
+    assert dispatcher.send_batch() == 3
+
+
+def test_batch_outcomes_are_counted(db, dispatcher, job, transport):
+    transport.refuse.add('+91802345678')
+    transport.flaky.add('+919123456789')
+    assert dispatcher.send_batch() == 3
+    assert dispatcher.send_batch() == 0
+
+    job = db.session.get(SMSJob, job.id)
+    assert (job.status, job.sent, job.failed) == ('Completed', 2, 2)
+    assert sorted(body for _, body in transport.sent) == ['Dear Client 0, your GST return is due.',
+                                                          'Dear Client 1, your GST return is due.']
+    retried = SMSJobRecipient.query.filter_by(phone='+919123456789').one()
+    assert (retried.status, retried.attempts) == ('Sent', 2) and retried.message_sid
+    assert CommunicationLog.query.filter_by(communication_type='SMS').count() == 3
+
+
+def test_jobs_fail_without_a_transport(app, db, dispatcher, job, monkeypatch):
+    monkeypatch.setitem(app.config, 'SMS_TRANSPORT', None)
+    assert dispatcher.send_batch() == 3
+    job = db.session.get(SMSJob, job.id)
+    assert (job.status, job.sent, job.failed) == ('Failed', 0, 4)
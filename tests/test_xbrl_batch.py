@@ -0,0 +1,94 @@
+"""XBRL validation pool: timeouts, pool restarts and recording verdicts"""
+import multiprocessing
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+import pytest
+from models import Client, XBRLReport, XBRLValidationBatch, XBRLValidationItem
+from xbrl import ValidationTimeout
+from xbrl_batch import XBRLBatchValidator, _Outcome, _Task, enqueue_validation
+
+
+@pytest.fixture
+def validator(app):
+    # Driven by hand: no coordinator thread
+    validator = XBRLBatchValidator()
+    validator.app = app
+    yield validator
+    if validator._executor is not None:
+        validator._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _task(item_id, deadline=None):
+    return _Task(item_id, 1, item_id, deadline or time.monotonic() + 60, ('report.xml', None, None, 1))
+
+
+def _finished(result=None, exception=None):
+    future = Future()
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+    return future
+
+
+def test_restart_records_finished_tasks_and_resubmits_the_rest(validator, monkeypatch):
+    resubmitted = []
+    monkeypatch.setattr(validator, '_submit', resubmitted.append)
+    validator._futures = {
+        _finished((True, '{}', [], 0.2)): _task(1),
+        _finished(exception=ValidationTimeout()): _task(2),
+        _finished(exception=ValueError('not an XBRL instance')): _task(3),
+        Future(): _task(4, deadline=time.monotonic() - 1),
+    }
+
+    outcomes = validator._restart_pool()
+    assert [(o.task.item_id, o.valid, o.error) for o in outcomes] == [
+        (1, True, None), (2, None, 'timeout'), (3, None, 'not an XBRL instance')]
+    assert [task.item_id for task in resubmitted] == [4]
+    assert resubmitted[0].deadline > time.monotonic()
+
+
+def test_overdue_task_kills_its_worker(validator, monkeypatch):
+    resubmitted = []
+    monkeypatch.setattr(validator, '_submit', resubmitted.append)
+    executor = validator._executor = ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn'))
+    stuck = executor.submit(time.sleep, 60)
+    waiting = executor.submit(time.sleep, 60)
+    deadline = time.monotonic() + 30
+    while not stuck.running() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    processes = list(executor._processes.values())
+    assert processes
+    validator._futures = {stuck: _task(1, deadline=time.monotonic() - 1), waiting: _task(2)}
+
+    outcomes = validator._collect(timeout=0)
+    assert [(o.task.item_id, o.error) for o in outcomes] == [(1, 'timeout')]
+    assert [task.item_id for task in resubmitted] == [2]
+    assert validator._executor is None
+    for process in processes:
+        process.join(10)
+        assert not process.is_alive()
+
+
+def test_record_marks_timeouts_failed(app, db, admin, validator, monkeypatch):
+    client = Client(name='Sita Traders Pvt Ltd', client_type='Company')
+    db.session.add(client)
+    db.session.flush()
+    reports = [XBRLReport(client_id=client.id, financial_year='2024-25', report_type='Balance Sheet',
+                          xbrl_file_path=f'uploads/report{i}.xml') for i in range(2)]
+    db.session.add_all(reports)
+    db.session.commit()
+    batch = enqueue_validation([r.id for r in reports], admin.id)
+
+    claimed = []
+    monkeypatch.setattr(validator, '_submit', claimed.append)
+    assert validator._claim(10) == 2
+    validator._record([_Outcome(claimed[0], True, '{"errors": []}', 0.4, None),
+                       _Outcome(claimed[1], None, None, None, 'timeout')])
+    validator._finish_batches()
+
+    batch = db.session.get(XBRLValidationBatch, batch.id)
+    assert (batch.status, batch.valid, batch.failed) == ('Completed', 1, 1)
+    failed = XBRLValidationItem.query.filter_by(status='Failed').one()
+    assert 'did not finish' in failed.error
+    assert db.session.get(XBRLReport, reports[0].id).validation_status == 'Valid'
@@ -50,28 +50,17 @@ def allowed_file(filename):
 
     return None, None """
 
-def save_uploaded_file(file, subfolder=''):
-    """Save uploaded file into a subfolder and return relative file path and size"""
-    print("Uploaded filename:", file.filename)
+def save_uploaded_file(file):
+    """Save an uploaded file in the blob store and return its relative file path and size.
 
+    Identical content is stored once and shared; see blobstore.store().
+    """
     if file and allowed_file(file.filename):
-        print("File is allowed. Proceeding to save.")
-        upload_dir = os.path.join(current_app.root_path, 'uploads', subfolder)
-        os.makedirs(upload_dir, exist_ok=True)
-
-        filename = secure_filename(file.filename)
-        name, ext = os.path.splitext(filename)
-        unique_filename = f"{name}_{uuid.uuid4().hex[:8]}{ext}"
-
-        file_path = os.path.join(upload_dir, unique_filename)
-        file.save(file_path)
-
-        file_size = os.path.getsize(file_path)
+        from blobstore import store
 
-        rel_path = os.path.join('uploads', subfolder, unique_filename)
-        return rel_path, file_size
+        extension = os.path.splitext(secure_filename(file.filename))[1]
+        return store(file.stream, extension)
 
-    print("File is NOT allowed.")
     return None, None
 
 def format_currency(amount):
@@ -0,0 +1,491 @@
+import json
+import os
+import random
+import re
+import signal
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from collections import Counter
+from datetime import date
+from decimal import Decimal, InvalidOperation
+import click
+from flask.cli import with_appcontext
+
+try:
+    import resource  # Unix only; used by the benchmark command
+except ImportError:
+    resource = None
+
+XBRLI = 'http://www.xbrl.org/2003/instance'
+LINK = 'http://www.xbrl.org/2003/linkbase'
+XLINK = 'http://www.w3.org/1999/xlink'
+XSI = 'http://www.w3.org/2001/XMLSchema-instance'
+ISO4217 = 'http://www.xbrl.org/2003/iso4217'
+
+MAX_ISSUES = 200  # issues kept per report; the rest are only counted
+
+# --- MCA taxonomy rules -------------------------------------------------------
+# Concepts are matched on their local name, so the rules hold across taxonomy
+# years (in-gaap, in-gcd, ...) whose namespaces differ.
+
+GENERAL_ELEMENTS = ('NameOfCompany', 'CorporateIdentityNumber',
+                    'DateOfStartOfReportingPeriod', 'DateOfEndOfReportingPeriod')
+
+# Per XBRLReport.report_type, on top of the general information above
+REQUIRED_ELEMENTS = {
+    'Balance Sheet': ('EquityAndLiabilities', 'ShareholdersFunds', 'CurrentLiabilities',
+                      'Assets', 'NonCurrentAssets', 'CurrentAssets'),
+    'P&L': ('RevenueFromOperations', 'Revenue', 'Expenses', 'ProfitBeforeTax', 'ProfitLossForPeriod'),
+    'Cash Flow': ('CashFlowsFromUsedInOperatingActivities', 'CashFlowsFromUsedInInvestingActivities',
+                  'CashFlowsFromUsedInFinancingActivities', 'IncreaseDecreaseInCashAndCashEquivalents'),
+    'Notes': (),
+}
+
+# Calculation roll-ups: total = sum(weight * item), checked per context and unit
+# wherever the total and at least one item are reported
+ROLLUPS = (
+    ('Assets', (('NonCurrentAssets', 1), ('CurrentAssets', 1))),
+    ('EquityAndLiabilities', (('ShareholdersFunds', 1), ('ShareApplicationMoneyPendingAllotment', 1),
+                              ('NonCurrentLiabilities', 1), ('CurrentLiabilities', 1))),
+    ('EquityAndLiabilities', (('Assets', 1),)),
+    ('Revenue', (('RevenueFromOperations', 1), ('OtherIncome', 1))),
+    ('ProfitLossForPeriod', (('ProfitBeforeTax', 1), ('TaxExpense', -1))),
+    ('IncreaseDecreaseInCashAndCashEquivalents', (('CashFlowsFromUsedInOperatingActivities', 1),
+                                                  ('CashFlowsFromUsedInInvestingActivities', 1),
+                                                  ('CashFlowsFromUsedInFinancingActivities', 1))),
+)
+
+# Only these concepts' values are kept in memory; every other fact is checked and dropped
+_TRACKED = {total for total, _ in ROLLUPS} | {item for _, items in ROLLUPS for item, _ in items}
+
+
+_NIL = f'{{{XSI}}}nil'
+
+_split_cache = {}
+
+
+def _split(tag):
+    """(namespace, local name) of a Clark-notation tag; instances repeat a few thousand tags, so it's memoised"""
+    try:
+        return _split_cache[tag]
+    except KeyError:
+        namespace, _, local = tag[1:].partition('}') if tag[0] == '{' else ('', '', tag)
+        _split_cache[tag] = (namespace, local)
+        return namespace, local
+
+
+def _parse_date(text):
+    # xs:date or xs:dateTime; the date part is all the checks need
+    return date.fromisoformat((text or '').strip()[:10])
+
+
+def _tolerance(decimals):
+    """Half a unit in the last reported place, the rounding a value with `decimals` may carry"""
+    if decimals is None or decimals == 'INF':
+        return Decimal(0)
+    try:
+        return Decimal('0.5').scaleb(-int(decimals))
+    except ValueError:
+        return Decimal(0)
+
+
+class ValidationResult:
+    """Issues found in one instance, plus what was parsed"""
+
+    def __init__(self, max_issues=MAX_ISSUES):
+        self.issues = []
+        self.max_issues = max_issues
+        self.counts = Counter()  # errors/warnings, including those beyond max_issues
+        self.stats = Counter()   # facts, contexts, units, bytes
+        self.seconds = 0.0
+
+    def add(self, severity, code, message, **detail):
+        self.counts[severity] += 1
+        if len(self.issues) < self.max_issues:
+            self.issues.append({'severity': severity, 'code': code, 'message': message, **detail})
+
+    @property
+    def valid(self):
+        return not self.counts['error']
+
+    def to_json(self):
+        return json.dumps({
+            'valid': self.valid,
+            'errors': self.counts['error'],
+            'warnings': self.counts['warning'],
+            'facts': self.stats['facts'],
+            'contexts': self.stats['contexts'],
+            'units': self.stats['units'],
+            'issues': self.issues,
+        })
+
+
+class InstanceValidator:
+    """Validate an XBRL instance in one streaming pass with bounded memory.
+
+    The file is read with iterparse and each top-level context, unit or fact
+    is checked and cleared as soon as it ends, so memory follows the number
+    of contexts and units rather than the file size. Only the values of
+    concepts used by the roll-up rules are retained.
+    """
+
+    def __init__(self, report_type=None, financial_year=None, max_issues=MAX_ISSUES):
+        self.report_type = report_type
+        self.financial_year = financial_year
+        self.max_issues = max_issues
+
+    def validate(self, source):
+        """Validate a path or binary file object and return a ValidationResult"""
+        self.result = ValidationResult(self.max_issues)
+        self.prefixes = {}
+        self.contexts = set()
+        self.units = set()
+        self.missing_refs = {}   # ('context'|'unit', id) -> first concept referring to it before it was defined
+        self.identifiers = set()
+        self.period_ends = set()
+        self.concepts = set()
+        self.values = {}         # (concept, context, unit) -> (value, decimals) for _TRACKED concepts
+        self.reporting_end = None
+        self.has_schema_ref = False
+
+        started = time.perf_counter()
+        try:
+            if self._parse(source):
+                self._finish()
+        except ET.ParseError as e:
+            line, column = e.position
+            self.result.add('error', 'malformed-xml', f"Not well-formed XML: {e}", line=line, column=column)
+        self.result.seconds = time.perf_counter() - started
+        return self.result
+
+    def _parse(self, source):
+        depth = 0
+        root = None
+        parser = ET.iterparse(source, events=('start-ns', 'start', 'end'))
+        for event, elem in parser:
+            if event == 'start-ns':
+                prefix, uri = elem
+                self.prefixes[prefix] = uri
+            elif event == 'start':
+                depth += 1
+                if depth == 1:
+                    root = elem
+                    if elem.tag != f'{{{XBRLI}}}xbrl':
+                        self.result.add('error', 'not-an-instance', f"Root element is {elem.tag}, not xbrli:xbrl")
+                        return False
+            else:
+                depth -= 1
+                if depth == 1:
+                    self._top_level(elem)
+                    root.clear()
+        if hasattr(source, 'tell'):
+            self.result.stats['bytes'] = source.tell()
+        elif isinstance(source, (str, os.PathLike)):
+            self.result.stats['bytes'] = os.path.getsize(source)
+        return True
+
+    def _top_level(self, elem):
+        namespace, local = _split(elem.tag)
+        if namespace == XBRLI:
+            if local == 'context':
+                self._context(elem)
+            elif local == 'unit':
+                self._unit(elem)
+        elif namespace == LINK:
+            if local == 'schemaRef':
+                self.has_schema_ref = True
+        else:
+            self._fact(elem, local)
+
+    def _define(self, kind, registry, elem):
+        ref = elem.get('id')
+        if not ref:
+            self.result.add('error', f'{kind}-without-id', f"A {kind} has no id")
+            return None
+        if ref in registry:
+            self.result.add('error', f'duplicate-{kind}', f"{kind.capitalize()} {ref} is defined more than once",
+                            **{kind: ref})
+            return None
+        registry.add(ref)
+        self.result.stats[f'{kind}s'] += 1
+        self.missing_refs.pop((kind, ref), None)
+        return ref
+
+    def _context(self, elem):
+        ref = self._define('context', self.contexts, elem)
+        if ref is None:
+            return
+        identifier = elem.find(f'{{{XBRLI}}}entity/{{{XBRLI}}}identifier')
+        if identifier is None or not (identifier.text or '').strip() or not identifier.get('scheme'):
+            self.result.add('error', 'context-entity', f"Context {ref} has no entity identifier and scheme", context=ref)
+        else:
+            self.identifiers.add((identifier.get('scheme'), identifier.text.strip()))
+
+        period = elem.find(f'{{{XBRLI}}}period')
+        if period is None:
+            self.result.add('error', 'context-period', f"Context {ref} has no period", context=ref)
+            return
+        instant = period.find(f'{{{XBRLI}}}instant')
+        start, end = period.find(f'{{{XBRLI}}}startDate'), period.find(f'{{{XBRLI}}}endDate')
+        try:
+            if instant is not None:
+                self.period_ends.add(_parse_date(instant.text))
+            elif start is not None and end is not None:
+                start, end = _parse_date(start.text), _parse_date(end.text)
+                if start > end:
+                    self.result.add('error', 'context-period', f"Context {ref} starts after it ends", context=ref)
+                self.period_ends.add(end)
+            elif period.find(f'{{{XBRLI}}}forever') is None:
+                self.result.add('error', 'context-period',
+                                f"Context {ref} needs an instant or a start and end date", context=ref)
+        except ValueError:
+            self.result.add('error', 'context-period', f"Context {ref} has an invalid date", context=ref)
+
+    def _unit(self, elem):
+        ref = self._define('unit', self.units, elem)
+        if ref is None:
+            return
+        measures = [m.text.strip() for m in elem.iter(f'{{{XBRLI}}}measure') if m.text and m.text.strip()]
+        if not measures:
+            self.result.add('error', 'unit-measure', f"Unit {ref} has no measure", unit=ref)
+        for measure in measures:
+            prefix, _, local = measure.rpartition(':')
+            uri = self.prefixes.get(prefix)
+            if uri is None:
+                self.result.add('error', 'unit-measure', f"Unit {ref} uses undeclared prefix in {measure}", unit=ref)
+            elif uri == ISO4217 and not re.fullmatch(r'[A-Z]{3}', local):
+                self.result.add('error', 'unit-measure', f"Unit {ref}: {measure} is not an ISO 4217 currency",
+                                unit=ref)
+
+    def _reference(self, kind, ref, concept):
+        if (kind, ref) not in self.missing_refs:
+            self.missing_refs[(kind, ref)] = concept
+
+    def _fact(self, elem, concept):
+        context = elem.get('contextRef')
+        if context is None:
+            if len(elem):
+                # A tuple: its children are the facts
+                for child in elem:
+                    self._fact(child, _split(child.tag)[1])
+            else:
+                self.result.add('error', 'fact-context', f"Fact {concept} has no contextRef", concept=concept)
+            return
+
+        self.result.stats['facts'] += 1
+        self.concepts.add(concept)
+        if context not in self.contexts:
+            self._reference('context', context, concept)
+        unit = elem.get('unitRef')
+        nil = elem.get(_NIL) in ('true', '1')
+        decimals, precision = elem.get('decimals'), elem.get('precision')
+        text = (elem.text or '').strip()
+
+        if unit is None:
+            if decimals is not None or precision is not None:
+                self.result.add('error', 'fact-decimals', f"Non-numeric fact {concept} has decimals/precision",
+                                concept=concept, context=context)
+            if concept == 'DateOfEndOfReportingPeriod' and text:
+                try:
+                    self.reporting_end = _parse_date(text)
+                except ValueError:
+                    self.result.add('error', 'fact-value', f"{concept} is not a date: {text[:40]}",
+                                    concept=concept, context=context)
+            return
+
+        if unit not in self.units:
+            self._reference('unit', unit, concept)
+        if nil:
+            return
+        if decimals is None and precision is None:
+            self.result.add('error', 'fact-decimals', f"Numeric fact {concept} needs decimals or precision",
+                            concept=concept, context=context)
+        elif decimals is not None and precision is not None:
+            self.result.add('error', 'fact-decimals', f"Numeric fact {concept} has both decimals and precision",
+                            concept=concept, context=context)
+        try:
+            value = Decimal(text)
+        except InvalidOperation:
+            self.result.add('error', 'fact-value', f"{concept} is not a number: {text[:40]!r}",
+                            concept=concept, context=context)
+            return
+        if concept not in _TRACKED:
+            return
+        key = (concept, context, unit)
+        previous = self.values.get(key)
+        if previous is None:
+            self.values[key] = (value, decimals)
+        elif previous[0] != value:
+            self.result.add('error', 'inconsistent-duplicate',
+                            f"{concept} is reported as both {previous[0]} and {value}", concept=concept,
+                            context=context)
+
+    def _finish(self):
+        result = self.result
+        if not self.has_schema_ref:
+            result.add('error', 'schema-ref', "The instance does not reference a taxonomy schema (link:schemaRef)")
+        for (kind, ref), concept in self.missing_refs.items():
+            result.add('error', f'undefined-{kind}', f"{concept} refers to undefined {kind} {ref}",
+                       concept=concept, **{kind: ref})
+        if len(self.identifiers) > 1:
+            result.add('error', 'entity-identifier', "Contexts identify more than one entity: " +
+                       ', '.join(sorted(value for _, value in self.identifiers)[:5]))
+
+        required = GENERAL_ELEMENTS + REQUIRED_ELEMENTS.get(self.report_type, ())
+        for concept in required:
+            if concept not in self.concepts:
+                result.add('error', 'required-element', f"Required element {concept} is missing", concept=concept)
+
+        self._check_rollups()
+        self._check_financial_year()
+
+    def _check_rollups(self):
+        by_context = {}
+        for (concept, context, unit), value in self.values.items():
+            by_context.setdefault((context, unit), {})[concept] = value
+        for (context, unit), values in by_context.items():
+            for total, items in ROLLUPS:
+                if total not in values:
+                    continue
+                present = [(values[item], weight) for item, weight in items if item in values]
+                if not present:
+                    continue
+                computed = sum(weight * value for (value, _), weight in present)
+                reported, decimals = values[total]
+                tolerance = _tolerance(decimals) + sum(_tolerance(d) for (_, d), _ in present)
+                if abs(computed - reported) > tolerance:
+                    terms = ' + '.join(item for item, _ in items if item in values)
+                    self.result.add('error', 'calculation',
+                                    f"{total} is {reported} but {terms} comes to {computed}",
+                                    concept=total, context=context)
+
+    def _check_financial_year(self):
+        match = re.match(r'^(\d{4})-(\d{2}|\d{4})$', (self.financial_year or '').strip())
+        if not match:
+            return
+        year_end = date(int(match.group(1)) + 1, 3, 31)
+        if self.reporting_end is not None and self.reporting_end != year_end:
+            self.result.add('warning', 'financial-year',
+                            f"DateOfEndOfReportingPeriod is {self.reporting_end}, expected {year_end} "
+                            f"for FY {self.financial_year}")
+        elif self.period_ends and year_end not in self.period_ends:
+            self.result.add('warning', 'financial-year', f"No context ends on {year_end} for FY {self.financial_year}")
+
+
+class ValidationTimeout(Exception):
+    pass
+
+
+def _expire(signum, frame):
+    raise ValidationTimeout()
+
+
+def validate_file(path, report_type=None, financial_year=None, timeout=None):
+    """Validate the instance at `path`; returns (valid, result JSON, facts, seconds).
+
+    Runs in the batch worker processes (xbrl_batch.py), so it needs no app
+    context. With `timeout` the parse is interrupted after that many seconds
+    by raising ValidationTimeout, leaving the worker free for the next file.
+    """
+    if not os.path.isfile(path):
+        result = ValidationResult()
+        result.add('error', 'file-missing', "No XBRL instance file is attached to this report")
+        return result.valid, result.to_json(), 0, 0.0
+
+    alarm = timeout and hasattr(signal, 'setitimer')
+    if alarm:
+        previous = signal.signal(signal.SIGALRM, _expire)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        result = InstanceValidator(report_type, financial_year).validate(path)
+    finally:
+        if alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+    return result.valid, result.to_json(), result.stats['facts'], result.seconds
+
+
+def failure_json(code, message):
+    """validation_errors value recording a run that produced no verdict"""
+    result = ValidationResult()
+    result.add('error', code, message)
+    return result.to_json()
+
+
+def validation_issues(validation_errors):
+    """Issue dicts for a stored validation_errors value; free text from the form becomes one issue per line"""
+    if not validation_errors:
+        return []
+    try:
+        return json.loads(validation_errors)['issues']
+    except (ValueError, KeyError, TypeError):
+        return [{'severity': 'error', 'code': '', 'message': line}
+                for line in validation_errors.splitlines() if line.strip()]
+
+
+# --- Benchmark ----------------------------------------------------------------
+
+def write_synthetic_instance(path, facts=100000, contexts=500, seed=0):
+    """Write a valid instance with `facts` facts over `contexts` contexts, for benchmarking"""
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as out:
+        out.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                  f'<xbrli:xbrl xmlns:xbrli="{XBRLI}" xmlns:link="{LINK}" xmlns:xlink="{XLINK}" '
+                  f'xmlns:iso4217="{ISO4217}" xmlns:in-gaap="http://www.icai.org/xbrl/taxonomy/in-gaap" '
+                  'xmlns:in-gcd="http://www.icai.org/xbrl/taxonomy/in-gcd">\n'
+                  '<link:schemaRef xlink:type="simple" xlink:href="in-gaap-ci.xsd"/>\n')
+        for i in range(contexts):
+            out.write(f'<xbrli:context id="C{i}"><xbrli:entity><xbrli:identifier scheme="http://www.mca.gov.in/CIN">'
+                      'U74999MH2015PTC000001</xbrli:identifier></xbrli:entity><xbrli:period>'
+                      '<xbrli:startDate>2024-04-01</xbrli:startDate><xbrli:endDate>2025-03-31</xbrli:endDate>'
+                      '</xbrli:period></xbrli:context>\n')
+        out.write('<xbrli:unit id="INR"><xbrli:measure>iso4217:INR</xbrli:measure></xbrli:unit>\n')
+        for concept, value in (('NameOfCompany', 'Synthetic Private Limited'),
+                               ('CorporateIdentityNumber', 'U74999MH2015PTC000001'),
+                               ('DateOfStartOfReportingPeriod', '2024-04-01'),
+                               ('DateOfEndOfReportingPeriod', '2025-03-31')):
+            out.write(f'<in-gcd:{concept} contextRef="C0">{value}</in-gcd:{concept}>\n')
+        for i in range(0, contexts):
+            non_current, current = rng.randrange(10 ** 6, 10 ** 9), rng.randrange(10 ** 6, 10 ** 9)
+            funds = rng.randrange(0, non_current + current)
+            for concept, value in (('NonCurrentAssets', non_current), ('CurrentAssets', current),
+                                   ('Assets', non_current + current), ('ShareholdersFunds', funds),
+                                   ('CurrentLiabilities', non_current + current - funds),
+                                   ('EquityAndLiabilities', non_current + current)):
+                out.write(f'<in-gaap:{concept} contextRef="C{i}" unitRef="INR" decimals="0">{value}'
+                          f'</in-gaap:{concept}>\n')
+        for i in range(max(facts - contexts * 6 - 4, 0)):
+            out.write(f'<in-gaap:DisclosureItem{i % 2000} contextRef="C{rng.randrange(contexts)}" unitRef="INR" '
+                      f'decimals="-3">{rng.randrange(10 ** 9)}</in-gaap:DisclosureItem{i % 2000}>\n')
+        out.write('</xbrli:xbrl>\n')
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process in MB, or None where it can't be read"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and KiB on Linux
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 1024
+
+
+@click.command('xbrl-benchmark')
+@click.option('--facts', default=500000, show_default=True, help='Facts in the synthetic instance.')
+@click.option('--contexts', default=2000, show_default=True, help='Contexts in the synthetic instance.')
+@with_appcontext
+def xbrl_benchmark_command(facts, contexts):
+    """Measure validator throughput and memory on a large synthetic instance."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'synthetic.xbrl')
+        write_synthetic_instance(path, facts, contexts)
+        size = os.path.getsize(path)
+        rss_before = _peak_rss_mb()
+        result = InstanceValidator('Balance Sheet', '2024-25').validate(path)
+        rss_after = _peak_rss_mb()
+    click.echo(f"{size / 2 ** 20:.1f} MB, {result.stats['facts']:,} facts, {result.stats['contexts']:,} contexts "
+               f"in {result.seconds:.2f}s: {size / 2 ** 20 / result.seconds:.1f} MB/s, "
+               f"{result.stats['facts'] / result.seconds:,.0f} facts/s")
+    memory = f"Peak RSS grew by {rss_after - rss_before:.1f} MB; " if rss_before is not None else ''
+    click.echo(f"{memory}{result.counts['error']} error(s), {result.counts['warning']} warning(s).")
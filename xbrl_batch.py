@@ -0,0 +1,345 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import Counter, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from sqlalchemy import insert, select, update
+from main_app import db
+from models import XBRLReport, XBRLValidationBatch, XBRLValidationItem
+from xbrl import ValidationTimeout, failure_json, validate_file
+
+logger = logging.getLogger(__name__)
+
+# Pool settings; each can be overridden in app.config
+XBRL_BATCH_DEFAULTS = {
+    'XBRL_WORKERS': None,              # validator processes; None uses one per CPU core
+    'XBRL_FILE_TIMEOUT': 300,          # seconds one instance may take before it is given up on
+    'XBRL_POLL_INTERVAL': 5.0,         # seconds between queue checks when idle
+    'XBRL_CLAIM_TIMEOUT': 3600,        # seconds after which a 'Running' item from a dead process is requeued
+    'XBRL_VALIDATOR_AUTOSTART': True,  # start on the first request a process serves
+}
+
+_Task = namedtuple('_Task', ['item_id', 'batch_id', 'report_id', 'deadline', 'args'])
+_Outcome = namedtuple('_Outcome', ['task', 'valid', 'result_json', 'seconds', 'error'])
+
+
+class XBRLBatchValidator:
+    """Background validation of queued XBRL reports across a process pool.
+
+    Parsing is CPU-bound, so instances are validated in a
+    ProcessPoolExecutor with one process per core while a coordinator thread
+    in the app process claims queued items from the database, submits them
+    and writes each verdict back as soon as its file finishes. Items that
+    run past XBRL_FILE_TIMEOUT are marked Failed without blocking the rest of
+    the batch.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._executor = None
+        self._futures = {}
+        self._wake = threading.Event()
+        self._started = False
+        self._start_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['xbrl_validator'] = self
+        # Started by the first request a process serves, like the email dispatcher, so
+        # spawned pool workers and one-shot `flask` commands that import the app never coordinate
+        app.before_request(self._start_on_request)
+
+    def setting(self, key):
+        return self.app.config.get(key, XBRL_BATCH_DEFAULTS[key])
+
+    def _start_on_request(self):
+        # The setting is read per request, so it can still be switched off after init_app (tests)
+        if not self._started and self.setting('XBRL_VALIDATOR_AUTOSTART'):
+            self.start()
+
+    @property
+    def workers(self):
+        return self.setting('XBRL_WORKERS') or os.cpu_count() or 1
+
+    def start(self):
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._coordinate, name='xbrl-validator', daemon=True).start()
+
+    def wake(self):
+        """Pick up newly queued work now instead of at the next poll"""
+        self._wake.set()
+
+    def _pool(self):
+        if self._executor is None:
+            # Spawned rather than forked, so workers don't inherit this
+            # process's threads, locks and database connections
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def _submit(self, task):
+        try:
+            future = self._pool().submit(validate_file, *task.args)
+        except BrokenProcessPool:
+            self._executor = None
+            future = self._pool().submit(validate_file, *task.args)
+        self._futures[future] = task
+
+    def _restart_pool(self):
+        """Kill the pool's processes and rerun the tasks still in flight in a fresh pool.
+
+        cancel() can't stop a file that is already being validated, so a
+        worker stuck past its deadline would keep its process. Killing the
+        pool is the only way to get that process back. Tasks that finished
+        first, with a verdict or an error, are returned as outcomes; the
+        others start again with a new deadline.
+        """
+        in_flight, self._futures = self._futures, {}
+        # Taken before the kill, which fails every unfinished future with BrokenProcessPool
+        finished = {future for future in in_flight if future.done()}
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            if hasattr(executor, 'kill_workers'):  # Python 3.14+
+                executor.kill_workers()
+            else:
+                for process in list((executor._processes or {}).values()):
+                    process.kill()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        outcomes = [self._outcome(future, task) for future, task in in_flight.items() if future in finished]
+        deadline = time.monotonic() + self.setting('XBRL_FILE_TIMEOUT') + 30
+        for future, task in in_flight.items():
+            if future not in finished:
+                self._submit(task._replace(deadline=deadline))
+        if in_flight:
+            logger.warning("Restarted the XBRL pool; resubmitted %d validation(s)", len(self._futures))
+        return outcomes
+
+    # --- Coordinator ----------------------------------------------------------
+
+    def _coordinate(self):
+        with self.app.app_context():
+            self._requeue_stale()
+        while True:
+            try:
+                with self.app.app_context():
+                    outcomes = self._collect(timeout=0.5 if self._futures else 0)
+                    if outcomes:
+                        self._record(outcomes)
+
+                    claimed = 0
+                    if len(self._futures) < self.workers * 2:
+                        claimed = self._claim(self.workers * 2 - len(self._futures))
+                    if outcomes or claimed:
+                        self._finish_batches()
+
+                    if not claimed and not self._futures:
+                        if not self._wake.wait(self.setting('XBRL_POLL_INTERVAL')):
+                            self._requeue_stale()
+                            self._finish_batches()
+                        self._wake.clear()
+            except Exception:
+                logger.exception("XBRL validator cycle failed")
+                db.session.rollback()
+                time.sleep(self.setting('XBRL_POLL_INTERVAL'))
+
+    def _collect(self, timeout):
+        if not self._futures:
+            return []
+        done, _ = wait(self._futures, timeout=timeout, return_when=FIRST_COMPLETED)
+        outcomes = []
+        for future in done:
+            outcomes.append(self._outcome(future, self._futures.pop(future)))
+
+        # Backstop for platforms without SIGALRM, or a worker stuck outside Python code
+        now = time.monotonic()
+        expired = False
+        for future, task in list(self._futures.items()):
+            if now > task.deadline:
+                del self._futures[future]
+                outcomes.append(_Outcome(task, None, None, None, 'timeout'))
+                expired = True
+        if expired:
+            outcomes.extend(self._restart_pool())
+        return outcomes
+
+    def _outcome(self, future, task):
+        """The outcome of a finished future"""
+        try:
+            valid, result_json, _, seconds = future.result()
+        except ValidationTimeout:
+            return _Outcome(task, None, None, None, 'timeout')
+        except BrokenProcessPool:
+            self._executor = None
+            return _Outcome(task, None, None, None, 'crashed')
+        except Exception as e:
+            logger.exception("Validating XBRL report %s failed", task.report_id)
+            return _Outcome(task, None, None, None, str(e) or type(e).__name__)
+        return _Outcome(task, valid, result_json, seconds, None)
+
+    def _requeue_stale(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=self.setting('XBRL_CLAIM_TIMEOUT'))
+        result = db.session.execute(
+            update(XBRLValidationItem)
+            .where(XBRLValidationItem.status == 'Running', XBRLValidationItem.claimed_at < cutoff)
+            .values(status='Queued', claim_token=None)
+        )
+        db.session.commit()
+        if result.rowcount:
+            logger.warning("Requeued %d XBRL validations abandoned mid-run", result.rowcount)
+
+    def _claim(self, limit):
+        ids = db.session.scalars(
+            select(XBRLValidationItem.id)
+            .where(XBRLValidationItem.status == 'Queued')
+            .order_by(XBRLValidationItem.id)
+            .limit(limit)
+        ).all()
+        if not ids:
+            return 0
+
+        # The status guard makes the claim safe against other processes polling the same table
+        now = datetime.utcnow()
+        token = uuid.uuid4().hex
+        db.session.execute(
+            update(XBRLValidationItem)
+            .where(XBRLValidationItem.id.in_(ids), XBRLValidationItem.status == 'Queued')
+            .values(status='Running', claim_token=token, claimed_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        rows = db.session.execute(
+            select(XBRLValidationItem.id, XBRLValidationItem.batch_id, XBRLValidationItem.report_id,
+                   XBRLReport.xbrl_file_path, XBRLReport.report_type, XBRLReport.financial_year)
+            .join(XBRLReport, XBRLReport.id == XBRLValidationItem.report_id)
+            .where(XBRLValidationItem.claim_token == token)
+            .order_by(XBRLValidationItem.id)
+        ).all()
+        db.session.execute(
+            update(XBRLValidationBatch)
+            .where(XBRLValidationBatch.id.in_({row.batch_id for row in rows}),
+                   XBRLValidationBatch.status == 'Queued')
+            .values(status='Running', started_at=now)
+        )
+        db.session.commit()
+
+        timeout = self.setting('XBRL_FILE_TIMEOUT')
+        for row in rows:
+            path = os.path.join(self.app.root_path, row.xbrl_file_path or '')
+            self._submit(_Task(row.id, row.batch_id, row.report_id, time.monotonic() + timeout + 30,
+                               (path, row.report_type, row.financial_year, timeout)))
+        return len(rows)
+
+    def _record(self, outcomes):
+        now = datetime.utcnow()
+        timeout = self.setting('XBRL_FILE_TIMEOUT')
+        reports = {r.id: r for r in XBRLReport.query.filter(XBRLReport.id.in_({o.task.report_id for o in outcomes}))}
+        counts = Counter()
+        item_updates = []
+        for outcome in outcomes:
+            task = outcome.task
+            report = reports.get(task.report_id)
+            if outcome.error is None:
+                status = 'Valid' if outcome.valid else 'Invalid'
+                if report is not None:
+                    report.validation_status = status
+                    report.validation_errors = outcome.result_json
+                item_updates.append({'id': task.item_id, 'status': status, 'seconds': outcome.seconds,
+                                     'error': None, 'finished_at': now, 'claim_token': None})
+                counts[(task.batch_id, 'valid' if outcome.valid else 'invalid')] += 1
+                continue
+
+            if outcome.error == 'timeout':
+                error = f"Validation did not finish within {timeout} seconds"
+            elif outcome.error == 'crashed':
+                error = "The validator process stopped unexpectedly"
+            else:
+                error = outcome.error
+            if report is not None:
+                report.validation_errors = failure_json(outcome.error if outcome.error in ('timeout', 'crashed')
+                                                        else 'validator-error', error)
+            item_updates.append({'id': task.item_id, 'status': 'Failed', 'seconds': None,
+                                 'error': error[:500], 'finished_at': now, 'claim_token': None})
+            counts[(task.batch_id, 'failed')] += 1
+
+        db.session.execute(update(XBRLValidationItem), item_updates)
+        for (batch_id, field), count in counts.items():
+            column = getattr(XBRLValidationBatch, field)
+            db.session.execute(
+                update(XBRLValidationBatch).where(XBRLValidationBatch.id == batch_id).values({field: column + count})
+            )
+        db.session.commit()
+
+    def _finish_batches(self):
+        pending = select(XBRLValidationItem.id).where(
+            XBRLValidationItem.batch_id == XBRLValidationBatch.id,
+            XBRLValidationItem.status.in_(('Queued', 'Running')),
+        )
+        db.session.execute(
+            update(XBRLValidationBatch)
+            .where(XBRLValidationBatch.status.in_(('Queued', 'Running')), ~pending.exists())
+            .values(status='Completed', finished_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+
+
+validator = XBRLBatchValidator()
+
+
+def enqueue_validation(report_ids, user_id):
+    """Queue reports with an uploaded instance for background validation; returns the batch, or None.
+
+    Reports already waiting in another batch are left there.
+    """
+    busy = select(XBRLValidationItem.report_id).where(XBRLValidationItem.status.in_(('Queued', 'Running')))
+    ids = db.session.scalars(
+        select(XBRLReport.id)
+        .where(XBRLReport.id.in_(report_ids), XBRLReport.xbrl_file_path.isnot(None),
+               XBRLReport.id.not_in(busy))
+        .order_by(XBRLReport.id)
+    ).all()
+    if not ids:
+        return None
+
+    batch = XBRLValidationBatch(total=len(ids), created_by=user_id)
+    db.session.add(batch)
+    db.session.flush()
+    db.session.execute(insert(XBRLValidationItem), [{'batch_id': batch.id, 'report_id': i} for i in ids])
+    db.session.commit()
+    validator.wake()
+    return batch
+
+
+def validation_batch_progress(batch):
+    done = (batch.valid or 0) + (batch.invalid or 0) + (batch.failed or 0)
+    return {
+        'id': batch.id,
+        'status': batch.status,
+        'total': batch.total,
+        'valid': batch.valid,
+        'invalid': batch.invalid,
+        'failed': batch.failed,
+        'pending': max(batch.total - done, 0),
+        'percent': round(100 * done / batch.total) if batch.total else 100,
+        'created_at': batch.created_at.isoformat() if batch.created_at else None,
+        'finished_at': batch.finished_at.isoformat() if batch.finished_at else None,
+    }
+
+
+def queued_reports(report_ids):
+    """{report_id: 'Queued' | 'Running'} for the given reports that are waiting on the pool"""
+    rows = db.session.execute(
+        select(XBRLValidationItem.report_id, XBRLValidationItem.status)
+        .where(XBRLValidationItem.report_id.in_(report_ids),
+               XBRLValidationItem.status.in_(('Queued', 'Running')))
+    )
+    return {report_id: status for report_id, status in rows}